@@ -3,6 +3,17 @@ ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Run it with uvicorn, e.g.::
+
+    uvicorn backend.asgi:application --host 0.0.0.0 --port 8000 --workers 4
+
+This entry point turns on settings.ASYNC_VIEWS (unless POTTERY_ASYNC_VIEWS is
+already set), so media files and feed reads are served by native async views:
+a video stream to a slow client holds a descriptor and READ_AHEAD blocks
+(core.media_server), not a thread, and many streams share one worker. Other
+endpoints run as sync views in Django's thread pool, as under WSGI.
+``python -m benchmarks.concurrent_streams`` compares the two deployments.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
@@ -12,5 +23,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+os.environ.setdefault('POTTERY_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
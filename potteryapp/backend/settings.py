@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings include every other middleware
+    'core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,13 +83,39 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+# Applied to every new SQLite connection. WAL lets readers go on while a
+# write commits; synchronous=NORMAL only syncs at checkpoints in WAL mode
+# (a power cut can lose the last commits, never corrupt the file); mmap
+# serves reads from the page cache; busy_timeout is how long a writer waits
+# for the lock before "database is locked".
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    f'PRAGMA mmap_size={256 * 1024 ** 2}',
+    'PRAGMA busy_timeout=20000',
+]
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Threads keep their connection, pragmas applied, between requests
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(SQLITE_PRAGMAS),
+            # Transactions take the write lock when they begin, waiting up to
+            # busy_timeout for it. Deferred ones that read first fail at once
+            # when they try to write while another connection holds the lock
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
+# Commit small writes from concurrent requests (creating posts, listing on
+# the shelf) on one writer thread, several per transaction (core.writes)
+DB_WRITE_COALESCING = True
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -127,3 +156,72 @@ STATIC_URL = 'static/'
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Media post-processing (thumbnails etc.) runs in `manage.py run_media_worker`.
+# Set to True to run jobs in-process right after upload when no worker is running.
+MEDIA_JOBS_EAGER = False
+
+# Uploaded images are normalized by the media worker (core.media.normalize):
+# turned upright, capped at IMAGE_MAX_EDGE pixels on the long side and
+# stripped of metadata. Decodes over IMAGE_MAX_PIXELS are refused, which
+# bounds a worker thread's memory (about 3 bytes per pixel).
+IMAGE_MAX_EDGE = 2560
+IMAGE_MAX_PIXELS = 40_000_000
+# Keep each replaced upload as a cold copy under posts/originals/, which is
+# never served; off, the upload is deleted once nothing else references it
+IMAGE_KEEP_ORIGINALS = True
+
+# Serve media files and feed reads (GET /api/posts/, /api/posts/<id>/) with
+# native async views. backend/asgi.py turns this on for uvicorn; under WSGI
+# the sync views keep sendfile and it should stay off.
+ASYNC_VIEWS = os.environ.get('POTTERY_ASYNC_VIEWS') == '1'
+
+# Most images/videos in one post created through POST /api/posts/
+POST_MAX_MEDIA = 20
+# Threads storing the files of one multi-media upload in parallel
+UPLOAD_PROCESSING_THREADS = 4
+
+# Largest file accepted through the resumable upload API (/api/uploads/) or in POST /api/posts/
+UPLOAD_MAX_SIZE = 2 * 1024 ** 3
+# Largest single chunk PUT to an upload session
+UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 ** 2
+# Multipart files over FILE_UPLOAD_MAX_MEMORY_SIZE go to a temporary file,
+# hashed as they are written for content-addressed storage (core.storage)
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'core.storage.HashingFileUploadHandler',
+]
+
+# Requests slower than this many seconds are logged to 'core.slow_requests'
+# with the SQL they ran (core.middleware). None turns the log off.
+SLOW_REQUEST_SECONDS = None
+
+# The media worker (manage.py run_media_worker) writes its metrics here every
+# few seconds, one file per worker process, and /api/metrics/ adds them to the
+# web process's own. Files of stopped workers are kept so counters don't go
+# backwards; clear the directory when deploying.
+METRICS_EXPORT_DIR = BASE_DIR / 'metrics'
+
+# Caches
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+#
+# 'feed' holds serialized post fragments (core.feed_cache). LocMemCache is
+# per-process and evicts least-recently-used entries past MAX_ENTRIES. To share
+# fragments between workers, use FileBasedCache, e.g. on tmpfs for a
+# shared-memory cache:
+#     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#     'LOCATION': '/dev/shm/potteryapp-feed',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'feed': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'feed-fragments',
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        },
+    },
+}
+FEED_CACHE_ALIAS = 'feed'
@@ -15,30 +15,46 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
-from core.views import PostViewSet
+from core.media_server import aserve_media, serve_media
+from core.views import (
+    PostViewSet, ShelfViewSet, UploadSessionViewSet, metrics_view, post_detail_async, post_list_async,
+    with_async_reads,
+)
 
 # Create a router and register our viewsets
 router = DefaultRouter()
 router.register(r'posts', PostViewSet, basename='post')
+router.register(r'shelf', ShelfViewSet, basename='shelf')
+router.register(r'uploads', UploadSessionViewSet, basename='upload')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/metrics/', metrics_view, name='metrics'),
     path('api/', include(router.urls)),
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
 ]
 
-# Serve media files in development with proper headers for video streaming
-if settings.DEBUG:
-    from django.urls import re_path
-    from core.views import serve_media_with_range
-    
-    # Custom media serving to support range requests for videos
-    urlpatterns += [
-        re_path(r'^media/(?P<path>.*)$', serve_media_with_range),
-    ]
+if settings.ASYNC_VIEWS:
+    # Feed reads on native async views (see backend/asgi.py). Ahead of the
+    # router so they take its paths and names; writes still reach PostViewSet
+    urlpatterns = [
+        path('api/posts/', with_async_reads(
+            post_list_async, PostViewSet.as_view({'get': 'list', 'post': 'create'}),
+        ), name='post-list'),
+        re_path(r'^api/posts/(?P<pk>[0-9]+)/$', with_async_reads(
+            post_detail_async,
+            PostViewSet.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}),
+        ), name='post-detail'),
+    ] + urlpatterns
+
+# Serve media files (in production too) with range and conditional request
+# support, which AVPlayer needs for video streaming
+urlpatterns += [
+    re_path(rf'^{settings.MEDIA_URL.lstrip("/")}(?P<path>.*)$', aserve_media if settings.ASYNC_VIEWS else serve_media,
+            name='media'),
+]
@@ -0,0 +1,38 @@
+"""
+Performance benchmarks for the backend.
+
+Run from the ``potteryapp`` directory, e.g.::
+
+    python -m benchmarks.poster_frame
+
+Benchmarks print a plain-text table and are not part of ``manage.py test``.
+"""
+import os
+import statistics
+import time
+from typing import Callable
+
+
+def setup_django() -> None:
+    """Configure Django for benchmarks that touch models or views."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    import django
+    django.setup()
+
+
+def timeit(fn: Callable[[], object], repeat: int = 5) -> dict[str, float]:
+    """Run ``fn`` ``repeat`` times; return min/median/max wall time in seconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {'min': min(samples), 'median': statistics.median(samples), 'max': max(samples)}
+
+
+def print_table(rows: list[dict], columns: list[str]) -> None:
+    widths = {c: max(len(c), *(len(str(r.get(c, ''))) for r in rows)) for c in columns}
+    print('  '.join(c.ljust(widths[c]) for c in columns))
+    print('  '.join('-' * widths[c] for c in columns))
+    for row in rows:
+        print('  '.join(str(row.get(c, '')).ljust(widths[c]) for c in columns))
@@ -0,0 +1,105 @@
+"""
+Caption search: FTS5 index (core.search) vs icontains.
+
+    python -m benchmarks.caption_search [--posts 100000]
+
+Creates a throwaway test database with generated captions (the FTS triggers
+index them as they are inserted) and reports the median latency of fetching
+the top 20 matches for a few query shapes both ways.
+
+Caption words follow a Zipf distribution over pottery terms plus generated
+filler words, so queries range from very common to rare. icontains can stop
+after 20 rows when a term is common (and returns them unranked); FTS5 ranks
+every match, and wins by orders of magnitude as terms get rarer.
+"""
+import argparse
+import random
+
+from benchmarks import print_table, setup_django, timeit
+
+WORDS = (
+    'bowl mug vase plate teapot jar pitcher platter cup tumbler planter lidded '
+    'celadon shino tenmoku ash crawl crackle matte gloss speckled glaze slip '
+    'stoneware porcelain earthenware terracotta raku wheel thrown handbuilt '
+    'trimmed carved fluted altered wood soda fired reduction oxidation cone '
+    'blue green white black rust amber tall squat wide small large first'
+).split()
+FILLER_WORDS = 20_000
+SYLLABLES = 'ka ri to mo sa ne lu pi da go ve shi ra no ku me'.split()
+BATCH = 5000
+
+
+def vocabulary(rng: random.Random) -> tuple[list[str], list[float]]:
+    words = list(WORDS)
+    seen = set(words)
+    while len(words) < len(WORDS) + FILLER_WORDS:
+        word = ''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    # Zipf: the n-th most common word is n times rarer than the first
+    return words, [1 / rank for rank in range(1, len(words) + 1)]
+
+
+def populate(count: int) -> None:
+    from django.contrib.auth import get_user_model
+    from core.models import Post
+
+    rng = random.Random(0)
+    words, weights = vocabulary(rng)
+    users = [get_user_model().objects.create(username=f'potter{i}') for i in range(50)]
+    for start in range(0, count, BATCH):
+        Post.objects.bulk_create(
+            Post(creator=rng.choice(users), caption=' '.join(rng.choices(words, weights, k=rng.randint(4, 14))))
+            for _ in range(start, min(count, start + BATCH))
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+    from django.db.models import Q
+    from core.models import Post
+    from django.db.models.expressions import RawSQL
+    from core.search import match_expression, search_posts
+
+    def icontains(query: str) -> list:
+        condition = Q()
+        for term in query.split():
+            condition &= Q(caption__icontains=term) | Q(creator__username__icontains=term)
+        return list(Post.objects.filter(condition).order_by('-created_at', '-id').values_list('id', flat=True)[:20])
+
+    # Most to least common: top word, mid-frequency, two-word, username + word, rare, absent
+    queries = ['bowl', 'porc', 'tenmoku fluted', 'potter7 raku', 'amber lidded crawl', 'nomatchword']
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    rows = []
+    try:
+        populate(args.posts)
+        for query in queries:
+            like = timeit(lambda: icontains(query), args.repeat)
+            fts = timeit(lambda: search_posts(query), args.repeat)
+            rows.append({
+                'query': query,
+                'matches': Post.objects.filter(pk__in=RawSQL(
+                    'SELECT rowid FROM core_post_fts WHERE core_post_fts MATCH %s', [match_expression(query)]
+                )).count(),
+                'icontains ms': f"{like['median'] * 1000:.2f}",
+                'fts5 ms': f"{fts['median'] * 1000:.2f}",
+                'speedup': f"{like['median'] / fts['median']:.1f}x",
+            })
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    print(f'{args.posts} posts, top 20 results, median of {args.repeat} runs')
+    print_table(rows, ['query', 'matches', 'icontains ms', 'fts5 ms', 'speedup'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+Concurrent video streams a single server worker sustains: ASGI vs WSGI.
+
+    python -m benchmarks.concurrent_streams [--streams 200] [--threads 16] [--duration 5]
+
+Starts each deployment as a real server on localhost and opens ``--streams``
+connections that each GET the same video and read it at ``--read-kbps``, as
+phones on slow networks do. Once they are running, a probe requests a feed
+page. Reported per server:
+
+- streams that got their first body bytes, and their median time to first byte;
+- feed probe latency while the streams are open;
+- server RSS, which shows bodies buffered in memory.
+
+Deployments (one worker process each):
+
+- ``uvicorn``: backend.asgi with the async views (settings.ASYNC_VIEWS);
+- ``uvicorn-sync``: backend.asgi with the sync views, which Django buffers in
+  full before sending under ASGI;
+- ``gunicorn``: backend.wsgi on gthread workers with ``--threads`` threads and
+  sendfile. Needs gunicorn installed (``pip install gunicorn``).
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks import print_table, setup_django
+
+MIB = 2 ** 20
+# Client receive buffer, small so a slow reader pushes back on the server as on a phone
+RECEIVE_BUFFER = 64 * 1024
+READ_SIZE = 16 * 1024
+
+
+def server_command(name: str, port: int, threads: int) -> tuple[list[str], dict]:
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'backend.settings'}
+    if name == 'gunicorn':
+        return [sys.executable, '-m', 'gunicorn', 'backend.wsgi:application', '-k', 'gthread', '--workers', '1',
+                '--threads', str(threads), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'], env
+    env['POTTERY_ASYNC_VIEWS'] = '0' if name == 'uvicorn-sync' else '1'
+    return [sys.executable, '-m', 'uvicorn', 'backend.asgi:application', '--port', str(port),
+            '--workers', '1', '--log-level', 'warning', '--no-access-log'], env
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_listening(port: int, timeout: float = 20) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Server on port {port} did not start')
+
+
+def rss_bytes(pid: int) -> int:
+    """Resident memory of ``pid`` and its children (gunicorn's worker), Linux only."""
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                total += next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pids.extend(int(child) for child in f.read().split())
+        except (OSError, StopIteration):
+            pass
+    return total
+
+
+async def connect(port: int) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', port))
+    return await asyncio.open_connection(sock=sock)
+
+
+async def get(port: int, path: str) -> tuple[asyncio.StreamReader, asyncio.StreamWriter, bytes]:
+    reader, writer = await connect(port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n'.encode())
+    head = await reader.readuntil(b'\r\n\r\n')
+    return reader, writer, head
+
+
+async def slow_stream(port: int, path: str, read_kbps: int, stop: asyncio.Event) -> float | None:
+    """Time to first body byte, or None if the stream never started before ``stop``."""
+    started = time.perf_counter()
+    writer = None
+    try:
+        async def first_bytes():
+            nonlocal writer
+            reader, writer, _ = await get(port, path)
+            await reader.readexactly(1)
+            return reader
+        first = asyncio.ensure_future(first_bytes())
+        stopped = asyncio.ensure_future(stop.wait())
+        await asyncio.wait([first, stopped], return_when=asyncio.FIRST_COMPLETED)
+        if not first.done():
+            first.cancel()
+            return None
+        stopped.cancel()
+        reader, ttfb = first.result(), time.perf_counter() - started
+        interval = READ_SIZE / (read_kbps * 1024)
+        while not stop.is_set():
+            await asyncio.sleep(interval)
+            if not await reader.read(READ_SIZE):
+                break
+        return ttfb
+    except (OSError, asyncio.IncompleteReadError):
+        return None
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def probe(port: int, path: str, timeout: float) -> float | None:
+    started = time.perf_counter()
+    try:
+        async with asyncio.timeout(timeout):
+            reader, writer, _ = await get(port, path)
+            await reader.read()
+            writer.close()
+    except (OSError, TimeoutError, asyncio.IncompleteReadError):
+        return None
+    return time.perf_counter() - started
+
+
+async def load(port: int, video_path: str, args) -> dict:
+    stop = asyncio.Event()
+    streams = [asyncio.ensure_future(slow_stream(port, video_path, args.read_kbps, stop))
+               for _ in range(args.streams)]
+    # Let every stream connect and the server settle before probing
+    await asyncio.sleep(1)
+    probe_seconds = await probe(port, '/api/posts/?page_size=20', args.duration)
+    await asyncio.sleep(max(0.0, args.duration - 1 - (probe_seconds or args.duration)))
+    stop.set()
+    ttfbs = [ttfb for ttfb in await asyncio.gather(*streams) if ttfb is not None]
+    return {'started': len(ttfbs), 'ttfb': statistics.median(ttfbs) if ttfbs else None, 'probe': probe_seconds}
+
+
+def run_server(name: str, video_path: str, args) -> dict:
+    port = free_port()
+    command, env = server_command(name, port, args.threads)
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, start_new_session=True)
+    try:
+        wait_until_listening(port)
+        result = asyncio.run(load(port, video_path, args))
+        result['rss'] = rss_bytes(server.pid)
+        return result
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait(timeout=20)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, default=200, help='Concurrent slow video clients')
+    parser.add_argument('--threads', type=int, default=16, help='gthread threads of the WSGI worker')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds the streams stay open')
+    parser.add_argument('--read-kbps', type=int, default=256, help='Read rate of each client, KiB/s')
+    parser.add_argument('--size-mb', type=int, default=32, help='Size of the streamed video')
+    parser.add_argument('--servers', default='uvicorn,uvicorn-sync,gunicorn')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    directory = os.path.join(settings.MEDIA_ROOT, 'benchmarks')
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'stream.mov'), 'wb') as f:
+        f.write(os.urandom(args.size_mb * MIB))
+
+    rows = []
+    try:
+        for name in args.servers.split(','):
+            if importlib.util.find_spec(name.split('-')[0]) is None:
+                print(f'{name.split("-")[0]} is not installed; skipping {name}')
+                continue
+            result = run_server(name, f'{settings.MEDIA_URL}benchmarks/stream.mov', args)
+            rows.append({
+                'server': name,
+                'streams started': f"{result['started']}/{args.streams}",
+                'median ttfb ms': f"{result['ttfb'] * 1000:.0f}" if result['ttfb'] is not None else '-',
+                'feed probe ms': f"{result['probe'] * 1000:.0f}" if result['probe'] is not None else 'timed out',
+                'server RSS MiB': f"{result['rss'] / MIB:.0f}",
+            })
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    print(f'{args.streams} clients reading a {args.size_mb} MiB video at {args.read_kbps} KiB/s '
+          f'for {args.duration:.0f}s; gunicorn with {args.threads} threads')
+    print_table(rows, ['server', 'streams started', 'median ttfb ms', 'feed probe ms', 'server RSS MiB'])
+
+
+if __name__ == '__main__':
+    main()
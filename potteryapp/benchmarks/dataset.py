@@ -0,0 +1,295 @@
+"""
+Synthetic dataset for load tests: users, posts with media and sale items.
+
+    python -m benchmarks.dataset --posts 100000 --database /tmp/bench.sqlite3
+
+Fills an empty, freshly migrated SQLite database with ``--posts`` posts (1k
+to 1M) spread over the past year, written with bulk_create in transactions
+of CHUNK posts. Every post has one to three media, about one in five a
+video; images carry the full rendition ladder and about a third of posts are
+on the shelf. Media point at a handful of tiny generated JPEG and MP4
+fixtures stored once in the database's own media directory, as identical
+uploads share one content-addressed file. Processing is skipped: rows are
+written as the media worker leaves them, with metadata and placeholders
+probed from the fixtures, and MediaBlob reference counts to match.
+
+bulk_create skips save() and signals, so no jobs are queued and the feed
+fragment cache starts cold. The same database can be reused by
+``benchmarks.load_test --database``.
+"""
+import argparse
+import os
+import random
+import shutil
+import struct
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import timedelta
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from benchmarks import setup_django
+from benchmarks.caption_search import WORDS
+
+# Posts per transaction, and rows per INSERT
+CHUNK = 10_000
+BATCH = 2_000
+IMAGE_FIXTURES = 12
+VIDEO_FIXTURES = 3
+VIDEO_SHARE = 0.2
+MEDIA_PER_POST = (1, 1, 1, 2, 2, 3)
+SALE_SHARE = 0.35
+SOLD_SHARE = 0.15
+POSTS_PER_USER = 50
+SPAN = timedelta(days=365)
+
+
+@dataclass
+class Fixture:
+    """A stored media file and the PostMedia field values of a row pointing at it."""
+    media_type: str
+    fields: dict
+    data: bytes
+    # (format, width, height, storage name) per rendition rung
+    renditions: list[tuple[str, int, int, str]] = field(default_factory=list)
+
+
+def photo_bytes(rng: np.random.Generator, size: tuple[int, int], fmt: str = 'JPEG') -> bytes:
+    """A small smooth image with grain, so encoders have something to do."""
+    width, height = size
+    coarse = rng.integers(0, 256, (4, 4, 3), dtype=np.uint8)
+    pixels = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC).astype(np.int16)
+    pixels += rng.integers(-6, 7, pixels.shape, dtype=np.int16)
+    buffer = BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format=fmt, quality=85)
+    return buffer.getvalue()
+
+
+def free_box(payload: bytes) -> bytes:
+    """An MP4 ``free`` box: players skip it, so appending one keeps a file valid."""
+    return struct.pack('>I4s', 8 + len(payload), b'free') + payload
+
+
+def mp4_bytes(rng: np.random.Generator, size: tuple[int, int] = (64, 48), frames: int = 24,
+              pad: int = 0) -> bytes:
+    """A tiny faststart MPEG-4 clip fading between two colors, padded to at least ``pad`` bytes."""
+    from core.faststart import make_faststart
+
+    width, height = size
+    start, end = rng.integers(0, 256, (2, 3))
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'clip.mp4')
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 12.0, size)
+        for i in range(frames):
+            color = start + (end - start) * i / max(frames - 1, 1)
+            writer.write(np.full((height, width, 3), color, dtype=np.uint8))
+        writer.release()
+        with open(path + '.faststart', 'wb') as dst:
+            written = make_faststart(path, dst)
+        with open(path + '.faststart' if written else path, 'rb') as f:
+            data = f.read()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    if len(data) < pad:
+        data += free_box(rng.bytes(max(0, pad - len(data) - 8)))
+    return data
+
+
+def store_fixture(media_type: str, data: bytes, ext: str, poster: bytes | None = None) -> Fixture:
+    """Store ``data`` (and a video's poster as its thumbnail) and probe it as the media worker would."""
+    from django.core.files.base import ContentFile
+    from core.media import metadata, placeholders
+    from core.models import PostMedia
+    from core.storage import MEDIA_DIR, THUMBNAIL_DIR, media_storage
+
+    storage = media_storage()
+    name = storage.save(f'{MEDIA_DIR}fixture{ext}', ContentFile(data))
+    is_video = media_type == PostMedia.MEDIA_TYPE_VIDEO
+    fields = {'file': name, 'status': PostMedia.STATUS_READY, 'original_size': len(data),
+              **metadata.probe(storage.path(name), name, is_video)}
+    if is_video:
+        fields['thumbnail'] = storage.save(f'{THUMBNAIL_DIR}poster.jpg', ContentFile(poster))
+        fields['is_faststart'] = True
+    with Image.open(BytesIO(poster or data)) as image:
+        fields.update(placeholders.placeholder(image.convert('RGB')))
+    return Fixture(media_type, fields, data)
+
+
+def make_fixtures(seed: int = 0, video_kb: int = 1024) -> dict[str, list[Fixture]]:
+    """
+    IMAGE_FIXTURES photos with a rendition file per format, and
+    VIDEO_FIXTURES clips padded to ``video_kb`` so ranged reads can seek.
+    """
+    from django.core.files.base import ContentFile
+    from core.models import PostMedia
+    from core.renditions import FORMAT_JPEG, FORMAT_WEBP, WIDTHS
+    from core.storage import media_storage
+
+    storage = media_storage()
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(IMAGE_FIXTURES):
+        fixture = store_fixture(PostMedia.MEDIA_TYPE_IMAGE, photo_bytes(rng, (96, 72)), '.jpg')
+        # One small file per format stands in for every rung; only the rows' widths differ
+        for fmt, pil_format in ((FORMAT_WEBP, 'WEBP'), (FORMAT_JPEG, 'JPEG')):
+            name = storage.save(f'posts/renditions/rung.{fmt}', ContentFile(photo_bytes(rng, (48, 36), pil_format)))
+            fixture.renditions += [(fmt, width, width * 3 // 4, name) for width in WIDTHS]
+        images.append(fixture)
+    videos = [
+        store_fixture(PostMedia.MEDIA_TYPE_VIDEO, mp4_bytes(rng, pad=video_kb * 1024), '.mp4',
+                      poster=photo_bytes(rng, (64, 48)))
+        for _ in range(VIDEO_FIXTURES)
+    ]
+    return {PostMedia.MEDIA_TYPE_IMAGE: images, PostMedia.MEDIA_TYPE_VIDEO: videos}
+
+
+@contextmanager
+def explicit_timestamps(*model_fields):
+    """Let bulk_create keep the values given to these auto_now_add fields."""
+    for model_field in model_fields:
+        model_field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for model_field in model_fields:
+            model_field.auto_now_add = True
+
+
+def generate(posts: int, *, seed: int = 0, video_kb: int = 1024, renditions: bool = True,
+             progress=None) -> dict[str, int]:
+    """
+    Write ``posts`` posts with their users, media, renditions and sale items
+    into the default database; returns row counts per model. ``progress`` is
+    called with the number of posts written after every chunk.
+    """
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+    from django.db import transaction
+    from django.utils import timezone
+    from core.models import MediaBlob, MediaRendition, Post, PostMedia, SaleItem
+
+    rng = random.Random(seed)
+    fixtures = make_fixtures(seed, video_kb)
+    references = Counter()
+    counts = Counter()
+
+    password = make_password(None)
+    users = get_user_model().objects.bulk_create(
+        (get_user_model()(username=f'potter{i:06d}', password=password)
+         for i in range(max(1, posts // POSTS_PER_USER))),
+        batch_size=BATCH,
+    )
+    user_ids = [user.pk for user in users]
+    counts['users'] = len(user_ids)
+
+    start = timezone.now() - SPAN
+    step = SPAN / max(posts, 1)
+    with explicit_timestamps(Post._meta.get_field('created_at'), PostMedia._meta.get_field('created_at')):
+        for chunk_start in range(0, posts, CHUNK):
+            with transaction.atomic():
+                created = [start + step * i for i in range(chunk_start, min(posts, chunk_start + CHUNK))]
+                batch = Post.objects.bulk_create(
+                    (Post(creator_id=rng.choice(user_ids), created_at=at, updated_at=at,
+                          caption=' '.join(rng.choices(WORDS, k=rng.randint(3, 12)))) for at in created),
+                    batch_size=BATCH,
+                )
+                media, used = [], []
+                for post in batch:
+                    for order in range(rng.choice(MEDIA_PER_POST)):
+                        kind = PostMedia.MEDIA_TYPE_VIDEO if rng.random() < VIDEO_SHARE else PostMedia.MEDIA_TYPE_IMAGE
+                        fixture = rng.choice(fixtures[kind])
+                        media.append(PostMedia(post=post, media_type=kind, order=order,
+                                               created_at=post.created_at, **fixture.fields))
+                        used.append(fixture)
+                media = PostMedia.objects.bulk_create(media, batch_size=BATCH)
+                if renditions:
+                    MediaRendition.objects.bulk_create(
+                        (MediaRendition(media=item, format=fmt, width=width, height=height, file=name)
+                         for item, fixture in zip(media, used) for fmt, width, height, name in fixture.renditions),
+                        batch_size=BATCH,
+                    )
+                sale_items = SaleItem.objects.bulk_create(
+                    (SaleItem(post=post, post_created_at=post.created_at, is_sold=rng.random() < SOLD_SHARE,
+                              price=f'{rng.randint(8, 400)}.{rng.choice(("00", "50", "95"))}')
+                     for post in batch if rng.random() < SALE_SHARE),
+                    batch_size=BATCH,
+                )
+            for fixture in used:
+                references[fixture.fields['file']] += 1
+                if fixture.fields.get('thumbnail'):
+                    references[fixture.fields['thumbnail']] += 1
+                if renditions:
+                    references.update(name for _, _, _, name in fixture.renditions)
+            counts['posts'] += len(batch)
+            counts['media'] += len(media)
+            counts['renditions'] += sum(len(fixture.renditions) for fixture in used) if renditions else 0
+            counts['sale items'] += len(sale_items)
+            if progress is not None:
+                progress(counts['posts'])
+
+    from core.storage import media_storage
+    storage = media_storage()
+    MediaBlob.objects.bulk_create(
+        MediaBlob(name=name, size=storage.size(name), refcount=refcount) for name, refcount in references.items()
+    )
+    return dict(counts)
+
+
+@contextmanager
+def bench_database(path: str | None = None):
+    """
+    Point the default database at the SQLite file ``path``, migrated, with
+    MEDIA_ROOT in a directory next to it; a throwaway one when None, removed
+    on exit. Must be entered before anything opens a connection.
+    """
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test import override_settings
+
+    directory = tempfile.mkdtemp() if path is None else None
+    path = path or os.path.join(directory, 'db.sqlite3')
+    old_name = connection.settings_dict['NAME']
+    connection.close()
+    connection.settings_dict['NAME'] = path
+    try:
+        with override_settings(MEDIA_ROOT=f'{path}.media'):
+            call_command('migrate', verbosity=0)
+            yield path
+    finally:
+        connection.close()
+        connection.settings_dict['NAME'] = old_name
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, default=10_000, help='Posts to generate, 1k to 1M')
+    parser.add_argument('--database', required=True, help='SQLite file to create; media go in <file>.media/')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--video-kb', type=int, default=1024, help='Size of each video fixture')
+    parser.add_argument('--renditions', action=argparse.BooleanOptionalAction, default=True,
+                        help='Write the rendition ladder of every image')
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        parser.error(f'{args.database} already exists')
+    setup_django()
+    with bench_database(args.database):
+        started = time.perf_counter()
+        counts = generate(args.posts, seed=args.seed, video_kb=args.video_kb, renditions=args.renditions,
+                          progress=lambda done: print(f'\r{done}/{args.posts} posts', end='', flush=True))
+        elapsed = time.perf_counter() - started
+    print(f'\n{", ".join(f"{count} {name}" for name, count in counts.items())} in {elapsed:.1f}s '
+          f'({sum(counts.values()) / elapsed:.0f} rows/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Feed rendering throughput: PostSerializer vs the core.feed_render fast path.
+
+    python -m benchmarks.feed_serialization [--sizes 100,1000,10000]
+
+Creates a throwaway test database, fills it with posts (each with two media
+items, every third one for sale) and reports posts/sec for rendering the whole
+set to JSON both ways. The fragment cache is not involved: this measures the
+cost of a cache miss.
+"""
+import argparse
+
+from benchmarks import print_table, setup_django, timeit
+
+
+def populate(count: int) -> None:
+    from django.contrib.auth import get_user_model
+    from core.models import Post, PostMedia, SaleItem
+
+    Post.objects.all().delete()
+    user, _ = get_user_model().objects.get_or_create(username='bench')
+    # bulk_create skips save(), so no processing jobs are queued
+    posts = Post.objects.bulk_create(Post(creator=user, caption=f'Bench post {i}') for i in range(count))
+    PostMedia.objects.bulk_create(
+        PostMedia(post=post, media_type=PostMedia.MEDIA_TYPE_IMAGE, order=order,
+                  file=f'posts/media/bench_{post.pk}_{order}.jpg',
+                  thumbnail=f'posts/thumbnails/bench_{post.pk}_{order}.jpg')
+        for post in posts for order in range(2)
+    )
+    SaleItem.objects.bulk_create(SaleItem(post=post, price='42.50', post_created_at=post.created_at) for post in posts[::3])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100,1000,10000')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.test import APIRequestFactory
+    from core import feed_render
+    from core.models import Post
+    from core.serializers import PostSerializer
+
+    request = APIRequestFactory().get('/api/posts/', HTTP_HOST='localhost:8000')
+    renderer = JSONRenderer()
+
+    def drf() -> bytes:
+        posts = Post.objects.select_related('creator', 'saleitem').prefetch_related('media').order_by('-created_at', '-id')
+        return renderer.render(PostSerializer(posts, many=True, context={'request': request}).data)
+
+    def fast() -> bytes:
+        rows = list(feed_render.post_rows(Post.objects.order_by('-created_at', '-id')))
+        return renderer.render(feed_render.render_posts(rows, request))
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    rows = []
+    try:
+        for count in (int(size) for size in args.sizes.split(',')):
+            populate(count)
+            assert drf() == fast(), 'fast path output differs from PostSerializer'
+            for name, fn in (('PostSerializer', drf), ('feed_render', fast)):
+                timing = timeit(fn, args.repeat)
+                rows.append({
+                    'posts': count,
+                    'renderer': name,
+                    'median ms': f"{timing['median'] * 1000:.1f}",
+                    'posts/sec': f"{count / timing['median']:.0f}",
+                    'JSON KiB': f'{len(fn()) / 1024:.0f}',
+                })
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    print(f'{args.repeat} runs each, 2 media per post, cold fragment cache')
+    print_table(rows, ['posts', 'renderer', 'median ms', 'posts/sec', 'JSON KiB'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""
+End-to-end load test: latency percentiles, throughput and SQL per request.
+
+    python -m benchmarks.load_test [--posts 10000] [--concurrency 8] [--requests 300]
+                                   [--database bench.sqlite3] [--output results.json]
+                                   [--baseline benchmarks/baselines/load_test.json] [--save-baseline] [--check]
+
+Fills a throwaway SQLite database with benchmarks.dataset (or reuses the one
+given with ``--database`` if it already has posts), then runs each scenario
+in turn: ``--concurrency`` threads, each with its own client and database
+connection, issue requests back to back until ``--requests`` are done. A few
+warm-up requests per thread are not counted. Scenarios:
+
+- ``feed``: a page of GET /api/posts/?page_size=20, from the first FEED_PAGES;
+- ``create_image`` / ``create_video``: POST /api/posts/ with a tiny JPEG or
+  MP4 made unique per request, so storage never deduplicates it;
+- ``list_on_shelf``: POST /api/posts/<id>/list_on_shelf/ for a random post;
+- ``media_range``: a RANGE_BYTES ranged GET at a random offset of a video.
+
+Requests go through Django's full handler and middleware in-process (no
+socket; see benchmarks.concurrent_streams for real servers), with DEBUG off
+and media jobs queued rather than run. Each thread keeps its connection
+between requests. Reported per scenario: p50/p95/p99 latency, requests per
+second across all threads, and SQL statements per request (mean and max),
+counted with core.middleware's QueryRecorder.
+
+``--output`` writes the results as JSON. They are compared with
+``--baseline`` when that file exists: a scenario regresses when its p95 or
+throughput is more than ``--tolerance`` worse, or it runs more queries or
+fails more requests. ``--check`` exits with status 1 on any regression;
+``--save-baseline`` replaces the baseline with this run. Timings only
+compare on the same machine with the same options; query counts compare
+anywhere.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable
+from urllib.parse import urlsplit
+
+from benchmarks import print_table, setup_django
+from benchmarks import dataset
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baselines', 'load_test.json')
+FEED_PAGE_SIZE = 20
+FEED_PAGES = 10
+RANGE_BYTES = 64 * 1024
+SCENARIOS = ('feed', 'create_image', 'create_video', 'list_on_shelf', 'media_range')
+# Compared with the baseline: (key, higher is better)
+COMPARED = (('p95_ms', False), ('throughput_rps', True))
+# Mean queries per request may vary this much (feed cache hits) before it counts
+QUERY_SLACK = 0.5
+
+
+@dataclass
+class Scenario:
+    name: str
+    # Issues one request; each thread has its own client and random generator
+    run: Callable[[object, random.Random], object]
+
+
+def client():
+    from rest_framework.test import APIClient
+    # Failures come back as 500 responses and are counted, not raised
+    return APIClient(HTTP_HOST='localhost', raise_request_exception=False)
+
+
+def build_scenarios(seed: int = 0) -> dict[str, Scenario]:
+    """The scenarios, with what they need looked up once from the database."""
+    import numpy as np
+    from django.conf import settings
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.db.models import Max, Min
+    from core.models import Post, PostMedia
+
+    post_ids = Post.objects.aggregate(low=Min('id'), high=Max('id'))
+    # Uploads from an earlier run on a reused --database have no size until the media worker runs
+    videos = [
+        (name, size) for name, size in
+        PostMedia.objects.filter(media_type=PostMedia.MEDIA_TYPE_VIDEO, file_size__isnull=False)
+        .values_list('file', 'file_size').distinct()
+    ]
+    feed_pages = [f'/api/posts/?page_size={FEED_PAGE_SIZE}']
+    browser = client()
+    while len(feed_pages) < FEED_PAGES:
+        next_url = browser.get(feed_pages[-1]).json()['next']
+        if next_url is None:
+            break
+        url = urlsplit(next_url)
+        feed_pages.append(f'{url.path}?{url.query}')
+
+    rng = np.random.default_rng(seed)
+    image = dataset.photo_bytes(rng, (96, 72))
+    video = dataset.mp4_bytes(rng)
+
+    def feed(client, rng):
+        return client.get(rng.choice(feed_pages))
+
+    def create_image(client, rng):
+        # JPEG decoders stop at the end-of-image marker, so trailing bytes only change the digest
+        upload = SimpleUploadedFile('pot.jpg', image + rng.randbytes(16), content_type='image/jpeg')
+        return client.post('/api/posts/', {'caption': 'load test', 'image': upload}, format='multipart')
+
+    def create_video(client, rng):
+        upload = SimpleUploadedFile('throw.mp4', video + dataset.free_box(rng.randbytes(16)), content_type='video/mp4')
+        return client.post('/api/posts/', {'caption': 'load test', 'video': upload}, format='multipart')
+
+    def list_on_shelf(client, rng):
+        post_id = rng.randint(post_ids['low'], post_ids['high'])
+        price = f'{rng.randint(8, 400)}.00'
+        return client.post(f'/api/posts/{post_id}/list_on_shelf/', {'price': price}, format='json')
+
+    def media_range(client, rng):
+        name, size = rng.choice(videos)
+        start = rng.randrange(max(1, size - RANGE_BYTES))
+        return client.get(f'{settings.MEDIA_URL}{name}', HTTP_RANGE=f'bytes={start}-{start + RANGE_BYTES - 1}')
+
+    return {fn.__name__: Scenario(fn.__name__, fn)
+            for fn in (feed, create_image, create_video, list_on_shelf, media_range)}
+
+
+def issue(scenario: Scenario, client, rng: random.Random):
+    response = scenario.run(client, rng)
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+def drive(scenario: Scenario, concurrency: int, requests: int, warmup: int) -> dict:
+    """Run ``requests`` of ``scenario`` on ``concurrency`` threads; returns its summary."""
+    from django.db import connection
+    from core.middleware import QueryRecorder
+
+    # next() on a shared count is atomic under the GIL
+    numbers = itertools.count()
+    start = threading.Barrier(concurrency + 1)
+    samples: list[tuple[float, int, int]] = []
+    errors = Counter()
+
+    def worker(index: int) -> None:
+        rng = random.Random(index)
+        browser = client()
+        mine = []
+        try:
+            try:
+                for _ in range(warmup):
+                    issue(scenario, browser, rng)
+            except BaseException:
+                # Don't leave the other threads waiting for this one
+                start.abort()
+                raise
+            start.wait()
+            while next(numbers) < requests:
+                recorder = QueryRecorder(keep_sql=False)
+                began = time.perf_counter()
+                with connection.execute_wrapper(recorder):
+                    response = issue(scenario, browser, rng)
+                mine.append((time.perf_counter() - began, recorder.count, response.status_code))
+                if response.status_code >= 400:
+                    exc_info = getattr(response, 'exc_info', None)
+                    errors[f'{exc_info[0].__name__}: {exc_info[1]}' if exc_info else f'HTTP {response.status_code}'] += 1
+        finally:
+            connection.close()
+            samples.extend(mine)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return summarize(samples, time.perf_counter() - began, errors)
+
+
+def percentile(quantiles: list[float], p: int) -> float:
+    return quantiles[p - 1] * 1000
+
+
+def summarize(samples: list[tuple[float, int, int]], wall: float, errors: Counter) -> dict:
+    latencies = sorted(seconds for seconds, _, _ in samples)
+    queries = [count for _, count, _ in samples]
+    quantiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(samples),
+        'errors': sum(errors.values()),
+        'p50_ms': round(percentile(quantiles, 50), 2),
+        'p95_ms': round(percentile(quantiles, 95), 2),
+        'p99_ms': round(percentile(quantiles, 99), 2),
+        'throughput_rps': round(len(samples) / wall, 1),
+        'queries_per_request': round(statistics.fmean(queries), 2),
+        'max_queries': max(queries),
+        'top_error': errors.most_common(1)[0][0][:200] if errors else None,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> tuple[list[dict], int]:
+    """Table rows comparing each scenario with the baseline, and how many regressed."""
+    rows, regressions = [], 0
+    for name, current in results['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            rows.append({'scenario': name, 'verdict': 'new'})
+            continue
+        problems = []
+        row = {'scenario': name}
+        for key, higher_is_better in COMPARED:
+            change = current[key] / before[key] - 1 if before[key] else 0.0
+            row[key] = f'{before[key]} -> {current[key]} ({change:+.0%})'
+            if (-change if higher_is_better else change) > tolerance:
+                problems.append(key.split('_')[0])
+        row['queries'] = f"{before['queries_per_request']} -> {current['queries_per_request']}"
+        if current['queries_per_request'] > before['queries_per_request'] + QUERY_SLACK:
+            problems.append('queries')
+        if current['errors'] > before['errors']:
+            problems.append('errors')
+        row['verdict'] = 'REGRESSED: ' + ', '.join(problems) if problems else 'ok'
+        regressions += bool(problems)
+        rows.append(row)
+    return rows, regressions
+
+
+def run(args) -> dict:
+    from django.test import override_settings
+    from core.models import Post
+
+    config = {
+        'posts': args.posts, 'concurrency': args.concurrency, 'requests': args.requests, 'warmup': args.warmup,
+        'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version, 'machine': platform.machine(),
+    }
+    # Failed requests are counted; their tracebacks would bury the report
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    with dataset.bench_database(args.database), override_settings(DEBUG=False, MEDIA_JOBS_EAGER=False):
+        existing = Post.objects.count()
+        if existing:
+            print(f'Reusing {existing} posts in {args.database}')
+            config['posts'] = existing
+        else:
+            started = time.perf_counter()
+            counts = dataset.generate(args.posts, seed=args.seed)
+            print(f'Generated {", ".join(f"{count} {name}" for name, count in counts.items())} '
+                  f'in {time.perf_counter() - started:.1f}s')
+        scenarios = build_scenarios(args.seed)
+        results = {'config': config, 'scenarios': {}}
+        for name in args.scenarios.split(','):
+            results['scenarios'][name] = drive(scenarios[name], args.concurrency, args.requests, args.warmup)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, default=10_000, help='Posts to generate, 1k to 1M')
+    parser.add_argument('--database', help='SQLite file to use, generated into when it has no posts')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=300, help='Requests per scenario')
+    parser.add_argument('--warmup', type=int, default=3, help='Uncounted requests per thread')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results here as JSON')
+    parser.add_argument('--baseline', default=BASELINE, help='Results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p95/throughput change, as a fraction')
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the baseline')
+    parser.add_argument('--check', action='store_true', help='Exit with status 1 if anything regressed')
+    args = parser.parse_args()
+    unknown = set(args.scenarios.split(',')) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+
+    setup_django()
+    results = run(args)
+    print(f"{results['config']['posts']} posts, {args.concurrency} threads, {args.requests} requests per scenario")
+    print_table([{'scenario': name, **summary} for name, summary in results['scenarios'].items()],
+                ['scenario', 'requests', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps',
+                 'queries_per_request', 'max_queries'])
+    for name, summary in results['scenarios'].items():
+        if summary['top_error']:
+            print(f"{name}: {summary['errors']} failed, most often {summary['top_error']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    regressions = 0
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        differing = {key for key in ('posts', 'concurrency', 'requests') if baseline['config'].get(key) != results['config'][key]}
+        print(f'\nAgainst {args.baseline}' + (f' (different {", ".join(sorted(differing))})' if differing else ''))
+        rows, regressions = compare(results, baseline, args.tolerance)
+        print_table(rows, ['scenario', 'p95_ms', 'throughput_rps', 'queries', 'verdict'])
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(f'Saved the baseline to {args.baseline}')
+    if args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
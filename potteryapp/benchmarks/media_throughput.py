@@ -0,0 +1,110 @@
+"""
+Throughput of core.media_server.serve_media.
+
+    python -m benchmarks.media_throughput [--size-mb 64]
+
+Serves a temporary file through the Django view in-process and reports MiB/s for:
+- a full 200 response,
+- an AVPlayer-style sweep of 1 MiB ranges,
+- a multipart/byteranges response,
+and compares draining a response body with read() copies against handing its
+descriptor to os.sendfile, which is what a sendfile-capable wsgi.file_wrapper does.
+"""
+import argparse
+import os
+import shutil
+import socket
+import tempfile
+import threading
+
+from benchmarks import print_table, setup_django, timeit
+
+MIB = 2 ** 20
+
+
+def drain_socket(sock: socket.socket) -> None:
+    while sock.recv(4 * MIB):
+        pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import RequestFactory, override_settings
+    from core.media_server import serve_media
+
+    media_root = tempfile.mkdtemp()
+    size = args.size_mb * MIB
+    with open(os.path.join(media_root, 'clip.mov'), 'wb') as f:
+        f.write(os.urandom(size))
+    factory = RequestFactory()
+
+    def consume(**headers) -> int:
+        response = serve_media(factory.get('/media/clip.mov', headers=headers), 'clip.mov')
+        total = sum(len(chunk) for chunk in response.streaming_content)
+        response.close()
+        return total
+
+    def range_sweep() -> None:
+        for start in range(0, size, MIB):
+            consume(Range=f'bytes={start}-{start + MIB - 1}')
+
+    def multipart() -> None:
+        spec = ','.join(f'{start}-{start + MIB // 2}' for start in range(0, size, 2 * MIB))
+        consume(Range=f'bytes={spec}')
+
+    def to_socket(use_sendfile: bool) -> None:
+        response = serve_media(factory.get('/media/clip.mov'), 'clip.mov')
+        source = response.file_to_stream
+        sender, receiver = socket.socketpair()
+        reader = threading.Thread(target=drain_socket, args=(receiver,))
+        reader.start()
+        try:
+            if use_sendfile:
+                offset = os.lseek(source.fileno(), 0, os.SEEK_CUR)
+                remaining = int(response['Content-Length'])
+                while remaining:
+                    sent = os.sendfile(sender.fileno(), source.fileno(), offset, remaining)
+                    offset += sent
+                    remaining -= sent
+            else:
+                for chunk in response.streaming_content:
+                    sender.sendall(chunk)
+        finally:
+            sender.close()
+            reader.join()
+            receiver.close()
+            response.close()
+
+    cases = [
+        ('full file (200)', lambda: consume(), size),
+        ('1 MiB range sweep (206)', range_sweep, size),
+        ('multipart/byteranges', multipart, size // 4),
+        ('socket via read() copies', lambda: to_socket(False), size),
+    ]
+    if hasattr(os, 'sendfile'):
+        cases.append(('socket via os.sendfile', lambda: to_socket(True), size))
+
+    rows = []
+    try:
+        with override_settings(MEDIA_ROOT=media_root):
+            for name, fn, nbytes in cases:
+                timing = timeit(fn, args.repeat)
+                rows.append({
+                    'case': name,
+                    'median ms': f"{timing['median'] * 1000:.1f}",
+                    'MiB/s': f"{nbytes / MIB / timing['median']:.0f}",
+                })
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+    print(f'{args.size_mb} MiB file, {args.repeat} runs each')
+    print_table(rows, ['case', 'median ms', 'MiB/s'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Creating a 10-item post in one request vs 10 single-item creates.
+
+    python -m benchmarks.multi_media_post [--items 10] [--size-mb 8]
+
+Posts multipart uploads through POST /api/posts/ in-process against a
+throwaway test database and media directory, and reports the median wall
+time of one request carrying every file (stored on core.uploads' thread pool,
+rows inserted with bulk_create) against one request per file. A second pair
+of rows times only core.uploads' store-and-insert step, without the
+multipart encoding and parsing the test client adds. Each round uses fresh
+random bytes, so content-addressed storage never finds a duplicate.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+from benchmarks import print_table, setup_django, timeit
+
+MIB = 2 ** 20
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=10)
+    parser.add_argument('--size-mb', type=int, default=8, help='Size of each file')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.db import connection
+    from django.test import override_settings
+    from rest_framework.test import APIClient
+    from core import uploads
+    from core.views import get_creator
+
+    client = APIClient(HTTP_HOST='localhost')
+    # Alternate photos and videos, as in a typical "process" post
+    names = [f'{i}.jpg' if i % 2 == 0 else f'{i}.mp4' for i in range(args.items)]
+
+    def files() -> list:
+        return [SimpleUploadedFile(name, os.urandom(args.size_mb * MIB)) for name in names]
+
+    def one_request(files: list) -> None:
+        response = client.post('/api/posts/', {'caption': 'set', 'media': files}, format='multipart')
+        assert response.status_code == 201, response.content
+
+    def sequential(files: list) -> None:
+        for upload in files:
+            one_request([upload])
+
+    def store_and_insert(files: list) -> None:
+        pairs = [(uploads.media_type_for_upload(upload), upload) for upload in files]
+        uploads.create_post(get_creator(None), 'set', uploads.store_uploads(pairs))
+
+    def store_and_insert_each(files: list) -> None:
+        for upload in files:
+            store_and_insert([upload])
+
+    media_root = tempfile.mkdtemp()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    rows = []
+    try:
+        with override_settings(MEDIA_ROOT=media_root, MEDIA_JOBS_EAGER=False):
+            for label, create in (
+                (f'1 request, {args.items} files', one_request),
+                (f'{args.items} single-file requests', sequential),
+                (f'store + insert, {args.items} files at once', store_and_insert),
+                (f'store + insert, {args.items} times 1 file', store_and_insert_each),
+            ):
+                # Building the request bodies isn't part of the measurement
+                batches = [files() for _ in range(args.repeat)]
+                result = timeit(lambda: create(batches.pop()), args.repeat)
+                rows.append({
+                    'method': label,
+                    'median ms': f"{result['median'] * 1000:.0f}",
+                    'min ms': f"{result['min'] * 1000:.0f}",
+                })
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(media_root, ignore_errors=True)
+
+    for batch, single in (rows[0], rows[1]), (rows[2], rows[3]):
+        batch['speedup'] = f"{float(single['median ms']) / float(batch['median ms']):.1f}x"
+    print(f'{args.items} files of {args.size_mb} MiB, median of {args.repeat} runs')
+    print_table(rows, ['method', 'median ms', 'min ms', 'speedup'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Cost of the BlurHash / dominant-color placeholder computed at ingest.
+
+    python -m benchmarks.placeholders [--width 4032] [--repeat 20]
+
+Times the vectorized encoder against a per-pixel loop of the reference
+algorithm on the same tiny copy, the downscale from the 320px rendition rung
+it is computed from, and what a separate decode of the original JPEG would
+have cost on top (the work reusing the rung avoids).
+"""
+import argparse
+import math
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from benchmarks import print_table, timeit
+from core.media import placeholders
+
+
+def scalar_blurhash(rgb: np.ndarray) -> str:
+    """The reference encoder, one pixel at a time."""
+    height, width = rgb.shape[:2]
+    components_x, components_y = (4, 3) if width >= height else (3, 4)
+    pixels = rgb.tolist()
+    factors = []
+    for j in range(components_y):
+        for i in range(components_x):
+            norm = 1 if i == 0 and j == 0 else 2
+            total = [0.0, 0.0, 0.0]
+            for y in range(height):
+                for x in range(width):
+                    basis = norm * math.cos(math.pi * i * x / width) * math.cos(math.pi * j * y / height)
+                    for c in range(3):
+                        total[c] += basis * placeholders._SRGB_TO_LINEAR[pixels[y][x][c]]
+            factors.append([value / (width * height) for value in total])
+    dc, ac = factors[0], factors[1:]
+    text = placeholders.base83(components_x - 1 + (components_y - 1) * 9, 1)
+    quantised_max = int(max(0, min(82, math.floor(max(abs(v) for f in ac for v in f) * 166 - 0.5))))
+    max_value = (quantised_max + 1) / 166
+    text += placeholders.base83(quantised_max, 1)
+    r, g, b = (placeholders.linear_to_srgb(value) for value in dc)
+    text += placeholders.base83((r << 16) + (g << 8) + b, 4)
+    for factor in ac:
+        q = [int(max(0, min(18, math.floor(math.copysign(abs(v / max_value) ** 0.5, v) * 9 + 9.5)))) for v in factor]
+        text += placeholders.base83(q[0] * 19 * 19 + q[1] * 19 + q[2], 2)
+    return text
+
+
+def photo(width: int) -> bytes:
+    height = width * 3 // 4
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:height, 0:width]
+    # A warm glaze-like gradient with grain, so JPEG has something to encode
+    pixels = np.stack([150 + 60 * xx / width, 90 + 50 * yy / height, 60 + 30 * (xx + yy) / (width + height)], axis=-1)
+    pixels += rng.normal(0, 8, pixels.shape)
+    buffer = BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=4032, help='Width of the synthetic original photo')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    original = photo(args.width)
+    rung = Image.open(BytesIO(original)).convert('RGB').resize((320, 240), Image.LANCZOS)
+    rgb = placeholders.tiny(rung)
+    assert scalar_blurhash(rgb) == placeholders.blurhash(rgb)
+
+    def full_decode():
+        image = Image.open(BytesIO(original))
+        image.draft('RGB', (image.width // 8, image.height // 8))
+        return placeholders.placeholder(image.convert('RGB'))
+
+    rows = []
+    for name, fn, repeat in [
+        ('blurhash, per-pixel loop', lambda: scalar_blurhash(rgb), max(1, args.repeat // 10)),
+        ('blurhash, vectorized', lambda: placeholders.blurhash(rgb), args.repeat),
+        ('dominant color', lambda: placeholders.dominant_color(rgb), args.repeat),
+        ('placeholder from 320px rung', lambda: placeholders.placeholder(rung), args.repeat),
+        ('placeholder from a new decode', full_decode, args.repeat),
+    ]:
+        timing = timeit(fn, repeat)
+        rows.append({
+            'step': name,
+            'median ms': f"{timing['median'] * 1000:.3f}",
+            'min ms': f"{timing['min'] * 1000:.3f}",
+        })
+    print(f'{rgb.shape[1]}x{rgb.shape[0]} tiny copy; original {args.width}px JPEG, {len(original) / 2 ** 20:.1f} MiB')
+    print_table(rows, ['step', 'median ms', 'min ms'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Cost of smart poster-frame selection versus the old first-frame thumbnail.
+
+    python -m benchmarks.poster_frame [--seconds 20] [--width 1280] [--candidates 8]
+
+Encodes a synthetic clip once, then times both paths from ``VideoCapture``
+open to the chosen BGR frame (JPEG encoding is identical for both and left out).
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from benchmarks import print_table, timeit
+from core.media.thumbnails import read_first_frame, select_poster_frame
+
+
+def write_clip(path: str, seconds: int, width: int, fps: int = 30) -> None:
+    height = width * 9 // 16
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    for i in range(seconds * fps):
+        # First second is black, like a phone lifted off the table
+        frame = np.zeros_like(noise) if i < fps else np.roll(noise, i * 4, axis=1)
+        writer.write(frame)
+    writer.release()
+
+
+def first_frame(path: str) -> np.ndarray:
+    cap = cv2.VideoCapture(path)
+    try:
+        return read_first_frame(cap)
+    finally:
+        cap.release()
+
+
+def poster_frame(path: str, candidates: int) -> np.ndarray:
+    cap = cv2.VideoCapture(path)
+    try:
+        return select_poster_frame(cap, candidates=candidates).frame
+    finally:
+        cap.release()
+
+
+def peak_memory(fn) -> float:
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=int, default=20)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--candidates', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'clip.mp4')
+        write_clip(path, args.seconds, args.width)
+
+        rows = []
+        for name, fn in [
+            ('first frame', lambda: first_frame(path)),
+            (f'poster ({args.candidates} seeks)', lambda: poster_frame(path, args.candidates)),
+        ]:
+            timing = timeit(fn, args.repeat)
+            rows.append({
+                'path': name,
+                'median ms': f"{timing['median'] * 1000:.1f}",
+                'min ms': f"{timing['min'] * 1000:.1f}",
+                'peak py MiB': f'{peak_memory(fn):.1f}',
+                'frame mean luma': f'{fn().mean():.0f}',
+            })
+        print(f'{args.seconds}s {args.width}px mp4v clip, {os.path.getsize(path) / 2 ** 20:.1f} MiB')
+        print_table(rows, ['path', 'median ms', 'min ms', 'peak py MiB', 'frame mean luma'])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
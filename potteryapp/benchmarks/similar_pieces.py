@@ -0,0 +1,83 @@
+"""
+"Similar pieces" lookup: core.media.phash.HashIndex vs a linear NumPy scan.
+
+    python -m benchmarks.similar_pieces [--hashes 1000000]
+
+Builds an index of random 64-bit hashes with clusters of near-duplicates
+planted in it (reposts of the same piece), then reports query latency at
+several Hamming radii, the cost of building the index, and the time to hash
+one uploaded photo.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks import print_table, timeit
+
+CLUSTERS = 1000
+CLUSTER_SIZE = 5
+QUERIES = 200
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hashes', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    import cv2
+    from PIL import Image
+    from core.media.phash import HashIndex, image_dhash, popcount
+
+    rng = random.Random(0)
+    hashes = [rng.getrandbits(64) for _ in range(args.hashes - CLUSTERS * CLUSTER_SIZE)]
+    for _ in range(CLUSTERS):
+        base = rng.getrandbits(64)
+        for _ in range(CLUSTER_SIZE):
+            value = base
+            for bit in rng.sample(range(64), rng.randint(0, 6)):
+                value ^= 1 << bit
+            hashes.append(value)
+
+    start = time.perf_counter()
+    index = HashIndex()
+    index.extend((key, key // 2, value) for key, value in enumerate(hashes))
+    build_seconds = time.perf_counter() - start
+    as_array = np.array(hashes, dtype=np.uint64)
+
+    queries = rng.sample(hashes[-CLUSTERS * CLUSTER_SIZE:], QUERIES // 2) + rng.sample(hashes, QUERIES // 2)
+    rows = []
+    for radius in (4, 6, 8, 10, 12):
+        samples = []
+        found = 0
+        for query in queries:
+            t0 = time.perf_counter()
+            found += len(index.search(query, radius))
+            samples.append(time.perf_counter() - t0)
+        samples.sort()
+        scan = timeit(lambda: np.nonzero(popcount(as_array ^ np.uint64(queries[0])) <= radius), repeat=5)
+        rows.append({
+            'radius': radius,
+            'index median µs': f'{statistics.median(samples) * 1e6:.0f}',
+            'index p99 µs': f'{samples[int(len(samples) * 0.99) - 1] * 1e6:.0f}',
+            'linear scan µs': f"{scan['median'] * 1e6:.0f}",
+            'avg matches': f'{found / len(queries):.1f}',
+        })
+
+    photo = cv2.resize(np.random.default_rng(0).integers(0, 256, (12, 12), dtype=np.uint8), (4032, 3024))
+    path = os.path.join(tempfile.mkdtemp(), 'photo.jpg')
+    Image.fromarray(photo).save(path, quality=90)
+    hash_time = timeit(lambda: image_dhash(path), repeat=5)
+    os.unlink(path)
+
+    print(f'{len(index)} hashes, index built in {build_seconds:.1f}s; {QUERIES} queries per radius')
+    print_table(rows, ['radius', 'index median µs', 'index p99 µs', 'linear scan µs', 'avg matches'])
+    print(f"dHash of a 4032x3024 JPEG: {hash_time['median'] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Concurrent writers and feed readers on one SQLite file: lock errors and throughput.
+
+    python -m benchmarks.sqlite_concurrency [--writers 8] [--readers 4] [--duration 5] [--posts 2000]
+
+Each configuration gets a fresh database from benchmarks.dataset, then
+``--writers`` threads write and ``--readers`` threads render feed pages for
+``--duration`` seconds. Writers alternate the database work of
+PostViewSet.create (uploads.create_post for an image already stored, several
+statements and signals) and of list_on_shelf (SaleItem update_or_create) on a
+random post. Readers render a random one of the first pages of the feed with
+core.feed_render. Configurations:
+
+- ``bare``: Django's defaults for a bare sqlite3 entry: rollback journal,
+  deferred transactions, 5 second timeout;
+- ``pragmas``: settings.SQLITE_PRAGMAS (WAL, synchronous=NORMAL, mmap,
+  busy_timeout) and IMMEDIATE transactions;
+- ``pragmas + coalescing``: writes also go through core.writes, several
+  requests' writes per transaction.
+
+Reported per configuration: writes and reads per second, their p95 latency,
+and the "database is locked" errors raised.
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+
+from benchmarks import print_table, setup_django
+from benchmarks import dataset
+
+FEED_PAGE_SIZE = 20
+FEED_PAGES = 10
+
+
+def configurations(settings) -> dict[str, tuple[dict, bool]]:
+    """Name -> (database OPTIONS, DB_WRITE_COALESCING)."""
+    tuned = dict(settings.DATABASES['default']['OPTIONS'])
+    return {
+        'bare': ({}, False),
+        'pragmas': (tuned, False),
+        'pragmas + coalescing': (tuned, True),
+    }
+
+
+def p95_ms(samples: list[float]) -> str:
+    if len(samples) < 2:
+        return '-'
+    return f'{statistics.quantiles(samples, n=20, method="inclusive")[18] * 1000:.1f}'
+
+
+def stress(args) -> dict:
+    from django.db import OperationalError, connection
+    from django.db.models import Max, Min
+    from rest_framework.test import APIRequestFactory
+    from core import feed_render, uploads
+    from core.models import Post, PostMedia, SaleItem
+    from core.views import get_creator
+    from core.writes import coalesced_write
+
+    creator = get_creator(None)
+    image = PostMedia.objects.filter(media_type=PostMedia.MEDIA_TYPE_IMAGE).values_list('file', flat=True).first()
+    stored = [uploads.StoredMedia(PostMedia.MEDIA_TYPE_IMAGE, image)]
+    post_ids = Post.objects.aggregate(low=Min('id'), high=Max('id'))
+    request = APIRequestFactory().get('/api/posts/', HTTP_HOST='localhost')
+    connection.close()
+
+    def create_post(rng):
+        coalesced_write(uploads.create_post, creator, 'stress', stored)
+
+    def list_on_shelf(rng):
+        coalesced_write(SaleItem.objects.update_or_create, post_id=rng.randint(post_ids['low'], post_ids['high']),
+                        defaults={'price': f'{rng.randint(8, 400)}.00', 'is_sold': False})
+
+    def read_feed(rng):
+        offset = rng.randrange(FEED_PAGES) * FEED_PAGE_SIZE
+        rows = list(feed_render.post_rows(Post.objects.order_by('-created_at', '-id')[offset:offset + FEED_PAGE_SIZE]))
+        feed_render.render_posts(rows, request)
+
+    writes, reads, locked = [], [], []
+    start = threading.Barrier(args.writers + args.readers + 1)
+    deadline = None
+
+    def worker(index: int, operations) -> None:
+        rng = random.Random(index)
+        samples, errors = [], 0
+        start.wait()
+        try:
+            while time.perf_counter() < deadline:
+                began = time.perf_counter()
+                try:
+                    rng.choice(operations)(rng)
+                except OperationalError as exc:
+                    if 'locked' not in str(exc):
+                        raise
+                    errors += 1
+                    continue
+                samples.append(time.perf_counter() - began)
+        finally:
+            connection.close()
+            (writes if operations is writer_operations else reads).extend(samples)
+            locked.append(errors)
+
+    writer_operations = [create_post, list_on_shelf]
+    threads = [threading.Thread(target=worker, args=(i, writer_operations)) for i in range(args.writers)]
+    threads += [threading.Thread(target=worker, args=(args.writers + i, [read_feed])) for i in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    deadline = time.perf_counter() + args.duration
+    start.wait()
+    for thread in threads:
+        thread.join()
+    return {
+        'writes/s': f'{len(writes) / args.duration:.0f}',
+        'write p95 ms': p95_ms(writes),
+        'reads/s': f'{len(reads) / args.duration:.0f}',
+        'read p95 ms': p95_ms(reads),
+        'lock errors': sum(locked),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--posts', type=int, default=2000, help='Posts in each fresh database')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.db import connection
+    from django.test import override_settings
+    from core import writes
+
+    rows = []
+    options = connection.settings_dict['OPTIONS']
+    saved = dict(options)
+    try:
+        for name, (config_options, coalescing) in configurations(settings).items():
+            options.clear()
+            options.update(config_options)
+            # The writer thread keeps its connection; start one per database
+            writes._coalescer = None
+            with dataset.bench_database(), override_settings(DB_WRITE_COALESCING=coalescing):
+                dataset.generate(args.posts, renditions=True)
+                rows.append({'configuration': name, **stress(args)})
+    finally:
+        options.clear()
+        options.update(saved)
+    print(f'{args.writers} writer and {args.readers} reader threads for {args.duration:.0f}s, {args.posts} posts')
+    print_table(rows, ['configuration', 'writes/s', 'write p95 ms', 'reads/s', 'read p95 ms', 'lock errors'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Process start-up cost with media processing loaded lazily vs eagerly.
+
+    python -m benchmarks.startup [--repeat 5]
+
+Each run is a fresh interpreter that sets up Django and loads the URLconf,
+as a web worker or management command does before its first piece of
+work. The "eager" row also imports core.media.derivatives, which pulls in
+OpenCV, NumPy and Pillow: what every process paid when core.models imported
+them at module level. Reports wall time and peak RSS (Linux only).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks import print_table
+
+BOOT = """
+import time
+started = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+{extra}
+elapsed = time.perf_counter() - started
+peak = -1
+try:
+    with open('/proc/self/status') as f:
+        peak = next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+except OSError:
+    pass
+print(elapsed, peak)
+"""
+
+
+def run(extra: str) -> tuple[float, int]:
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'backend.settings'}
+    output = subprocess.run([sys.executable, '-c', BOOT.format(extra=extra)], env=env,
+                            capture_output=True, text=True, check=True).stdout
+    elapsed, peak_kib = output.split()
+    return float(elapsed), int(peak_kib)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rows = []
+    for label, extra in (('lazy (current)', ''), ('eager media imports', 'import core.media.derivatives')):
+        samples = [run(extra) for _ in range(args.repeat)]
+        peak = max(peak for _, peak in samples)
+        rows.append({
+            'start-up': label,
+            'median ms': f'{statistics.median(elapsed for elapsed, _ in samples) * 1000:.0f}',
+            'min ms': f'{min(elapsed for elapsed, _ in samples) * 1000:.0f}',
+            'peak RSS MiB': f'{peak / 1024:.0f}' if peak >= 0 else 'n/a',
+        })
+    print(f'Fresh interpreter per run, {args.repeat} runs')
+    print_table(rows, ['start-up', 'median ms', 'min ms', 'peak RSS MiB'])
+
+
+if __name__ == '__main__':
+    main()
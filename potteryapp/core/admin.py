@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Post, SaleItem, PostMedia
+from django.utils import timezone
+from django.utils.html import format_html
+from . import search
+from .models import Post, SaleItem, PostMedia, MediaJob, MediaBlob
 
 # Inline admin for PostMedia
 class PostMediaInline(admin.TabularInline):
@@ -34,6 +37,12 @@ class PostAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at',)
     inlines = [PostMediaInline, SaleItemInline]
     
+    def get_search_results(self, request, queryset, search_term):
+        # Use the FTS index instead of LIKE '%...%' scans over every caption
+        if not search_term.strip() or not search.is_available():
+            return super().get_search_results(request, queryset, search_term)
+        return search.filter_posts(queryset, search_term), False
+    
     def caption_preview(self, obj):
         if obj.caption:
             return obj.caption[:50] + '...' if len(obj.caption) > 50 else obj.caption
@@ -42,8 +51,8 @@ class PostAdmin(admin.ModelAdmin):
 
 @admin.register(PostMedia)
 class PostMediaAdmin(admin.ModelAdmin):
-    list_display = ('id', 'post', 'media_type', 'order', 'file_preview', 'file_url_display', 'created_at')
-    list_filter = ('media_type', 'created_at')
+    list_display = ('id', 'post', 'media_type', 'order', 'status', 'is_faststart', 'file_preview', 'file_url_display', 'created_at')
+    list_filter = ('media_type', 'status', 'created_at')
     search_fields = ('post__caption', 'post__id')
     readonly_fields = ('created_at', 'file_url_display')
     fields = ('post', 'file', 'media_type', 'order', 'file_url_display', 'created_at')
@@ -82,4 +91,27 @@ class SaleItemAdmin(admin.ModelAdmin):
     list_display = ('id', 'post', 'price', 'is_sold')
     list_filter = ('is_sold',)
     search_fields = ('post__caption', 'post__id')
-    fields = ('post', 'price', 'is_sold')
\ No newline at end of file
+    fields = ('post', 'price', 'is_sold')
+    
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip() or search_term.strip().isdigit() or not search.is_available():
+            return super().get_search_results(request, queryset, search_term)
+        return search.filter_posts(queryset, search_term, post_field='post'), False
+
+@admin.register(MediaJob)
+class MediaJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'media', 'kind', 'status', 'attempts', 'run_after', 'locked_by', 'finished_at')
+    list_filter = ('status', 'kind')
+    readonly_fields = ('created_at', 'finished_at', 'locked_at', 'locked_by', 'last_error')
+    actions = ['retry_jobs']
+
+    @admin.action(description='Retry selected jobs')
+    def retry_jobs(self, request, queryset):
+        queryset.update(status=MediaJob.STATUS_QUEUED, attempts=0, run_after=timezone.now(), locked_by='', locked_at=None)
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'refcount', 'created_at')
+    search_fields = ('name',)
+    readonly_fields = ('name', 'size', 'refcount', 'created_at')
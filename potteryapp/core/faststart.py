@@ -0,0 +1,254 @@
+"""
+MP4/MOV "faststart" remuxing.
+
+iPhone recordings usually put the ``moov`` box (the index of where every frame
+lives) after ``mdat`` (the frames). A player then has to range-fetch the tail
+of the file before it can start, which costs extra round trips on every open.
+
+``make_faststart`` writes a copy with the top-level boxes reordered so ``moov``
+precedes the first ``mdat``, and moves every chunk offset in ``stco``/``co64``
+with the bytes it points into: by the size of the relocated ``moov`` for data
+that was in front of it, by the size difference for data that followed it.
+Nothing is decoded or re-encoded: media bytes are streamed across with a
+fixed-size buffer and only ``moov`` is held in memory. The copy is a new file
+rather than a rewrite in place, since uploads are stored under the digest of
+their bytes (see core.storage).
+"""
+import os
+import posixpath
+import struct
+import tempfile
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable
+
+from django.core.files import File
+from django.core.files.storage import Storage
+
+from .storage import MEDIA_DIR
+
+# Boxes whose payload is a plain list of child boxes (ISO/IEC 14496-12)
+CONTAINER_TYPES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts', b'dinf', b'mvex', b'udta'}
+# A moov bigger than this is not something we want in memory; leave the file alone
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+COPY_BUFFER_SIZE = 1024 * 1024
+UINT32_MAX = 0xFFFFFFFF
+
+
+class FaststartError(Exception):
+    pass
+
+
+@dataclass
+class TopBox:
+    type: bytes
+    offset: int
+    size: int
+
+
+@dataclass
+class Box:
+    type: bytes
+    payload: bytes = b''
+    children: list['Box'] | None = None
+    # Extra header bytes before the child list (none for the types we descend into)
+    prefix: bytes = b''
+
+    def serialize(self) -> bytes:
+        if self.children is None:
+            body = self.payload
+        else:
+            body = self.prefix + b''.join(child.serialize() for child in self.children)
+        size = len(body) + 8
+        if size > UINT32_MAX:
+            return struct.pack('>I4sQ', 1, self.type, size + 8) + body
+        return struct.pack('>I4s', size, self.type) + body
+
+
+def read_top_level_boxes(f: BinaryIO, file_size: int) -> list[TopBox]:
+    boxes = []
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        size, box_type = struct.unpack('>I4s', header[:8])
+        if size == 1:
+            if len(header) < 16:
+                raise FaststartError('Truncated 64-bit box header')
+            size = struct.unpack('>Q', header[8:16])[0]
+        elif size == 0:
+            # Box extends to end of file
+            size = file_size - offset
+        if size < 8 or offset + size > file_size:
+            raise FaststartError(f'Invalid size for {box_type!r} box at offset {offset}')
+        boxes.append(TopBox(box_type, offset, size))
+        offset += size
+    return boxes
+
+
+def parse_boxes(data: bytes) -> list[Box]:
+    boxes = []
+    offset = 0
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = len(data) - offset
+        if size < header or offset + size > len(data):
+            raise FaststartError(f'Invalid size for {box_type!r} box inside moov')
+        payload = data[offset + header:offset + size]
+        if box_type in CONTAINER_TYPES and not (box_type == b'udta' and not _looks_like_boxes(payload)):
+            boxes.append(Box(box_type, children=parse_boxes(payload)))
+        else:
+            boxes.append(Box(box_type, payload=payload))
+        offset += size
+    return boxes
+
+
+def _looks_like_boxes(payload: bytes) -> bool:
+    # Old QuickTime udta can hold raw data; only descend if it parses cleanly
+    try:
+        parse_boxes(payload)
+        return True
+    except (FaststartError, struct.error):
+        return False
+
+
+def _walk(boxes: list[Box]):
+    for box in boxes:
+        yield box
+        if box.children is not None:
+            yield from _walk(box.children)
+
+
+def _read_offsets(box: Box) -> list[int]:
+    count = struct.unpack_from('>I', box.payload, 4)[0]
+    fmt = '>%dI' if box.type == b'stco' else '>%dQ'
+    return list(struct.unpack_from(fmt % count, box.payload, 8))
+
+
+def shift_chunk_offsets(moov: Box, relocate: Callable[[int], int]) -> None:
+    """
+    Replace every chunk offset in the moov tree with ``relocate(offset)``.
+    stco tables whose offsets would overflow 32 bits are upgraded to co64 in
+    place.
+    """
+    for box in _walk([moov]):
+        if box.type not in (b'stco', b'co64'):
+            continue
+        version_flags = box.payload[:4]
+        offsets = [relocate(offset) for offset in _read_offsets(box)]
+        if box.type == b'stco' and offsets and max(offsets) > UINT32_MAX:
+            box.type = b'co64'
+        fmt = '>%dI' if box.type == b'stco' else '>%dQ'
+        box.payload = version_flags + struct.pack('>I', len(offsets)) + struct.pack(fmt % len(offsets), *offsets)
+
+
+def relocated_moov(moov_bytes: bytes, moov_offset: int, insert_at: int) -> bytes:
+    """
+    Return the serialised moov, read from ``moov_offset``, to place at
+    ``insert_at`` (the first mdat). Data between the two moves forward by the
+    new moov's size, data after the old moov by the difference in size. The
+    new size can grow if stco is upgraded to co64, so repeat until it is
+    stable (at most twice in practice).
+    """
+    header = 16 if struct.unpack_from('>I', moov_bytes)[0] == 1 else 8
+    moov_end = moov_offset + len(moov_bytes)
+    size = len(moov_bytes)
+    while True:
+        def relocate(offset: int, size=size) -> int:
+            if offset < insert_at:
+                return offset
+            if offset < moov_end:
+                return offset + size
+            return offset + size - len(moov_bytes)
+
+        moov = Box(b'moov', children=parse_boxes(moov_bytes[header:]))
+        shift_chunk_offsets(moov, relocate)
+        data = moov.serialize()
+        if len(data) == size:
+            return data
+        size = len(data)
+
+
+def is_faststart(path: str) -> bool | None:
+    """True/False for ISO-BMFF files with both moov and mdat, None otherwise."""
+    with open(path, 'rb') as f:
+        try:
+            boxes = read_top_level_boxes(f, os.fstat(f.fileno()).st_size)
+        except (FaststartError, struct.error):
+            return None
+    types = [box.type for box in boxes]
+    if b'moov' not in types or b'mdat' not in types:
+        return None
+    return types.index(b'moov') < types.index(b'mdat')
+
+
+def _copy_range(src: BinaryIO, dst: BinaryIO, offset: int, length: int) -> None:
+    src.seek(offset)
+    while length:
+        chunk = src.read(min(COPY_BUFFER_SIZE, length))
+        if not chunk:
+            raise FaststartError('Unexpected end of file while copying')
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def make_faststart(path: str, dst: BinaryIO) -> bool | None:
+    """
+    Write the file at ``path`` to ``dst`` with moov moved in front of mdat.
+
+    Returns True if a copy was written, False if the file is already
+    faststart (nothing written), or None if it isn't an ISO-BMFF file we can
+    handle.
+    """
+    with open(path, 'rb') as src:
+        file_size = os.fstat(src.fileno()).st_size
+        try:
+            boxes = read_top_level_boxes(src, file_size)
+        except (FaststartError, struct.error):
+            return None
+
+        types = [box.type for box in boxes]
+        if types.count(b'moov') != 1 or b'mdat' not in types:
+            return None
+        moov_index = types.index(b'moov')
+        first_mdat = types.index(b'mdat')
+        if moov_index < first_mdat:
+            return False
+
+        moov_box = boxes[moov_index]
+        if moov_box.size > MAX_MOOV_SIZE:
+            raise FaststartError(f'moov box is {moov_box.size} bytes, larger than {MAX_MOOV_SIZE}')
+        src.seek(moov_box.offset)
+        moov_bytes = src.read(moov_box.size)
+        if any(box.type == b'cmov' for box in _walk(parse_boxes(moov_bytes[8:]))):
+            # Compressed movie header: offsets are inside a zlib stream, leave it
+            return None
+        new_moov = relocated_moov(moov_bytes, moov_box.offset, boxes[first_mdat].offset)
+
+        # Everything before the first mdat stays put, then moov, then the rest
+        order = boxes[:first_mdat] + [None] + [b for i, b in enumerate(boxes[first_mdat:], first_mdat) if i != moov_index]
+        for box in order:
+            if box is None:
+                dst.write(new_moov)
+            else:
+                _copy_range(src, dst, box.offset, box.size)
+    return True
+
+
+def faststart_stored(storage: Storage, name: str) -> dict:
+    """
+    Remux the video stored as ``name``; returns PostMedia field values.
+    ``is_faststart`` is always set. When a copy had to be written, ``file``
+    names it; the upload's blob is left to its references.
+    """
+    with tempfile.TemporaryFile() as remuxed:
+        written = make_faststart(storage.path(name), remuxed)
+        fields = {'is_faststart': None if written is None else True}
+        if written:
+            ext = os.path.splitext(name)[1]
+            fields['file'] = storage.save(posixpath.join(MEDIA_DIR, f'video{ext}'), File(remuxed))
+    return fields
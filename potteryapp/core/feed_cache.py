@@ -0,0 +1,154 @@
+"""
+Cache of serialized post fragments for the feed.
+
+Each post's JSON fragment is cached under ``(post id, Post.version, base URL)``.
+``Post.version`` is bumped in the same transaction as any change to the post,
+its media or its sale item (see core.signals), so readers either see the old
+row with the old fragment or the new row with a cache miss. Because the version
+lives in the database, invalidations made by the media worker process are seen
+by every web process, whatever cache backend is configured; stale fragments are
+never looked up again and simply age out.
+
+The backend is ``CACHES[settings.FEED_CACHE_ALIAS]``. The default is an
+in-process LocMemCache bounded by MAX_ENTRIES with LRU eviction; a
+FileBasedCache (e.g. under /dev/shm) shares fragments between worker processes.
+"""
+import hashlib
+import threading
+from typing import Awaitable, Callable, Iterable, Sequence
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+
+# Bump when PostSerializer output changes so old fragments are ignored
+FRAGMENT_SCHEMA = 5
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.invalidations = 0
+
+    def record(self, hits: int = 0, misses: int = 0, invalidations: int = 0) -> None:
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.invalidations += invalidations
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+stats = CacheStats()
+
+
+def metric_lines() -> list[str]:
+    """``stats`` for /api/metrics/ (see core.metrics)."""
+    current = stats.as_dict()
+    lines = []
+    for name in ('hits', 'misses', 'invalidations'):
+        lines += [f'# HELP feed_cache_{name}_total Feed fragment cache {name}.',
+                  f'# TYPE feed_cache_{name}_total counter',
+                  f'feed_cache_{name}_total {current[name]}']
+    return lines
+
+
+metrics.COLLECTORS.append(metric_lines)
+
+
+def get_cache():
+    return caches[settings.FEED_CACHE_ALIAS]
+
+
+def fragment_key(post_id: int, version: int, base_url: str) -> str:
+    # Fragments embed absolute URLs, so the host they were built for is part of the key
+    base = hashlib.blake2b(base_url.encode(), digest_size=8).hexdigest()
+    return f'feed:s{FRAGMENT_SCHEMA}:post:{post_id}:{version}:{base}'
+
+
+def list_etag(request, rows: Sequence[dict], *extra) -> str:
+    """
+    Strong ETag for a list of rendered posts. A fragment is fixed by its post's
+    id and version and the base URL, so those (plus the full request URL, which
+    covers pagination links, and anything else in ``extra``) fix the body.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{FRAGMENT_SCHEMA} {request.build_absolute_uri()}'.encode())
+    for row in rows:
+        digest.update(f' {row["id"]}:{row["version"]}'.encode())
+    for value in extra:
+        digest.update(f' {value}'.encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def invalidate(post_ids: Iterable[int]) -> None:
+    """Bump Post.version and updated_at for the given posts (in the caller's transaction)."""
+    from .models import Post
+
+    post_ids = {post_id for post_id in post_ids if post_id is not None}
+    if post_ids:
+        Post.objects.filter(pk__in=post_ids).update(version=F('version') + 1, updated_at=timezone.now())
+        stats.record(invalidations=len(post_ids))
+
+
+def render_posts(rows: Sequence[dict], request, serialize: Callable[[list], list]) -> list[dict]:
+    """
+    Return serialized fragments for Post value ``rows`` (each with at least
+    ``id`` and ``version``) in order, calling ``serialize(missing_rows)`` only
+    for the ones not already cached.
+    """
+    if not rows:
+        return []
+    cache = get_cache()
+    keys = fragment_keys(rows, request)
+    cached = cache.get_many(keys)
+    missing = find_missing(rows, keys, cached)
+    if missing:
+        fresh = dict(zip((key for key in keys if key not in cached), serialize(missing)))
+        cache.set_many(fresh)
+        cached.update(fresh)
+    return [cached[key] for key in keys]
+
+
+async def arender_posts(rows: Sequence[dict], request,
+                        serialize: Callable[[list], Awaitable[list]]) -> list[dict]:
+    """render_posts() for async views: ``serialize`` is awaited, the cache used through its async API."""
+    if not rows:
+        return []
+    cache = get_cache()
+    keys = fragment_keys(rows, request)
+    cached = await cache.aget_many(keys)
+    missing = find_missing(rows, keys, cached)
+    if missing:
+        fresh = dict(zip((key for key in keys if key not in cached), await serialize(missing)))
+        await cache.aset_many(fresh)
+        cached.update(fresh)
+    return [cached[key] for key in keys]
+
+
+def fragment_keys(rows: Sequence[dict], request) -> list[str]:
+    base_url = request.build_absolute_uri('/') if request is not None else ''
+    return [fragment_key(row['id'], row['version'], base_url) for row in rows]
+
+
+def find_missing(rows: Sequence[dict], keys: list[str], cached: dict) -> list[dict]:
+    missing = [row for row, key in zip(rows, keys) if key not in cached]
+    stats.record(hits=len(rows) - len(missing), misses=len(missing))
+    return missing
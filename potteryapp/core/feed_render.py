@@ -0,0 +1,153 @@
+"""
+Fast read-only rendering of posts for the feed.
+
+Produces exactly what PostSerializer / PostMediaSerializer / SaleItemSerializer
+produce (same keys, order and value formatting, so the rendered JSON is
+byte-identical) but works from ``.values()`` rows: no model instances, no
+per-field serializer objects and one ``build_absolute_uri`` per request instead
+of two per media item. Writes and the OpenAPI schema still go through the DRF
+serializers, which remain the source of truth; tests assert the two agree.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from typing import Iterable
+
+from django.conf import settings
+from django.db.models import QuerySet
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+
+from .models import PostMedia
+from .renditions import rendition_map
+
+# Columns the feed needs from Post and its one-to-one/foreign-key joins
+POST_FIELDS = (
+    'id', 'version', 'creator_id', 'creator__username', 'caption', 'created_at',
+    'saleitem__id', 'saleitem__price', 'saleitem__is_sold',
+)
+MEDIA_FIELDS = ('id', 'post_id', 'file', 'thumbnail', 'storyboard', 'media_type', 'order', 'status')
+METADATA_FIELDS = tuple(PostMedia.METADATA_FIELDS)
+PLACEHOLDER_FIELDS = tuple(PostMedia.PLACEHOLDER_FIELDS)
+# Joined into the media query (one row per rendition) to keep the feed at 2 queries
+RENDITION_FIELDS = ('renditions__format', 'renditions__width', 'renditions__file')
+
+# SaleItem.price decimal places; DRF's DecimalField always renders this many
+PRICE_QUANTUM = Decimal('0.01')
+
+
+def post_rows(queryset: QuerySet) -> QuerySet:
+    """Turn a Post queryset into the dict rows render_posts() consumes."""
+    return queryset.values(*POST_FIELDS)
+
+
+def format_datetime(value) -> str:
+    # Mirrors rest_framework.fields.DateTimeField.to_representation
+    value = timezone.localtime(value) if settings.USE_TZ else value
+    text = value.isoformat()
+    if text.endswith('+00:00'):
+        text = text[:-6] + 'Z'
+    return text
+
+
+def format_price(value: Decimal) -> str:
+    # Mirrors DecimalField(max_digits=10, decimal_places=2) with COERCE_DECIMAL_TO_STRING
+    return '{:f}'.format(value.quantize(PRICE_QUANTUM))
+
+
+class MediaUrlBuilder:
+    """Builds absolute media URLs from one per-request base instead of per file."""
+
+    def __init__(self, request):
+        self.base = request.build_absolute_uri(settings.MEDIA_URL) if request is not None else settings.MEDIA_URL
+
+    def __call__(self, name: str) -> str | None:
+        return self.base + filepath_to_uri(name) if name else None
+
+
+def media_rows(post_ids: list[int]) -> QuerySet:
+    """The single media query behind media_by_post(), one row per rendition."""
+    return (
+        PostMedia.objects
+        .filter(post_id__in=post_ids)
+        # Same order as PostMedia.Meta.ordering, grouped by post
+        .order_by('post_id', 'order', 'created_at', 'id')
+        .values_list(*MEDIA_FIELDS, *METADATA_FIELDS, *PLACEHOLDER_FIELDS, *RENDITION_FIELDS)
+    )
+
+
+def group_media(rows: Iterable[tuple]) -> dict[int, list[tuple]]:
+    """
+    Media rows per post, each ``MEDIA_FIELDS`` plus dicts of the
+    ``METADATA_FIELDS`` and ``PLACEHOLDER_FIELDS`` and a list of (format,
+    width, file) renditions.
+    """
+    grouped = defaultdict(list)
+    metadata_end = len(MEDIA_FIELDS) + len(METADATA_FIELDS)
+    placeholder_end = metadata_end + len(PLACEHOLDER_FIELDS)
+    previous_id = None
+    for row in rows:
+        media, rendition = row[:len(MEDIA_FIELDS)], row[placeholder_end:]
+        if media[0] != previous_id:
+            metadata = dict(zip(METADATA_FIELDS, row[len(MEDIA_FIELDS):metadata_end]))
+            placeholder = dict(zip(PLACEHOLDER_FIELDS, row[metadata_end:placeholder_end]))
+            grouped[media[1]].append(media + (metadata, placeholder, []))
+            previous_id = media[0]
+        if rendition[0] is not None:
+            grouped[media[1]][-1][-1].append(rendition)
+    return grouped
+
+
+def media_by_post(post_ids: list[int]) -> dict[int, list[tuple]]:
+    return group_media(media_rows(post_ids))
+
+
+async def amedia_by_post(post_ids: list[int]) -> dict[int, list[tuple]]:
+    return group_media([row async for row in media_rows(post_ids)])
+
+
+def render_posts(rows: list[dict], request, media: dict[int, list[tuple]] | None = None) -> list[dict]:
+    """
+    Render Post value rows (see POST_FIELDS) with one query for all their
+    media, unless ``media`` (from media_by_post) is passed in.
+    """
+    url = MediaUrlBuilder(request)
+    if media is None:
+        media = media_by_post([row['id'] for row in rows])
+    rendered = []
+    for row in rows:
+        sale_id = row['saleitem__id']
+        rendered.append({
+            'id': row['id'],
+            'creator': row['creator_id'],
+            'creator_username': row['creator__username'],
+            'caption': row['caption'],
+            'created_at': format_datetime(row['created_at']),
+            'is_for_sale': sale_id is not None,
+            'sale_item': None if sale_id is None else {
+                'id': sale_id,
+                'price': format_price(row['saleitem__price']),
+                'is_sold': row['saleitem__is_sold'],
+            },
+            'media': [
+                {
+                    'id': media_id,
+                    'file_url': url(file_name),
+                    'thumbnail_url': url(thumbnail_name),
+                    'storyboard_url': url(storyboard_name),
+                    'media_type': media_type,
+                    'order': order,
+                    'status': status,
+                    'metadata': metadata,
+                    'placeholder': placeholder,
+                    'renditions': rendition_map((fmt, width, url(name)) for fmt, width, name in renditions),
+                }
+                for (media_id, _, file_name, thumbnail_name, storyboard_name, media_type, order, status,
+                     metadata, placeholder, renditions) in media[row['id']]
+            ],
+        })
+    return rendered
+
+
+async def arender_posts(rows: list[dict], request) -> list[dict]:
+    """render_posts() with the media query run through the async ORM."""
+    return render_posts(rows, request, await amedia_by_post([row['id'] for row in rows]))
@@ -0,0 +1,243 @@
+"""
+DB-backed job queue for media post-processing.
+
+Jobs are rows in MediaJob. Uploads enqueue them in the same transaction as the
+PostMedia row; a worker process (``manage.py run_media_worker``) claims them
+and runs them on a local thread pool. OpenCV and Pillow release the GIL while
+decoding/encoding, so threads give real parallelism for this workload.
+"""
+import functools
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable, Sequence
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import feed_cache, metrics
+from .models import MediaJob, PostMedia
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before retry N is 2 ** N * RETRY_BACKOFF
+RETRY_BACKOFF = 5
+# A running job whose lock is older than this is assumed to belong to a dead worker
+STALE_LOCK_TIMEOUT = timedelta(minutes=10)
+# How often a running Worker looks for jobs other workers left behind
+STALE_CHECK_INTERVAL = 60
+# How often a running Worker writes its metrics for /api/metrics/ (settings.METRICS_EXPORT_DIR)
+METRICS_EXPORT_INTERVAL = 10
+
+
+def process_media(job: MediaJob) -> None:
+    job.media.process()
+
+
+HANDLERS: dict[str, Callable[[MediaJob], None]] = {
+    MediaJob.KIND_PROCESS: process_media,
+}
+
+
+def enqueue_media_processing(media: PostMedia) -> MediaJob:
+    """
+    Queue post-processing for a PostMedia. With ``MEDIA_JOBS_EAGER`` set
+    (handy for local development without a worker) the job runs as soon as
+    the surrounding transaction commits.
+    """
+    job = MediaJob.objects.create(media=media, kind=MediaJob.KIND_PROCESS)
+    if getattr(settings, 'MEDIA_JOBS_EAGER', False):
+        transaction.on_commit(functools.partial(run_eagerly, job.pk))
+    return job
+
+
+def enqueue_media_processing_many(media: Sequence[PostMedia]) -> list[MediaJob]:
+    """enqueue_media_processing for several PostMedia with a single INSERT."""
+    jobs = MediaJob.objects.bulk_create(MediaJob(media=item, kind=MediaJob.KIND_PROCESS) for item in media)
+    if getattr(settings, 'MEDIA_JOBS_EAGER', False):
+        for job in jobs:
+            transaction.on_commit(functools.partial(run_eagerly, job.pk))
+    return jobs
+
+
+def run_eagerly(job_id: int) -> None:
+    """Run a job that was just enqueued, unless a worker claimed it first."""
+    if claim_job(job_id, f'eager:{socket.gethostname()}:{os.getpid()}'):
+        run_job(job_id)
+
+
+def claim_job(job_id: int, worker_id: str, now=None) -> bool:
+    """
+    Claim one job with a conditional UPDATE on ``status='queued'``. Returns
+    True if this call won it. The attempt is counted here, not when the
+    handler returns, so a job that kills its worker still runs out of attempts.
+    """
+    return bool(MediaJob.objects.filter(id=job_id, status=MediaJob.STATUS_QUEUED).update(
+        status=MediaJob.STATUS_RUNNING,
+        attempts=F('attempts') + 1,
+        locked_by=worker_id,
+        locked_at=now or timezone.now(),
+    ))
+
+
+def claim_jobs(worker_id: str, limit: int) -> list[int]:
+    """
+    Atomically claim up to ``limit`` runnable jobs for this worker.
+
+    Each claim is a conditional UPDATE on ``status='queued'``, so two workers
+    racing for the same row can't both win it.
+    """
+    now = timezone.now()
+    candidates = list(
+        MediaJob.objects
+        .filter(status=MediaJob.STATUS_QUEUED, run_after__lte=now)
+        .order_by('run_after', 'id')
+        .values_list('id', flat=True)[:limit]
+    )
+    return [job_id for job_id in candidates if claim_job(job_id, worker_id, now)]
+
+
+def mark_media_failed(media_ids: Sequence[int]) -> None:
+    """Mark media whose job gave up as failed."""
+    PostMedia.objects.filter(pk__in=media_ids).update(status=PostMedia.STATUS_FAILED)
+    # update() skips signals, so invalidate the cached "processing" fragments here
+    feed_cache.invalidate(PostMedia.objects.filter(pk__in=media_ids).values_list('post_id', flat=True))
+
+
+def requeue_stale_jobs() -> int:
+    """
+    Put jobs left 'running' by a crashed worker back on the queue, or fail
+    them if that was their last attempt. Returns the number of jobs found.
+    """
+    now = timezone.now()
+    stale = MediaJob.objects.filter(status=MediaJob.STATUS_RUNNING, locked_at__lt=now - STALE_LOCK_TIMEOUT)
+    with transaction.atomic():
+        exhausted = stale.filter(attempts__gte=F('max_attempts'))
+        media_ids = list(exhausted.values_list('media_id', flat=True))
+        failed = exhausted.update(status=MediaJob.STATUS_FAILED, locked_by='', locked_at=None, finished_at=now,
+                                  last_error='The worker running it stopped')
+        mark_media_failed(media_ids)
+        requeued = stale.update(status=MediaJob.STATUS_QUEUED, locked_by='', locked_at=None)
+    if failed or requeued:
+        logger.warning('Requeued %d and failed %d jobs left running by a stopped worker', requeued, failed)
+    return failed + requeued
+
+
+def run_job(job_id: int) -> bool:
+    """Run one claimed job (claim_job counted the attempt). Returns True on success."""
+    job = MediaJob.objects.select_related('media').get(pk=job_id)
+    handler = HANDLERS[job.kind]
+    try:
+        handler(job)
+    except Exception as exc:
+        logger.exception('Media job %s failed (attempt %s/%s)', job.pk, job.attempts, job.max_attempts)
+        job.last_error = ''.join(traceback.format_exception_only(type(exc), exc)).strip()
+        job.locked_by = ''
+        job.locked_at = None
+        if job.attempts >= job.max_attempts:
+            job.status = MediaJob.STATUS_FAILED
+            job.finished_at = timezone.now()
+            mark_media_failed([job.media_id])
+        else:
+            job.status = MediaJob.STATUS_QUEUED
+            job.run_after = timezone.now() + timedelta(seconds=RETRY_BACKOFF * 2 ** job.attempts)
+        job.save()
+        return False
+
+    job.status = MediaJob.STATUS_DONE
+    job.last_error = ''
+    job.finished_at = timezone.now()
+    job.save()
+    return True
+
+
+def run_pending(worker_id: str = 'inline') -> int:
+    """Synchronously drain every runnable job in this thread. Returns jobs run."""
+    count = 0
+    while True:
+        claimed = claim_jobs(worker_id, limit=10)
+        if not claimed:
+            return count
+        for job_id in claimed:
+            run_job(job_id)
+            count += 1
+
+
+class Worker:
+    """
+    Polls the job table and runs claimed jobs on a bounded thread pool.
+    Never claims more jobs than it has free threads, so other worker
+    processes can pick up the rest.
+    """
+
+    def __init__(self, concurrency: int = 4, poll_interval: float = 1.0):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._stop = threading.Event()
+        self._in_flight = threading.BoundedSemaphore(concurrency)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def export_metrics(self) -> None:
+        """Write this process's metrics where the web process's /api/metrics/ picks them up."""
+        directory = settings.METRICS_EXPORT_DIR
+        if not directory:
+            return
+        try:
+            os.makedirs(directory, exist_ok=True)
+            name = self.worker_id.replace(':', '-')
+            metrics.export(os.path.join(directory, f'media-worker-{name}.json'))
+        except OSError:
+            logger.warning('Could not export media worker metrics to %s', directory, exc_info=True)
+
+    def _run_in_thread(self, job_id: int) -> None:
+        try:
+            run_job(job_id)
+        except Exception:
+            logger.exception('Media job %s crashed the worker thread', job_id)
+        finally:
+            # Each pool thread has its own DB connection; don't leak them
+            connection.close()
+            self._in_flight.release()
+
+    def run(self, once: bool = False) -> None:
+        try:
+            self._poll(once)
+        finally:
+            # After the pool has drained, so the last jobs' timings are included
+            self.export_metrics()
+
+    def _poll(self, once: bool) -> None:
+        stale_checked = exported = None
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='media-worker') as pool:
+            while not self._stop.is_set():
+                close_old_connections()
+                # Not only at startup: other workers can die while this one runs
+                if stale_checked is None or time.monotonic() - stale_checked >= STALE_CHECK_INTERVAL:
+                    requeue_stale_jobs()
+                    stale_checked = time.monotonic()
+                if exported is None or time.monotonic() - exported >= METRICS_EXPORT_INTERVAL:
+                    self.export_metrics()
+                    exported = time.monotonic()
+                free = 0
+                while self._in_flight.acquire(blocking=False):
+                    free += 1
+                claimed = claim_jobs(self.worker_id, free) if free else []
+                # Give back the slots we didn't use
+                for _ in range(free - len(claimed)):
+                    self._in_flight.release()
+                for job_id in claimed:
+                    pool.submit(self._run_in_thread, job_id)
+                if once and not claimed and free == self.concurrency:
+                    break
+                if not claimed:
+                    time.sleep(self.poll_interval)
@@ -0,0 +1,58 @@
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.media.metadata import probe_or_error
+from core.models import PostMedia
+
+# Media probed per batch; each batch is written in one transaction
+BATCH_PER_WORKER = 16
+
+
+class Command(BaseCommand):
+    help = ('Store size, duration, codec and checksum for ready media processed before metadata existed. '
+            'Rows are committed batch by batch, so an interrupted run picks up where it stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes (default: one per CPU)')
+        parser.add_argument('--limit', type=int, default=None, help='Process at most this many media')
+
+    def handle(self, *args, **options):
+        # file_size is set for every probed row, decodable or not, so it marks progress
+        pending = PostMedia.objects.filter(file_size__isnull=True, status=PostMedia.STATUS_READY).order_by('pk')
+        if options['limit']:
+            pending = pending[:options['limit']]
+        pending_ids = list(pending.values_list('pk', flat=True))
+        total = len(pending_ids)
+        remaining = iter(pending_ids)
+
+        # Video probing holds the GIL for much of the container parsing, so
+        # use processes; children only see paths and return plain dicts.
+        # spawn: forking would copy this process's open database connection.
+        # The children import core.media.metadata only, never Django's app registry
+        workers = max(1, options['workers'])
+        context = multiprocessing.get_context('spawn')
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            while batch_ids := list(itertools.islice(remaining, workers * BATCH_PER_WORKER)):
+                batch = list(PostMedia.objects.filter(pk__in=batch_ids).order_by('pk'))
+                results = pool.map(probe_or_error, [
+                    (item.file.path, item.file.name, item.media_type == PostMedia.MEDIA_TYPE_VIDEO)
+                    for item in batch
+                ])
+                with transaction.atomic():
+                    for item, (metadata, error) in zip(batch, results):
+                        if error is not None:
+                            self.stderr.write(f'PostMedia {item.pk}: {error}')
+                            failed += 1
+                            continue
+                        item.set_metadata(metadata)
+                        item.save(update_fields=PostMedia.METADATA_FIELDS)
+                        done += 1
+                self.stdout.write(f'{done + failed}/{total}')
+        self.stdout.write(self.style.SUCCESS(f'Stored metadata for {done} media ({failed} could not be read).'))
@@ -0,0 +1,100 @@
+import os
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import feed_cache
+from core.models import MediaBlob, MediaRendition, PostMedia
+from core.signals import BLOB_FIELDS, BLOB_LIST_FIELDS, stored_blob_names
+from core.storage import content_addressed_name, digest_from_name, hash_file, media_storage
+
+
+class Command(BaseCommand):
+    help = (
+        'Move existing PostMedia files and thumbnails into content-addressed storage, '
+        'merge byte-identical duplicates and rebuild blob reference counts.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would change without touching files or rows')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        storage = media_storage()
+        renamed = {}  # legacy name -> content-addressed name
+        legacy_files = set()
+        reclaimed = 0
+        missing = 0
+
+        for media in PostMedia.objects.order_by('pk').iterator():
+            updates = {}
+            for field_name in BLOB_FIELDS:
+                name = getattr(media, field_name).name
+                if not name or digest_from_name(name):
+                    continue
+                if name not in renamed:
+                    path = storage.path(name)
+                    if not os.path.exists(path):
+                        self.stderr.write(f'PostMedia {media.pk}: {field_name} {name} is missing on disk')
+                        missing += 1
+                        continue
+                    new_name = content_addressed_name(os.path.dirname(name), hash_file(path), os.path.splitext(name)[1])
+                    if storage.exists(new_name) or new_name in renamed.values():
+                        reclaimed += os.path.getsize(path)
+                        legacy_files.add(path)
+                        self.stdout.write(f'{name} duplicates {new_name}')
+                    elif not dry_run:
+                        os.makedirs(os.path.dirname(storage.path(new_name)), exist_ok=True)
+                        os.replace(path, storage.path(new_name))
+                    renamed[name] = new_name
+                updates[field_name] = renamed[name]
+            if updates and not dry_run:
+                # queryset.update skips the signals: refcounts are rebuilt below,
+                # and the post is bumped here so no cached fragment keeps the
+                # legacy names (unlinked next) and /changes reports it
+                with transaction.atomic():
+                    PostMedia.objects.filter(pk=media.pk).update(**updates)
+                    feed_cache.invalidate([media.post_id])
+
+        if not dry_run:
+            for path in legacy_files:
+                os.unlink(path)
+            self.reuse_thumbnails()
+            self.rebuild_refcounts()
+
+        prefix = '[dry run] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}{len(renamed)} files moved to content-addressed names, '
+            f'{len(legacy_files)} duplicates merged, {reclaimed / 2 ** 20:.1f} MiB reclaimed, {missing} missing'
+        ))
+
+    @transaction.atomic
+    def reuse_thumbnails(self):
+        """Rows that now share a video with a thumbnailed row get its thumbnail."""
+        thumbnails = dict(
+            PostMedia.objects.exclude(thumbnail='').values_list('file', 'thumbnail')
+        )
+        post_ids = set()
+        for file_name, thumbnail in thumbnails.items():
+            rows = PostMedia.objects.filter(file=file_name, thumbnail='')
+            post_ids.update(rows.values_list('post_id', flat=True))
+            rows.update(thumbnail=thumbnail)
+        feed_cache.invalidate(post_ids)
+
+    @transaction.atomic
+    def rebuild_refcounts(self):
+        storage = media_storage()
+        counts = Counter()
+        for media in PostMedia.objects.only(*BLOB_FIELDS, *BLOB_LIST_FIELDS).iterator():
+            counts.update(stored_blob_names(media))
+        for name in MediaRendition.objects.values_list('file', flat=True).iterator():
+            if digest_from_name(name):
+                counts[name] += 1
+        MediaBlob.objects.exclude(name__in=counts).delete()
+        for name, refcount in counts.items():
+            MediaBlob.objects.update_or_create(
+                name=name,
+                defaults={'refcount': refcount, 'size': storage.size(name) if storage.exists(name) else 0},
+            )
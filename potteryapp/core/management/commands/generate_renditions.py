@@ -0,0 +1,62 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from PIL import Image
+
+from core.models import PostMedia
+from core.media.renditions import render_ladder, store
+
+# Media rendered per batch; bounds how many results wait in memory for the main thread
+BATCH_PER_WORKER = 8
+
+
+def render_and_store(path: str, placeholder: bool):
+    """Decode, downscale, encode and write one media's renditions (and placeholder). No database access."""
+    try:
+        ladder = render_ladder(path, placeholder=placeholder)
+        store(ladder.renditions)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        return None, exc
+    for rendition in ladder.renditions:
+        rendition.data = b''  # On disk now
+    return ladder, None
+
+
+class Command(BaseCommand):
+    help = ('Generate responsive WebP/JPEG renditions, and BlurHash placeholders, for ready media uploaded '
+            'before they existed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Images rendered in parallel (default: 4)')
+        parser.add_argument('--limit', type=int, default=None, help='Process at most this many media')
+        parser.add_argument('--force', action='store_true', help='Regenerate renditions that already exist')
+
+    def handle(self, *args, **options):
+        pending = PostMedia.objects.filter(status=PostMedia.STATUS_READY).order_by('pk')
+        if not options['force']:
+            # Placeholders of images come from the smallest rung, so missing ones re-render the ladder
+            pending = pending.filter(Q(renditions__isnull=True) | Q(blurhash='')).distinct()
+        if options['limit']:
+            pending = pending[:options['limit']]
+        # Ids up front: rows are written while we go, and SQLite cursors see their own writes
+        pending_ids = iter(list(pending.values_list('pk', flat=True)))
+
+        # Pillow releases the GIL while decoding, resizing and encoding, so
+        # threads render in parallel; rows are written from this thread only
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='renditions') as pool:
+            while batch_ids := list(itertools.islice(pending_ids, options['workers'] * BATCH_PER_WORKER)):
+                batch = [item for item in PostMedia.objects.filter(pk__in=batch_ids).order_by('pk') if item.still_image]
+                results = pool.map(render_and_store, [item.still_image.path for item in batch],
+                                   [not item.blurhash or options['force'] for item in batch])
+                for item, (ladder, error) in zip(batch, results):
+                    if error is not None:
+                        self.stderr.write(f'PostMedia {item.pk}: {error}')
+                        failed += 1
+                        continue
+                    item.save_renditions(ladder.renditions, ladder.placeholder)
+                    done += 1
+        self.stdout.write(self.style.SUCCESS(f'Generated renditions for {done} media ({failed} could not be decoded).'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core.models import PostMedia
+
+
+class Command(BaseCommand):
+    help = 'Compute perceptual hashes for ready media uploaded before "similar posts" existed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Hash at most this many media')
+
+    def handle(self, *args, **options):
+        pending = PostMedia.objects.filter(phash__isnull=True, status=PostMedia.STATUS_READY).order_by('pk')
+        if options['limit']:
+            pending = pending[:options['limit']]
+        hashed = skipped = 0
+        for media in pending.iterator():
+            media.compute_phash()
+            if media.phash is None:
+                skipped += 1
+            else:
+                hashed += 1
+        self.stdout.write(self.style.SUCCESS(f'Hashed {hashed} media ({skipped} could not be decoded).'))
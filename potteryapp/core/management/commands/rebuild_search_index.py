@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = 'Repopulate the caption/username full-text search index from the posts table.'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('Full-text search needs SQLite FTS5; this database uses icontains instead.')
+        with transaction.atomic():
+            count = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} posts.'))
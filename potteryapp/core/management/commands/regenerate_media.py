@@ -0,0 +1,174 @@
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.media.derivatives import Task, regenerate
+from core.models import PostMedia
+from core.signals import send_bulk_post_save
+
+STEPS = frozenset({'normalize', 'faststart', 'thumbnail', 'storyboard', 'metadata', 'phash'})
+
+
+def missing_steps(media: PostMedia) -> frozenset:
+    """The steps PostMedia.process() would still run for this row."""
+    steps = set()
+    if media.media_type == PostMedia.MEDIA_TYPE_VIDEO:
+        if media.is_faststart is False:  # None: not an MP4/MOV, nothing to remux
+            steps.add('faststart')
+        if not media.thumbnail:
+            steps.add('thumbnail')
+        if not media.storyboard:
+            steps.add('storyboard')
+    elif media.original_size is None:
+        steps.add('normalize')
+    if media.file_size is None:
+        steps.add('metadata')
+    if media.phash is None:
+        steps.add('phash')
+    return frozenset(steps)
+
+
+class Command(BaseCommand):
+    help = ('Regenerate thumbnails, storyboards, metadata and perceptual hashes of existing media, and normalize '
+            'images, on a process pool. Progress is checkpointed after every batch, so running the same command again resumes. '
+            'Renditions are left to generate_renditions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing-thumbnail', action='store_true', help='Only videos without a thumbnail')
+        parser.add_argument('--media-type', choices=[PostMedia.MEDIA_TYPE_IMAGE, PostMedia.MEDIA_TYPE_VIDEO])
+        parser.add_argument('--since', type=date.fromisoformat, help='Only media created on or after this date')
+        parser.add_argument('--until', type=date.fromisoformat, help='Only media created before this date')
+        parser.add_argument('--force', action='store_true',
+                            help='Redo every step for the selected rows, not only what is missing')
+        parser.add_argument('--limit', type=int, default=None, help='Process at most this many media')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes (default: one per CPU)')
+        parser.add_argument('--batch-size', type=int, default=100, help='Rows written per bulk_update')
+        parser.add_argument('--checkpoint', default='regenerate_media.checkpoint.json',
+                            help='Progress file; removed when the run completes')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint')
+
+    def select(self, options):
+        # Rows still processing belong to the media worker
+        queryset = PostMedia.objects.exclude(status=PostMedia.STATUS_PROCESSING).order_by('pk')
+        if options['missing_thumbnail']:
+            queryset = queryset.filter(media_type=PostMedia.MEDIA_TYPE_VIDEO, thumbnail='')
+        if options['media_type']:
+            queryset = queryset.filter(media_type=options['media_type'])
+        if options['since']:
+            queryset = queryset.filter(created_at__date__gte=options['since'])
+        if options['until']:
+            queryset = queryset.filter(created_at__date__lt=options['until'])
+        if not options['force']:
+            queryset = queryset.filter(
+                Q(media_type=PostMedia.MEDIA_TYPE_VIDEO) & (Q(thumbnail='') | Q(storyboard='') | Q(is_faststart=False))
+                | Q(media_type=PostMedia.MEDIA_TYPE_IMAGE, original_size__isnull=True)
+                | Q(file_size__isnull=True) | Q(phash__isnull=True)
+            )
+        return queryset
+
+    def load_checkpoint(self, path, selection):
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint['selection'] != selection:
+            raise CommandError(f'{path} belongs to a run with different options; pass --restart to discard it')
+        return checkpoint
+
+    def save_checkpoint(self, path, checkpoint):
+        # Write-then-rename, so an interrupt never leaves half a file behind
+        with open(path + '.tmp', 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(path + '.tmp', path)
+
+    def handle(self, *args, **options):
+        selection = {key: str(options[key]) for key in ('missing_thumbnail', 'media_type', 'since', 'until', 'force')}
+        path = options['checkpoint']
+        checkpoint = None if options['restart'] else self.load_checkpoint(path, selection)
+        if checkpoint is None:
+            checkpoint = {'selection': selection, 'last_pk': 0, 'done': 0, 'failed': 0}
+        else:
+            self.stdout.write(f"Resuming after PostMedia {checkpoint['last_pk']}")
+
+        pending = self.select(options).filter(pk__gt=checkpoint['last_pk'])
+        if options['limit']:
+            pending = pending[:options['limit']]
+        # Ids up front: rows are written while we go, and SQLite cursors see their own writes
+        pending_ids = list(pending.values_list('pk', flat=True))
+        remaining = iter(pending_ids)
+
+        # spawn: forking would copy this process's open database connection.
+        # Workers import core.media.derivatives only and write files straight into
+        # media storage; every database write happens here, once per batch
+        workers = max(1, options['workers'])
+        context = multiprocessing.get_context('spawn')
+        started = time.monotonic()
+        done = failed = normalized = saved = 0
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            while batch_ids := list(itertools.islice(remaining, options['batch_size'])):
+                batch = {item.pk: item for item in PostMedia.objects.filter(pk__in=batch_ids)}
+                tasks = [
+                    Task(pk=item.pk, media_root=str(settings.MEDIA_ROOT), name=item.file.name,
+                         is_video=item.media_type == PostMedia.MEDIA_TYPE_VIDEO,
+                         steps=STEPS if options['force'] else missing_steps(item),
+                         thumbnail='' if options['force'] else item.thumbnail.name,
+                         max_edge=settings.IMAGE_MAX_EDGE, max_pixels=settings.IMAGE_MAX_PIXELS,
+                         keep_original=settings.IMAGE_KEEP_ORIGINALS)
+                    for item in sorted(batch.values(), key=lambda item: item.pk)
+                ]
+                updated = []
+                batch_failed = 0
+                for result in pool.map(regenerate, tasks):
+                    if result.error:
+                        self.stderr.write(f'PostMedia {result.pk}: {result.error}')
+                        batch_failed += 1
+                        continue
+                    item = batch[result.pk]
+                    item.set_metadata(result.fields)
+                    if 'phash' in result.fields:
+                        item.hashed_at = timezone.now() if item.phash is not None else None
+                    if 'file' in result.fields and item.media_type == PostMedia.MEDIA_TYPE_IMAGE:
+                        normalized += 1
+                        saved += item.original_size - item.file_size
+                    item.status = PostMedia.STATUS_READY
+                    updated.append(item)
+                self.write_batch(updated)
+                done += len(updated)
+                failed += batch_failed
+
+                checkpoint.update(last_pk=batch_ids[-1], done=checkpoint['done'] + len(updated),
+                                  failed=checkpoint['failed'] + batch_failed)
+                self.save_checkpoint(path, checkpoint)
+                elapsed = time.monotonic() - started
+                self.stdout.write(f'{done + failed}/{len(pending_ids)} media, {(done + failed) / elapsed:.1f}/s')
+
+        # A --limit run leaves its checkpoint for the next one to resume from
+        if os.path.exists(path) and not self.select(options).filter(pk__gt=checkpoint['last_pk']).exists():
+            os.unlink(path)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Regenerated {done} media in {elapsed:.1f}s ({done / elapsed:.1f}/s), {failed} failed.'
+        ))
+        if normalized:
+            self.stdout.write(f'Normalized {normalized} images, saving {saved / 2 ** 20:.1f} MiB.')
+        if checkpoint['done'] != done or checkpoint['failed'] != failed:
+            self.stdout.write(f"Including earlier runs: {checkpoint['done']} regenerated, {checkpoint['failed']} failed.")
+
+    def write_batch(self, media):
+        if not media:
+            return
+        fields = PostMedia.DERIVED_FIELDS + ['hashed_at', 'status']
+        with transaction.atomic():
+            PostMedia.objects.bulk_update(media, fields)
+            send_bulk_post_save(PostMedia, media, created=False, update_fields=fields)
@@ -0,0 +1,31 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from core.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run the background worker that thumbnails and post-processes uploaded media.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Number of jobs processed in parallel (default: 4)')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to sleep when the queue is empty (default: 1.0)')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue and exit instead of polling forever')
+
+    def handle(self, *args, **options):
+        worker = Worker(concurrency=options['concurrency'], poll_interval=options['poll_interval'])
+
+        # Finish in-flight jobs on Ctrl-C / SIGTERM instead of abandoning them
+        def shutdown(signum, frame):
+            self.stdout.write('Stopping after in-flight jobs finish...')
+            worker.stop()
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        self.stdout.write(f'Media worker {worker.worker_id} started with {worker.concurrency} threads')
+        worker.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS('Media worker stopped'))
@@ -0,0 +1,9 @@
+"""
+Media processing: decoding, encoding and analysing uploaded files.
+
+Every module in this package imports OpenCV, NumPy or Pillow at module
+level. Nothing outside it does: models and commands import from here inside
+the functions that need it, so web workers, migrations and management
+commands that never touch pixels never load those libraries (a test keeps
+it that way).
+"""
@@ -0,0 +1,179 @@
+"""
+Files and values derived from an uploaded media file.
+
+These are the steps of PostMedia.process() that only need the file: poster
+thumbnail (and its placeholder), storyboard, metadata, perceptual hash,
+faststart remux and image normalization. They
+take paths and a storage and return PostMedia field values, with no database
+access, so the same code runs in the media worker (through PostMedia
+methods) and in regenerate_media's worker processes, which don't load
+Django's app registry at all.
+"""
+import os
+import posixpath
+from dataclasses import dataclass, field
+from io import BytesIO
+
+import cv2
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from PIL import Image
+
+from ..faststart import faststart_stored
+from ..metrics import MEDIA_STEP_SECONDS
+from .metadata import file_metadata, probe, video_metadata
+from .normalize import normalize_stored
+from .phash import image_dhash, to_signed
+from .placeholders import placeholder
+from ..storage import STORYBOARD_DIR, THUMBNAIL_DIR, ContentAddressedStorage
+from .storyboards import build_storyboard, encode_sheet, sheet_reference, webvtt
+from .thumbnails import select_poster_frame
+
+THUMBNAIL_QUALITY = 85
+
+
+def save_bytes(storage: Storage, directory: str, filename: str, data: bytes) -> str:
+    """Store ``data`` under ``directory``; returns the (content-addressed) name."""
+    return storage.save(posixpath.join(directory, filename), ContentFile(data))
+
+
+def frame_image(frame) -> Image.Image:
+    """A BGR OpenCV frame as an RGB Pillow image."""
+    return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+
+def encode_thumbnail(image: Image.Image) -> bytes:
+    """The JPEG poster thumbnail of an RGB image."""
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=THUMBNAIL_QUALITY)
+    return buffer.getvalue()
+
+
+def store_storyboard(storage: Storage, storyboard) -> dict:
+    """Write the sprite sheets and WebVTT index of a core.media.storyboards.Storyboard."""
+    directory = STORYBOARD_DIR.rstrip('/')
+    sheet_names = [save_bytes(storage, directory, 'sheet.jpg', encode_sheet(sheet)) for sheet in storyboard.sheets]
+    vtt = webvtt(storyboard.cues, [sheet_reference(name, directory) for name in sheet_names])
+    return {
+        'storyboard': save_bytes(storage, directory, 'storyboard.vtt', vtt.encode()),
+        'storyboard_sheets': sheet_names,
+    }
+
+
+def decode_video(path: str, storage: Storage, *, metadata: bool, thumbnail: bool, storyboard: bool) -> dict:
+    """
+    Open the video once and derive everything it can give: its metadata,
+    the poster thumbnail (with its placeholder, from the same decoded frame)
+    and the scrub storyboard, each only if asked for.
+    Returns the PostMedia field values; raises if the video can't be read.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            raise ValueError(f'OpenCV could not open {os.path.basename(path)}')
+        # Container properties first: reading them needs no decoding
+        fields = video_metadata(cap) if metadata else {}
+        poster = sprites = None
+        if thumbnail:
+            # Seek through the clip and keep the sharpest, best exposed frame
+            with MEDIA_STEP_SECONDS.time(('poster_frame',)):
+                poster = select_poster_frame(cap)
+            if poster is None:
+                raise ValueError(f'No decodable frame in {os.path.basename(path)}')
+        if storyboard:
+            # Same capture: seek again at fixed intervals for the scrub preview
+            with MEDIA_STEP_SECONDS.time(('storyboard',)):
+                sprites = build_storyboard(cap)
+    finally:
+        cap.release()
+
+    if metadata:
+        # After any faststart remux, so these describe the bytes clients download
+        fields.update(file_metadata(path))
+    if poster is not None:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        still = frame_image(poster.frame)
+        with MEDIA_STEP_SECONDS.time(('thumbnail_encode',)):
+            jpeg = encode_thumbnail(still)
+        fields['thumbnail'] = save_bytes(storage, THUMBNAIL_DIR, f'thumb_{stem}.jpg', jpeg)
+        with MEDIA_STEP_SECONDS.time(('placeholder',)):
+            fields.update(placeholder(still))
+    if sprites is not None:
+        fields.update(store_storyboard(storage, sprites))
+    return fields
+
+
+def still_phash(path: str) -> int | None:
+    """Signed dHash of an image (see core.media.phash), or None if Pillow can't decode it."""
+    try:
+        return to_signed(image_dhash(path))
+    except (OSError, ValueError):
+        return None
+
+
+@dataclass
+class Task:
+    """What regenerate() needs to know about one PostMedia."""
+    pk: int
+    media_root: str
+    name: str
+    is_video: bool
+    # Which of 'normalize', 'faststart', 'thumbnail', 'storyboard', 'metadata', 'phash' to (re)make
+    steps: frozenset
+    thumbnail: str = ''  # Existing thumbnail name, if it is being kept
+    # settings.IMAGE_MAX_EDGE, IMAGE_MAX_PIXELS and IMAGE_KEEP_ORIGINALS, for 'normalize'
+    max_edge: int = 0
+    max_pixels: int = 0
+    keep_original: bool = True
+
+
+@dataclass
+class Result:
+    pk: int
+    fields: dict = field(default_factory=dict)
+    error: str = ''  # "ExceptionType: message" if a step failed
+
+
+def regenerate(task: Task) -> Result:
+    """
+    Run the requested steps for one media file, writing into storage under
+    ``task.media_root``. For process pools: never raises, failures come
+    back as Result.error.
+    """
+    storage = ContentAddressedStorage(location=task.media_root)
+    result = Result(task.pk)
+    try:
+        path = storage.path(task.name)
+        if task.is_video:
+            if 'faststart' in task.steps:
+                result.fields.update(faststart_stored(storage, task.name))
+                path = storage.path(result.fields.get('file', task.name))
+            # A replaced file needs its size and checksum again
+            if 'file' in result.fields or task.steps & {'metadata', 'thumbnail', 'storyboard'}:
+                result.fields.update(decode_video(
+                    path, storage,
+                    metadata='metadata' in task.steps or 'file' in result.fields,
+                    thumbnail='thumbnail' in task.steps,
+                    storyboard='storyboard' in task.steps,
+                ))
+        else:
+            if 'normalize' in task.steps:
+                result.fields.update(normalize_stored(
+                    storage, task.name,
+                    max_edge=task.max_edge, max_pixels=task.max_pixels, keep_original=task.keep_original,
+                ))
+            # A replaced file needs its size and checksum again
+            if 'metadata' in task.steps or 'file' in result.fields:
+                name = result.fields.get('file', task.name)
+                result.fields.update(probe(storage.path(name), name, is_video=False))
+        if 'phash' in task.steps:
+            still_name = ((result.fields.get('thumbnail') or task.thumbnail) if task.is_video
+                          else result.fields.get('file', task.name))
+            if still_name:
+                result.fields['phash'] = still_phash(storage.path(still_name))
+    except Exception as exc:
+        result.error = f'{type(exc).__name__}: {exc}'
+    return result
@@ -0,0 +1,94 @@
+"""
+Media metadata clients need to lay out a cell before downloading the file.
+
+Video properties come from the capture the media worker already opens for
+the poster frame and storyboard (PostMedia.decode_video), so reading them
+costs a few ``cap.get`` calls and no extra open or decode. Image dimensions
+come from the file header; Pillow doesn't decode pixels to report them.
+
+Width and height are the display size, with rotation applied: what the
+client will actually draw. ``rotation`` is kept alongside for players that
+handle the transform themselves.
+
+Everything here works on paths with no database access, so the
+backfill_media_metadata command can run ``probe`` in worker processes.
+"""
+import os
+
+import cv2
+from PIL import Image
+
+from ..storage import digest_from_name, hash_file
+
+# EXIF orientation -> clockwise degrees to display upright (mirroring ignored)
+EXIF_ROTATIONS = {3: 180, 4: 180, 5: 270, 6: 90, 7: 90, 8: 270}
+
+
+def fourcc_name(value: float) -> str:
+    """'avc1', 'hvc1', 'MJPG'... from CAP_PROP_FOURCC; empty if the backend doesn't say."""
+    code = int(value)
+    text = ''.join(chr((code >> shift) & 0xFF) for shift in (0, 8, 16, 24))
+    return text if text.isprintable() and text.strip('\0 ') else ''
+
+
+def video_metadata(cap: cv2.VideoCapture) -> dict:
+    """Properties of an opened capture, as PostMedia field values."""
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or None
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or None
+    rotation = int(cap.get(cv2.CAP_PROP_ORIENTATION_META)) % 360
+    # With auto-rotation on (OpenCV's default) the reported size is already upright
+    if rotation in (90, 270) and not cap.get(cv2.CAP_PROP_ORIENTATION_AUTO):
+        width, height = height, width
+    fps = cap.get(cv2.CAP_PROP_FPS) or None
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+    return {
+        'width': width,
+        'height': height,
+        'rotation': rotation,
+        'duration': frame_count / fps if fps and frame_count else None,
+        'fps': fps,
+        'frame_count': frame_count,
+        'codec': fourcc_name(cap.get(cv2.CAP_PROP_FOURCC)),
+    }
+
+
+def image_metadata(path: str) -> dict:
+    """Upright size and EXIF rotation of an image, read from its header."""
+    with Image.open(path) as image:
+        width, height = image.size
+        rotation = EXIF_ROTATIONS.get(image.getexif().get(0x0112, 1), 0)
+    if rotation in (90, 270):
+        width, height = height, width
+    return {'width': width, 'height': height, 'rotation': rotation}
+
+
+def file_metadata(path: str, name: str = '') -> dict:
+    """Size and SHA-256 of the stored bytes. A content-addressed ``name`` already carries the digest."""
+    checksum = digest_from_name(name)
+    return {'file_size': os.path.getsize(path), 'checksum': checksum or hash_file(path)}
+
+
+def probe(path: str, name: str, is_video: bool) -> dict:
+    """All metadata for one stored file. Undecodable media still get size and checksum."""
+    metadata = file_metadata(path, name)
+    if is_video:
+        cap = cv2.VideoCapture(path)
+        try:
+            if cap.isOpened():
+                metadata.update(video_metadata(cap))
+        finally:
+            cap.release()
+    else:
+        try:
+            metadata.update(image_metadata(path))
+        except (OSError, ValueError, Image.DecompressionBombError):
+            pass
+    return metadata
+
+
+def probe_or_error(item: tuple[str, str, bool]):
+    """probe() for one (path, name, is_video) as a (metadata, error) pair, for process pools."""
+    try:
+        return probe(*item), None
+    except (OSError, ValueError) as exc:
+        return None, exc
@@ -0,0 +1,226 @@
+"""
+Normalizing uploaded images before they are served.
+
+Phones upload full-resolution JPEGs that every client has to rotate by their
+EXIF orientation, carrying GPS position and camera details; screenshots and
+exported photos arrive as large PNGs. ``normalize`` makes the file the app
+serves instead:
+
+- pixels turned upright, so no client needs the EXIF orientation;
+- at most ``max_edge`` pixels on the long side;
+- EXIF, XMP, IPTC and comments stripped. The ICC profile is kept, since
+  dropping it shifts colors;
+- a PNG that holds a photo re-encoded as JPEG when that is smaller.
+
+A JPEG that only needs its metadata stripped is rewritten losslessly: the
+metadata segments are cut out and the compressed scans copied as they are.
+Anything else is decoded once. For a JPEG, ``Image.draft`` asks the decoder
+for the smallest DCT scale that still covers ``max_edge``. A decode larger
+than ``max_pixels`` is refused before any pixels are allocated, which caps
+what one upload can cost a worker in memory.
+
+No database access: the media worker runs it through
+PostMedia.normalize_image, and regenerate_media runs it in its worker
+processes (see core.media.derivatives.regenerate).
+"""
+import logging
+import math
+import os
+import posixpath
+import struct
+from dataclasses import dataclass
+from io import BytesIO
+
+from django.core.files import File
+from django.core.files.storage import Storage
+from PIL import Image, ImageOps
+
+from ..metrics import MEDIA_BYTES_SAVED
+from ..storage import MEDIA_DIR, ORIGINAL_DIR
+from .renditions import REDUCING_GAP
+
+logger = logging.getLogger(__name__)
+
+JPEG_QUALITY = 88
+# Formats normalized; others (HEIC, GIF, WebP...) are kept as uploaded
+JPEG_FORMATS = {'JPEG', 'MPO'}
+PNG_FORMAT = 'PNG'
+# A PNG with at least this many distinct colors in a PHOTO_SAMPLE-square
+# sample is a photo; screenshots and drawings stay far below
+PHOTO_SAMPLE = 64
+PHOTO_MIN_COLORS = 1024
+
+# JPEG segments dropped by strip_jpeg_metadata: APP1 (EXIF, XMP), APP12,
+# APP13 (IPTC, Photoshop) and COM. APP2 is dropped too unless it holds the
+# ICC profile (iPhones put their multi-picture index there)
+JPEG_METADATA_MARKERS = {0xE1, 0xEC, 0xED, 0xFE}
+JPEG_APP2 = 0xE2
+ICC_SIGNATURE = b'ICC_PROFILE\0'
+JPEG_SOS = 0xDA
+JPEG_EOI = b'\xff\xd9'
+# Markers with no length field
+JPEG_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD8)}
+
+
+@dataclass
+class Normalized:
+    data: bytes
+    ext: str
+    width: int
+    height: int
+
+
+def strip_jpeg_metadata(data: bytes) -> bytes:
+    """
+    ``data`` without its metadata segments and anything after the image
+    (MPO secondary images, HDR gain maps). Pixels are untouched. Raises
+    ValueError if the marker structure is broken.
+    """
+    if data[:2] != b'\xff\xd8':
+        raise ValueError('Not a JPEG')
+    kept = [data[:2]]
+    offset = 2
+    while True:
+        if offset + 4 > len(data) or data[offset] != 0xFF:
+            raise ValueError('Truncated JPEG header')
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            offset += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            kept.append(data[offset:offset + 2])
+            offset += 2
+            continue
+        length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+        segment = data[offset:offset + 2 + length]
+        if marker == JPEG_SOS:
+            # Scans run to EOI; inside them 0xFF is always followed by 0x00 or a restart marker
+            end = data.find(JPEG_EOI, offset + 2 + length)
+            if end < 0:
+                raise ValueError('JPEG has no end of image marker')
+            kept.append(data[offset:end + 2])
+            return b''.join(kept)
+        icc = marker == JPEG_APP2 and segment[4:].startswith(ICC_SIGNATURE)
+        if marker not in JPEG_METADATA_MARKERS and (marker != JPEG_APP2 or icc):
+            kept.append(segment)
+        offset += 2 + length
+
+
+def is_photo(image: Image.Image) -> bool:
+    """Whether an RGB(A) image has the many distinct colors of a photo."""
+    sample = image.convert('RGB').resize((PHOTO_SAMPLE, PHOTO_SAMPLE), Image.NEAREST)
+    return len(sample.getcolors(PHOTO_SAMPLE * PHOTO_SAMPLE)) >= PHOTO_MIN_COLORS
+
+
+def has_alpha(image: Image.Image) -> bool:
+    """Whether ``image`` has any pixel that isn't fully opaque."""
+    if image.mode in ('RGBA', 'LA', 'PA'):
+        return image.getchannel('A').getextrema()[0] < 255
+    return 'transparency' in image.info
+
+
+def encode_jpeg(image: Image.Image, icc_profile: bytes | None) -> bytes:
+    # An empty comment: Pillow would otherwise copy the decoded one over
+    buffer = BytesIO()
+    image.convert('RGB').save(buffer, format='JPEG', quality=JPEG_QUALITY, progressive=True, optimize=True,
+                              icc_profile=icc_profile, comment=b'')
+    return buffer.getvalue()
+
+
+def encode_png(image: Image.Image, icc_profile: bytes | None) -> bytes:
+    # No pnginfo: text chunks (and any eXIf) are dropped
+    buffer = BytesIO()
+    image.save(buffer, format='PNG', optimize=True, icc_profile=icc_profile)
+    return buffer.getvalue()
+
+
+def decode_upright(image: Image.Image, orientation: int, max_edge: int, max_pixels: int) -> Image.Image:
+    """Decode an opened image upright, no larger than ``max_edge``; refuses more than ``max_pixels``."""
+    raw_width, raw_height = image.size
+    scale = min(1.0, max_edge / max(raw_width, raw_height))
+    if image.format in JPEG_FORMATS:
+        image.draft('RGB', (math.ceil(raw_width * scale), math.ceil(raw_height * scale)))
+    if image.width * image.height > max_pixels:
+        raise Image.DecompressionBombError(
+            f'{image.width}x{image.height} decode is over the {max_pixels} pixel limit'
+        )
+    image.load()
+    image = ImageOps.exif_transpose(image) if orientation != 1 else image
+    long_edge = max(image.size)
+    if long_edge <= max_edge:
+        return image
+    width = max(1, round(image.width * max_edge / long_edge))
+    height = max(1, round(image.height * max_edge / long_edge))
+    factor = min(image.width // width, image.height // height) // REDUCING_GAP
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def normalize(data: bytes, max_edge: int, max_pixels: int) -> Normalized | None:
+    """
+    The normalized form of an uploaded image, or None when the upload is
+    best kept as it is: already normalized, a format this doesn't handle
+    (HEIC, animations...), or nothing would get smaller. Raises OSError,
+    ValueError or Image.DecompressionBombError for unreadable images.
+    """
+    with Image.open(BytesIO(data)) as image:
+        fmt = image.format
+        if fmt not in JPEG_FORMATS and (fmt != PNG_FORMAT or getattr(image, 'is_animated', False)):
+            return None
+        orientation = image.getexif().get(0x0112, 1)
+        oversized = max(image.size) > max_edge
+        if fmt in JPEG_FORMATS and orientation == 1 and not oversized:
+            stripped = strip_jpeg_metadata(data)
+            if len(stripped) >= len(data):
+                return None
+            return Normalized(stripped, '.jpg', *image.size)
+
+        if image.mode == 'CMYK':
+            # Its ICC profile can't describe the RGB re-encode; leave print exports alone
+            return None
+        icc_profile = image.info.get('icc_profile')
+        upright = decode_upright(image, orientation, max_edge, max_pixels)
+        if fmt in JPEG_FORMATS:
+            return Normalized(encode_jpeg(upright, icc_profile), '.jpg', *upright.size)
+
+        candidates = []
+        if not has_alpha(upright) and is_photo(upright):
+            candidates.append(Normalized(encode_jpeg(upright, icc_profile), '.jpg', *upright.size))
+        candidates.append(Normalized(encode_png(upright, icc_profile), '.png', *upright.size))
+        best = min(candidates, key=lambda candidate: len(candidate.data))
+        # Turned or shrunk: always replace. Otherwise only if it saves bytes
+        if orientation != 1 or oversized or len(best.data) < len(data):
+            return best
+        return None
+
+
+def normalize_stored(storage: Storage, name: str, *, max_edge: int, max_pixels: int,
+                     keep_original: bool) -> dict:
+    """
+    Normalize the image stored as ``name``; returns PostMedia field values.
+    ``original_size`` is always set. When the image is replaced, ``file``
+    names the normalized one and ``original`` a cold copy of the upload
+    under ORIGINAL_DIR if ``keep_original``. Images that can't be decoded,
+    or only over ``max_pixels``, are logged and kept as uploaded.
+    """
+    path = storage.path(name)
+    with open(path, 'rb') as f:
+        data = f.read()
+    fields = {'original_size': len(data)}
+    try:
+        normalized = normalize(data, max_edge, max_pixels)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        logger.warning('Could not normalize %s: %s', name, exc)
+        return fields
+    if normalized is None:
+        return fields
+
+    fields['file'] = storage.save(posixpath.join(MEDIA_DIR, f'image{normalized.ext}'), File(BytesIO(normalized.data)))
+    if keep_original:
+        ext = os.path.splitext(name)[1]
+        with open(path, 'rb') as f:
+            fields['original'] = storage.save(posixpath.join(ORIGINAL_DIR, f'original{ext}'), File(f))
+    MEDIA_BYTES_SAVED.inc((normalized.ext.lstrip('.'),), len(data) - len(normalized.data))
+    return fields
@@ -0,0 +1,159 @@
+"""
+Perceptual hashing and Hamming-radius search.
+
+``dhash`` reduces an image to 64 bits: shrink the grayscale image to 9x8,
+then record for each row whether each pixel is brighter than its left
+neighbour. Re-encodes, resizes and small crops or exposure changes flip only
+a few bits, so photos of the same piece end up a small Hamming distance apart.
+
+``HashIndex`` answers "every hash within r bits of q" with multi-index
+hashing (Norouzi et al.): each hash is split into ``chunks`` 16-bit
+substrings, each indexed in its own table. If two hashes differ in at most r
+bits, then by pigeonhole at least one substring differs in at most
+``r // chunks`` bits, so probing each table with the query's substring and
+its near neighbours finds every candidate; candidates are then checked with
+one XOR and popcount. With 4 chunks and r <= 7 that is 68 bucket probes per
+query, independent of the number of hashes; r <= 11 takes 548, and past
+that a linear scan is as fast (benchmarks/similar_pieces), which is why the
+API caps the radius at 10.
+"""
+import itertools
+from array import array
+from collections.abc import Iterable
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+HASH_BITS = 64
+HASH_SIZE = 8
+# Decoding at a fraction of full size is plenty for a 9x8 hash; JPEG can do it in the DCT
+DECODE_SIZE = (64, 64)
+
+SIGN_BIT = 1 << (HASH_BITS - 1)
+
+
+def dhash(gray: np.ndarray) -> int:
+    """64-bit difference hash of a 2-D grayscale array."""
+    small = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def image_dhash(path: str) -> int:
+    """dhash of an image file, as displayed (EXIF orientation applied)."""
+    with Image.open(path) as image:
+        image.draft('L', DECODE_SIZE)
+        image = ImageOps.exif_transpose(image).convert('L')
+        return dhash(np.asarray(image))
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    """Set bits per element of a uint64 array."""
+    if hasattr(np, 'bitwise_count'):  # NumPy 2.0+
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def to_signed(value: int) -> int:
+    """Unsigned 64-bit hash -> value that fits a signed BIGINT column."""
+    return value - (1 << HASH_BITS) if value & SIGN_BIT else value
+
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+class HashIndex:
+    """
+    In-memory multi-index hash table of (key, group, hash) entries.
+
+    ``key`` identifies an entry (a PostMedia id) and ``group`` is what results
+    are reported by (its post id). Entries live in parallel arrays so a
+    million of them cost tens of MB rather than a million Python objects;
+    removed entries are tombstoned in place.
+    """
+
+    def __init__(self, chunks: int = 4):
+        if HASH_BITS % chunks:
+            raise ValueError('chunks must divide 64')
+        self.chunks = chunks
+        self.chunk_bits = HASH_BITS // chunks
+        self.chunk_mask = (1 << self.chunk_bits) - 1
+        self.tables: list[dict[int, array]] = [{} for _ in range(chunks)]
+        self.hashes = array('Q')
+        self.groups = array('q')
+        self.keys = array('q')
+        self.positions: dict[int, int] = {}
+        self._flip_masks: dict[int, list[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def _substrings(self, value: int):
+        for chunk in range(self.chunks):
+            yield chunk, (value >> (chunk * self.chunk_bits)) & self.chunk_mask
+
+    def flip_masks(self, radius: int) -> list[int]:
+        """Every chunk-sized bit mask with at most ``radius`` bits set."""
+        if radius not in self._flip_masks:
+            masks = [0]
+            for weight in range(1, radius + 1):
+                for bits in itertools.combinations(range(self.chunk_bits), weight):
+                    masks.append(sum(1 << bit for bit in bits))
+            self._flip_masks[radius] = masks
+        return self._flip_masks[radius]
+
+    def add(self, key: int, group: int, value: int) -> None:
+        """Insert or replace the entry for ``key``."""
+        position = self.positions.get(key)
+        if position is not None:
+            if self.hashes[position] == value:
+                self.groups[position] = group
+                return
+            self.remove(key)
+        position = len(self.hashes)
+        self.hashes.append(value)
+        self.groups.append(group)
+        self.keys.append(key)
+        self.positions[key] = position
+        for chunk, substring in self._substrings(value):
+            bucket = self.tables[chunk].get(substring)
+            if bucket is None:
+                bucket = self.tables[chunk][substring] = array('q')
+            bucket.append(position)
+
+    def extend(self, entries: Iterable[tuple[int, int, int]]) -> None:
+        for key, group, value in entries:
+            self.add(key, group, value)
+
+    def remove(self, key: int) -> None:
+        position = self.positions.pop(key, None)
+        if position is not None:
+            # Bucket entries stay behind and are skipped by search()
+            self.groups[position] = -1
+
+    def search(self, value: int, radius: int) -> list[tuple[int, int, int]]:
+        """Every live (key, group, distance) within ``radius`` bits of ``value``."""
+        masks = self.flip_masks(radius // self.chunks)
+        # Gather candidate positions with C-level array copies, then verify
+        # them all at once in NumPy instead of one Python XOR per candidate
+        candidates = array('q')
+        for chunk, substring in self._substrings(value):
+            lookup = self.tables[chunk].get
+            for mask in masks:
+                bucket = lookup(substring ^ mask)
+                if bucket is not None:
+                    candidates.extend(bucket)
+        if not candidates:
+            return []
+        positions = np.frombuffer(candidates, dtype=np.int64)
+        distances = popcount(np.frombuffer(self.hashes, dtype=np.uint64)[positions] ^ np.uint64(value))
+        # A position found through several substrings is listed more than once;
+        # dedupe after filtering, when only a handful are left
+        positions = np.unique(positions[distances <= radius])
+        positions = positions[np.frombuffer(self.groups, dtype=np.int64)[positions] >= 0]
+        distances = popcount(np.frombuffer(self.hashes, dtype=np.uint64)[positions] ^ np.uint64(value))
+        keys = np.frombuffer(self.keys, dtype=np.int64)[positions]
+        groups = np.frombuffer(self.groups, dtype=np.int64)[positions]
+        return list(zip(keys.tolist(), groups.tolist(), distances.tolist()))
@@ -0,0 +1,99 @@
+"""
+Placeholders painted in a feed cell before its image arrives: a BlurHash
+(https://blurha.sh) and a dominant color.
+
+Both are computed from a tiny copy of a picture that is already decoded for
+other work: the poster frame picked for a video thumbnail, or the smallest
+rendition rung of an image (see core.media.derivatives and
+core.media.renditions). The encoder is vectorized NumPy: every cosine
+component comes out of one einsum over at most TINY_SIZE x TINY_SIZE pixels.
+"""
+import numpy as np
+from PIL import Image
+
+# Long side of the copy placeholders are computed from; BlurHash keeps only
+# a handful of cosine components, so more pixels change nothing visible
+TINY_SIZE = 32
+# Components along the long and the short side
+LONG_COMPONENTS = 4
+SHORT_COMPONENTS = 3
+# Bits kept per channel when binning colors for the dominant one
+DOMINANT_COLOR_BITS = 3
+
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+# sRGB byte -> linear light
+_SRGB_TO_LINEAR = np.array([
+    value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+    for value in np.arange(256) / 255
+])
+
+
+def base83(value: int, length: int) -> str:
+    return ''.join(BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def linear_to_srgb(value: float) -> int:
+    value = min(max(value, 0.0), 1.0)
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def tiny(image: Image.Image) -> np.ndarray:
+    """``image`` (RGB) shrunk to at most TINY_SIZE on its long side, as an array."""
+    scale = TINY_SIZE / max(image.size)
+    if scale < 1:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        # reducing_gap: an integer box reduce first, then the BOX resize
+        image = image.resize(size, Image.BOX, reducing_gap=2.0)
+    return np.asarray(image, dtype=np.uint8)
+
+
+def blurhash(rgb: np.ndarray) -> str:
+    """BlurHash of an RGB array, with LONG_COMPONENTS along its long side."""
+    height, width = rgb.shape[:2]
+    components_x, components_y = ((LONG_COMPONENTS, SHORT_COMPONENTS) if width >= height
+                                  else (SHORT_COMPONENTS, LONG_COMPONENTS))
+    linear = _SRGB_TO_LINEAR[rgb]
+    # Cosine basis per axis; factors[j, i] = sum over pixels of basis_y[j] * basis_x[i] * pixel
+    basis_x = np.cos(np.pi * np.outer(np.arange(components_x), np.arange(width)) / width)
+    basis_y = np.cos(np.pi * np.outer(np.arange(components_y), np.arange(height)) / height)
+    factors = np.einsum('jy,yxc,ix->jic', basis_y, linear, basis_x) / (width * height)
+    factors[1:] *= 2
+    factors[0, 1:] *= 2
+    factors = factors.reshape(-1, 3)
+    dc, ac = factors[0], factors[1:]
+
+    text = base83(components_x - 1 + (components_y - 1) * 9, 1)
+    if len(ac):
+        quantised_max = int(max(0, min(82, np.floor(np.abs(ac).max() * 166 - 0.5))))
+        max_value = (quantised_max + 1) / 166
+    else:
+        quantised_max, max_value = 0, 1
+    text += base83(quantised_max, 1)
+    r, g, b = (linear_to_srgb(channel) for channel in dc)
+    text += base83((r << 16) + (g << 8) + b, 4)
+
+    scaled = ac / max_value
+    quantised = np.clip(np.floor(np.sign(scaled) * np.sqrt(np.abs(scaled)) * 9 + 9.5), 0, 18).astype(int)
+    for qr, qg, qb in quantised:
+        text += base83(qr * 19 * 19 + qg * 19 + qb, 2)
+    return text
+
+
+def dominant_color(rgb: np.ndarray) -> str:
+    """The mean of the most common coarse color bin, as ``#rrggbb``."""
+    pixels = rgb.reshape(-1, 3)
+    shift = 8 - DOMINANT_COLOR_BITS
+    coarse = pixels.astype(np.int32) >> shift
+    bins = (coarse[:, 0] << 2 * DOMINANT_COLOR_BITS) | (coarse[:, 1] << DOMINANT_COLOR_BITS) | coarse[:, 2]
+    counts = np.bincount(bins, minlength=1 << 3 * DOMINANT_COLOR_BITS)
+    r, g, b = pixels[bins == counts.argmax()].mean(axis=0).round().astype(int)
+    return f'#{r:02x}{g:02x}{b:02x}'
+
+
+def placeholder(image: Image.Image) -> dict:
+    """PostMedia placeholder field values for an RGB picture."""
+    rgb = tiny(image)
+    return {'blurhash': blurhash(rgb), 'dominant_color': dominant_color(rgb)}
@@ -0,0 +1,131 @@
+"""
+Responsive image renditions.
+
+Every image PostMedia (and every video's poster frame) gets a fixed ladder
+of downscaled copies in WebP and progressive JPEG, so a phone showing a feed
+cell fetches a few dozen KB instead of the original upload. Widths above the
+source width are capped to it, so a small screenshot still gets a WebP/JPEG
+copy at its own size but is never upscaled.
+
+Downscaling is cheap by construction:
+- ``Image.draft`` asks the JPEG decoder for a 1/2, 1/4 or 1/8 scale decode
+  (done in the DCT) that is still at least as large as the biggest rung;
+- each rung is made from the previous, larger one, with ``Image.reduce``
+  (integer box filter) before a final Lanczos ``resize``.
+
+The smallest rung also feeds the BlurHash/dominant-color placeholder (see
+core.media.placeholders), so images are decoded once for both.
+
+``render_ladder`` is pure Pillow and NumPy with no database access, so the
+backfill command can run it on a thread pool; PostMedia.generate_renditions
+stores the results as MediaRendition rows.
+"""
+import math
+from dataclasses import dataclass
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from ..renditions import FORMAT_JPEG, FORMAT_WEBP, FORMATS, WIDTHS
+from .placeholders import placeholder as compute_placeholder
+
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+# Reduce by an integer factor first while the image is at least this many
+# times larger than the target; Lanczos does the rest
+REDUCING_GAP = 2
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+@dataclass
+class Rendition:
+    format: str
+    width: int
+    height: int
+    data: bytes
+    name: str = ''  # Storage name, once stored
+
+
+@dataclass
+class Ladder:
+    renditions: list[Rendition]
+    # PostMedia placeholder field values; empty unless asked for
+    placeholder: dict
+
+
+def ladder_widths(source_width: int) -> list[int]:
+    """WIDTHS capped to the source width, ascending, without duplicates."""
+    return sorted({min(width, source_width) for width in WIDTHS})
+
+
+def downscale(image: Image.Image, width: int) -> Image.Image:
+    height = max(1, round(image.height * width / image.width))
+    factor = image.width // (width * REDUCING_GAP)
+    if factor >= 2:
+        image = image.reduce(factor)
+    if image.size == (width, height):
+        return image
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def flatten(image: Image.Image) -> Image.Image:
+    """``image`` as RGB, transparency flattened onto white like a browser would."""
+    if image.mode == 'RGB':
+        return image
+    flattened = Image.new('RGB', image.size, (255, 255, 255))
+    flattened.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+    return flattened
+
+
+def encode(image: Image.Image, fmt: str) -> bytes:
+    buffer = BytesIO()
+    if fmt == FORMAT_WEBP:
+        image.save(buffer, format='WEBP', quality=WEBP_QUALITY, method=4)
+    else:
+        # JPEG has no alpha
+        flatten(image).save(buffer, format='JPEG', quality=JPEG_QUALITY, progressive=True, optimize=True)
+    return buffer.getvalue()
+
+
+def open_for_ladder(path: str) -> Image.Image:
+    """Decode ``path`` upright, at the smallest draft scale the ladder allows."""
+    image = Image.open(path)
+    orientation = image.getexif().get(0x0112, 1)
+    raw_width, raw_height = image.size
+    upright_width = raw_height if orientation in TRANSPOSED_ORIENTATIONS else raw_width
+    scale = max(ladder_widths(upright_width)) / upright_width
+    image.draft('RGB', (math.ceil(raw_width * scale), math.ceil(raw_height * scale)))
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    return image.convert('RGBA' if has_alpha else 'RGB')
+
+
+def render_ladder(path: str, placeholder: bool = False) -> Ladder:
+    """
+    Every rung of the ladder for the image at ``path``, in every format, and
+    if ``placeholder``, the placeholder computed from the smallest rung.
+    """
+    image = open_for_ladder(path)
+    rungs = []
+    for width in reversed(ladder_widths(image.width)):
+        image = downscale(image, width)
+        rungs.append(image)
+    renditions = [
+        Rendition(format=fmt, width=rung.width, height=rung.height, data=encode(rung, fmt))
+        for rung in reversed(rungs)
+        for fmt in FORMATS
+    ]
+    return Ladder(renditions, compute_placeholder(flatten(rungs[-1])) if placeholder else {})
+
+
+def store(renditions: list[Rendition]) -> list[Rendition]:
+    """Write rendition bytes to media storage; fills in each ``name``. No database access."""
+    from ..models import MediaRendition
+
+    field = MediaRendition._meta.get_field('file')
+    for rendition in renditions:
+        filename = f'{rendition.width}.{"jpg" if rendition.format == FORMAT_JPEG else rendition.format}'
+        rendition.name = field.storage.save(field.generate_filename(None, filename), ContentFile(rendition.data))
+    return renditions
@@ -0,0 +1,166 @@
+"""
+Scrub-preview storyboards for videos.
+
+Frames are sampled at a fixed interval with seeks, shrunk to small tiles and
+laid out row-major on one or a few JPEG sprite sheets. A WebVTT file maps
+each interval to its tile with a media fragment, which is the format players
+(and the iOS client) already understand::
+
+    WEBVTT
+
+    00:00:00.000 --> 00:00:02.000
+    ../../ab/cd/abcd...ef.jpg#xywh=0,0,160,90
+
+Sheet paths in the VTT are relative to the VTT itself (see sheet_reference),
+so the file doesn't depend on the host the API is served from.
+
+The interval grows for long videos so there are never more than MAX_TILES
+tiles, and sampling stops after ``time_budget`` seconds (the rest of the
+video then scrubs to the last tile). Building the sheets is pure NumPy: the
+tile stack is reshaped into a grid, with no per-tile pastes.
+"""
+import math
+import posixpath
+import time
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+# Seconds between sampled frames for videos short enough to allow it
+DEFAULT_INTERVAL = 2.0
+MAX_TILES = 200
+TILE_WIDTH = 160
+COLUMNS = 10
+ROWS_PER_SHEET = 10
+JPEG_QUALITY = 70
+# Seconds spent seeking before we settle for a partial storyboard
+DEFAULT_TIME_BUDGET = 10.0
+
+
+@dataclass
+class Cue:
+    start: float
+    end: float
+    sheet: int  # Index into Storyboard.sheets
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+@dataclass
+class Storyboard:
+    sheets: list[np.ndarray]  # BGR sprite sheets
+    cues: list[Cue]
+
+
+def sample_times(duration: float, interval: float = DEFAULT_INTERVAL, max_tiles: int = MAX_TILES) -> np.ndarray:
+    """Start time of each tile: every ``interval`` seconds, stretched to fit ``max_tiles``."""
+    interval = max(interval, duration / max_tiles)
+    return np.arange(0.0, duration, interval)
+
+
+def tile_grid(tiles: np.ndarray, columns: int) -> np.ndarray:
+    """
+    Lay out a (N, H, W, C) stack row-major on a grid ``columns`` wide; the
+    last row is padded with black. One reshape and transpose, no loops.
+    """
+    n, height, width, channels = tiles.shape
+    rows = math.ceil(n / columns)
+    if rows * columns != n:
+        padding = np.zeros((rows * columns - n, height, width, channels), dtype=tiles.dtype)
+        tiles = np.concatenate([tiles, padding])
+    return (
+        tiles.reshape(rows, columns, height, width, channels)
+        .transpose(0, 2, 1, 3, 4)
+        .reshape(rows * height, columns * width, channels)
+    )
+
+
+def build_storyboard(
+    cap: cv2.VideoCapture,
+    interval: float = DEFAULT_INTERVAL,
+    time_budget: float = DEFAULT_TIME_BUDGET,
+) -> Storyboard | None:
+    """
+    Sample an opened capture into sprite sheets and cues. Returns None when
+    the container doesn't report a frame count and rate (so seeking isn't
+    possible) or no frame could be decoded.
+    """
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    if frame_count <= 0 or fps <= 0:
+        return None
+    duration = frame_count / fps
+
+    deadline = time.monotonic() + time_budget
+    tiles = []
+    starts = []
+    tile_size = None
+    for start in sample_times(duration, interval):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, min(int(start * fps), frame_count - 1))
+        ret, frame = cap.read()
+        if ret and frame is not None:
+            if tile_size is None:
+                height, width = frame.shape[:2]
+                # Even height keeps the sheets friendly to every JPEG decoder
+                tile_size = (TILE_WIDTH, max(2, round(height * TILE_WIDTH / width / 2) * 2))
+            tiles.append(cv2.resize(frame, tile_size, interpolation=cv2.INTER_AREA))
+            starts.append(float(start))
+        if time.monotonic() > deadline:
+            break
+    if not tiles:
+        return None
+
+    per_sheet = COLUMNS * ROWS_PER_SHEET
+    stack = np.stack(tiles)
+    sheets = [tile_grid(stack[i:i + per_sheet], COLUMNS) for i in range(0, len(stack), per_sheet)]
+    tile_width, tile_height = tile_size
+    cues = []
+    for i, start in enumerate(starts):
+        position = i % per_sheet
+        cues.append(Cue(
+            start=start,
+            end=starts[i + 1] if i + 1 < len(starts) else duration,
+            sheet=i // per_sheet,
+            x=position % COLUMNS * tile_width,
+            y=position // COLUMNS * tile_height,
+            width=tile_width,
+            height=tile_height,
+        ))
+    return Storyboard(sheets=sheets, cues=cues)
+
+
+def encode_sheet(sheet: np.ndarray) -> bytes:
+    ok, buffer = cv2.imencode('.jpg', sheet, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise ValueError('Could not encode storyboard sheet')
+    return buffer.tobytes()
+
+
+def format_timestamp(seconds: float) -> str:
+    millis = round(seconds * 1000)
+    hours, millis = divmod(millis, 3_600_000)
+    minutes, millis = divmod(millis, 60_000)
+    secs, millis = divmod(millis, 1000)
+    return f'{hours:02d}:{minutes:02d}:{secs:02d}.{millis:03d}'
+
+
+def webvtt(cues: list[Cue], sheet_urls: list[str]) -> str:
+    """The WebVTT index; ``sheet_urls[i]`` is how the VTT refers to sheet i."""
+    lines = ['WEBVTT', '']
+    for cue in cues:
+        lines.append(f'{format_timestamp(cue.start)} --> {format_timestamp(cue.end)}')
+        lines.append(f'{sheet_urls[cue.sheet]}#xywh={cue.x},{cue.y},{cue.width},{cue.height}')
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def sheet_reference(sheet_name: str, directory: str) -> str:
+    """
+    How a VTT refers to a sheet when both are stored under ``directory``.
+    Content-addressed names are two levels below it (``ab/cd/<digest>``),
+    so the path is the same from any VTT there, whatever its own digest.
+    """
+    return '../../' + posixpath.relpath(sheet_name, directory)
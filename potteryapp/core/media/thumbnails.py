@@ -0,0 +1,133 @@
+"""
+Poster-frame selection for video thumbnails.
+
+Instead of taking the first decoded frame (often black, blurred or covered by
+a hand on phone-shot clips), seek to a handful of evenly spaced timestamps,
+score a small grayscale copy of each candidate and keep the best one.
+
+Cost is bounded on both axes:
+- time: sampling stops once ``time_budget`` seconds have elapsed;
+- memory: only the downscaled candidates are kept, and the winning frame is
+  decoded again at full resolution with a single extra seek.
+"""
+import time
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+# Number of timestamps sampled across the clip
+DEFAULT_CANDIDATES = 8
+# Seconds spent sampling before we settle for what we have
+DEFAULT_TIME_BUDGET = 2.0
+# Width of the grayscale copies the metrics are computed on
+SCORE_WIDTH = 160
+# Frames darker than this mean luma are treated as black / lens covered
+MIN_BRIGHTNESS = 20.0
+
+# Relative weight of each metric in the final score
+SHARPNESS_WEIGHT = 0.5
+ENTROPY_WEIGHT = 0.3
+EXPOSURE_WEIGHT = 0.2
+
+
+@dataclass
+class PosterFrame:
+    frame: np.ndarray  # BGR, full resolution
+    index: int  # Frame index in the video
+    score: float
+    candidates: int  # How many candidates were scored
+
+
+def _downscale_gray(frame: np.ndarray) -> np.ndarray:
+    height, width = frame.shape[:2]
+    scale = SCORE_WIDTH / width
+    small = cv2.resize(frame, (SCORE_WIDTH, max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+
+def score_frames(grays: np.ndarray) -> np.ndarray:
+    """
+    Score a stack of equally sized grayscale frames, shape (N, H, W) uint8.
+
+    Every metric is computed for the whole stack at once and normalised to
+    [0, 1] before weighting; higher is better. Near-black frames score -1.
+    """
+    n = grays.shape[0]
+    pixels = grays.reshape(n, -1)
+
+    # Exposure: mean luma, best around mid-grey
+    brightness = pixels.mean(axis=1)
+    exposure = 1.0 - np.abs(brightness - 128.0) / 128.0
+
+    # Entropy of the luma histogram (max 8 bits); one bincount over the stack
+    offsets = (np.arange(n, dtype=np.int64) * 256)[:, None]
+    hist = np.bincount((pixels + offsets).ravel(), minlength=n * 256).reshape(n, 256)
+    p = hist / pixels.shape[1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        entropy = -np.nansum(np.where(p > 0, p * np.log2(p), 0.0), axis=1) / 8.0
+
+    # Sharpness: variance of the Laplacian. Filtering the stack as one tall
+    # image only smears the few rows at each seam, which doesn't move the variance.
+    height = grays.shape[1]
+    laplacian = cv2.Laplacian(grays.reshape(n * height, -1), cv2.CV_32F).reshape(n, -1)
+    sharpness = laplacian.var(axis=1)
+    peak = sharpness.max()
+    sharpness = sharpness / peak if peak > 0 else sharpness
+
+    scores = SHARPNESS_WEIGHT * sharpness + ENTROPY_WEIGHT * entropy + EXPOSURE_WEIGHT * exposure
+    return np.where(brightness < MIN_BRIGHTNESS, -1.0, scores)
+
+
+def read_first_frame(cap: cv2.VideoCapture) -> np.ndarray | None:
+    ret, frame = cap.read()
+    return frame if ret else None
+
+
+def select_poster_frame(
+    cap: cv2.VideoCapture,
+    candidates: int = DEFAULT_CANDIDATES,
+    time_budget: float = DEFAULT_TIME_BUDGET,
+) -> PosterFrame | None:
+    """
+    Pick the best-looking frame from an opened capture.
+
+    Falls back to the first frame when the container doesn't report a frame
+    count (so seeking isn't possible) or no candidate could be decoded.
+    """
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    if frame_count <= 1 or candidates <= 1:
+        frame = read_first_frame(cap)
+        return PosterFrame(frame, 0, 0.0, 1) if frame is not None else None
+
+    # Centre of N equal slices: skips the very first and last frames, which are
+    # the ones most likely to show the phone being picked up or put down
+    positions = np.unique(((np.arange(candidates) + 0.5) * frame_count / candidates).astype(int))
+
+    deadline = time.monotonic() + time_budget
+    grays = []
+    indexes = []
+    for position in positions:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(position))
+        ret, frame = cap.read()
+        if ret and frame is not None:
+            grays.append(_downscale_gray(frame))
+            indexes.append(int(position))
+        if time.monotonic() > deadline:
+            break
+
+    if not grays:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        frame = read_first_frame(cap)
+        return PosterFrame(frame, 0, 0.0, 1) if frame is not None else None
+
+    scores = score_frames(np.stack(grays))
+    best = int(np.argmax(scores))
+
+    # Decode the winner again at full resolution rather than holding every
+    # full-size candidate in memory
+    cap.set(cv2.CAP_PROP_POS_FRAMES, indexes[best])
+    ret, frame = cap.read()
+    if not ret or frame is None:
+        return None
+    return PosterFrame(frame, indexes[best], float(scores[best]), len(grays))
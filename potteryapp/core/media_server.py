@@ -0,0 +1,433 @@
+"""
+Media file serving with HTTP range and conditional request support.
+
+AVPlayer streams video with byte-range requests and revalidates what it has
+cached, so this view implements the parts of RFC 9110 it relies on:
+
+- a single ``fstat`` per request, taken on the already-open descriptor;
+- strong ETag / Last-Modified validators with If-None-Match, If-Modified-Since,
+  If-Match, If-Unmodified-Since (via Django's get_conditional_response) and If-Range;
+- single ranges (206 with the file's real Content-Type), suffix and open-ended
+  ranges, and multiple ranges as ``multipart/byteranges``;
+- bodies that expose ``fileno()`` and the exact range length, so WSGI servers
+  with a sendfile-capable ``wsgi.file_wrapper`` (e.g. gunicorn) hand the bytes
+  to the kernel with ``os.sendfile`` instead of copying them through Python.
+
+``aserve_media`` is the same view for ASGI servers (see backend/asgi.py).
+Django serves a synchronous streaming body under ASGI by reading all of it
+into a list first, so it streams from an async iterator instead: one
+``pread`` in a worker thread per block, at most READ_AHEAD blocks read
+ahead of what the server has sent, so a slow client holds a descriptor
+and a few hundred KB, never a thread. When the client disconnects, Django
+cancels the response and the iterator stops reading.
+
+The descriptor is always closed: by the response when one is returned, and
+immediately on 304/412/416.
+"""
+import asyncio
+import mimetypes
+import os
+import posixpath
+import secrets
+import stat
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpRequest, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+from .storage import ORIGINAL_DIR
+
+# Bytes read per iteration when the server can't use sendfile
+BLOCK_SIZE = 256 * 1024
+# Blocks aserve_media reads ahead of the one being sent
+READ_AHEAD = 1
+# More ranges than this in one request is abuse, not a media player; serve 200
+MAX_RANGES = 16
+# Browser/AVPlayer cache lifetime; ETag revalidation covers changes after that
+CACHE_MAX_AGE = 3600
+
+# A few types the platform mimetypes table gets wrong or lacks
+EXTRA_TYPES = {
+    '.mov': 'video/quicktime',
+    '.m4v': 'video/x-m4v',
+    '.heic': 'image/heic',
+    '.webp': 'image/webp',
+    '.vtt': 'text/vtt',
+}
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class RangeFile:
+    """
+    Read-only view of ``length`` bytes of an open descriptor from ``start``.
+
+    Exposes ``fileno()`` positioned at ``start`` so a sendfile-capable
+    wsgi.file_wrapper can send the range zero-copy (gunicorn sends exactly
+    Content-Length bytes from the current offset), and a bounded ``read()``
+    for servers that iterate instead.
+    """
+
+    def __init__(self, fd: int, start: int, length: int):
+        self.fd = fd
+        self.remaining = length
+        os.lseek(fd, start, os.SEEK_SET)
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def read(self, size: int = -1) -> bytes:
+        if self.remaining <= 0 or self.fd < 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = os.read(self.fd, size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class AsyncRangeReader:
+    """
+    Async iterator over byte ranges of an open descriptor, for aserve_media.
+
+    Each block is read with ``os.pread`` in a worker thread, up to READ_AHEAD
+    blocks ahead of the one being sent. Owns the descriptor: it is closed
+    when iteration ends or is cancelled, or by close() if it never started,
+    but never while a read that uses it is still running in its thread.
+    """
+
+    def __init__(self, fd: int, ranges: list[tuple[int, int]], headers: list[bytes] | None = None,
+                 trailer: bytes = b''):
+        self.fd = fd
+        self.ranges = ranges
+        # multipart/byteranges: a part header per range and the closing boundary
+        self.headers = headers
+        self.trailer = trailer
+        self.reads: set[asyncio.Future] = set()
+
+    def parts(self):
+        """Literal bytes and (offset, size) blocks to read, in body order."""
+        for index, (start, end) in enumerate(self.ranges):
+            if self.headers:
+                yield self.headers[index]
+            for offset in range(start, end + 1, BLOCK_SIZE):
+                yield offset, min(BLOCK_SIZE, end - offset + 1)
+        if self.trailer:
+            yield self.trailer
+
+    def start_read(self, offset: int, size: int) -> tuple[asyncio.Future, int]:
+        future = asyncio.get_running_loop().run_in_executor(None, os.pread, self.fd, size, offset)
+        self.reads.add(future)
+        future.add_done_callback(self.reads.discard)
+        return future, size
+
+    async def __aiter__(self):
+        queue = []
+        try:
+            for part in self.parts():
+                queue.append(part if isinstance(part, bytes) else self.start_read(*part))
+                if len(queue) > READ_AHEAD:
+                    yield await self.take(queue)
+            while queue:
+                yield await self.take(queue)
+        finally:
+            self.close()
+
+    @staticmethod
+    async def take(queue: list) -> bytes:
+        item = queue.pop(0)
+        if isinstance(item, bytes):
+            return item
+        future, size = item
+        # Shielded: cancelling the response mustn't mark a read done while its thread still uses fd
+        data = await asyncio.shield(future)
+        if len(data) != size:
+            # Content-Length is already sent; end the response short rather than pad it
+            raise OSError('File changed while being served')
+        return data
+
+    def close(self) -> None:
+        if self.fd < 0:
+            return
+        fd, self.fd = self.fd, -1
+        running = set(self.reads)
+        if not running:
+            os.close(fd)
+            return
+
+        # Cancelled mid-read: a thread may still be in pread on fd, so close
+        # it once the last read returns
+        def release(future: asyncio.Future) -> None:
+            if not future.cancelled():
+                future.exception()  # Retrieved: nobody awaits it any more
+            running.discard(future)
+            if not running:
+                os.close(fd)
+        for future in list(running):
+            future.add_done_callback(release)
+
+
+def guess_content_type(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in EXTRA_TYPES:
+        return EXTRA_TYPES[ext]
+    content_type, _ = mimetypes.guess_type(path)
+    return content_type or 'application/octet-stream'
+
+
+def make_etag(st: os.stat_result) -> str:
+    # Same recipe as nginx: size and mtime. Cheap, and stable across workers.
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def parse_range_header(header: str, size: int) -> list[tuple[int, int]] | None:
+    """
+    Parse a ``Range`` header into sorted, coalesced inclusive (start, end) pairs.
+
+    Returns None when the header is malformed or not a byte range, in which
+    case the caller ignores it and serves the whole file. Raises
+    RangeNotSatisfiable when it is well formed but no range overlaps the file.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, dash, last = part.partition('-')
+        if not dash:
+            return None
+        first, last = first.strip(), last.strip()
+        if not (first.isdigit() or first == '') or not (last.isdigit() or last == ''):
+            return None
+        if first == '':
+            # Suffix range: the last N bytes
+            if last == '':
+                return None
+            length = int(last)
+            if length == 0:
+                continue
+            ranges.append((max(0, size - length), size - 1))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            continue
+        end = min(int(last), size - 1) if last else size - 1
+        ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    # Coalesce overlapping/adjacent ranges so we never send a byte twice
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(request: HttpRequest, etag: str, mtime: float) -> bool:
+    """If-Range: honour Range only when the client's copy is still current."""
+    if_range = request.META.get('HTTP_IF_RANGE', '').strip()
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        # Strong comparison; weak tags never match here
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(mtime) <= since
+
+
+def _multipart_body(source: RangeFile, ranges: list[tuple[int, int]], headers: list[bytes], trailer: bytes):
+    fd = source.fileno()
+    try:
+        for (start, end), part_header in zip(ranges, headers):
+            yield part_header
+            offset = start
+            while offset <= end:
+                # pread doesn't move the file offset, so parts can't interfere
+                chunk = os.pread(fd, min(BLOCK_SIZE, end - offset + 1), offset)
+                if not chunk:
+                    return
+                offset += len(chunk)
+                yield chunk
+        yield trailer
+    finally:
+        source.close()
+
+
+def multipart_response(fd: int, ranges: list[tuple[int, int]], size: int, content_type: str,
+                       asynchronous: bool = False) -> StreamingHttpResponse:
+    boundary = secrets.token_hex(16).encode()
+    headers = [
+        (
+            b'\r\n--' + boundary + b'\r\n'
+            + f'Content-Type: {content_type}\r\n'.encode()
+            + f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'.encode()
+        )
+        for start, end in ranges
+    ]
+    trailer = b'\r\n--' + boundary + b'--\r\n'
+    length = sum(len(h) for h in headers) + sum(end - start + 1 for start, end in ranges) + len(trailer)
+
+    # Owns the descriptor. Also registered as a closer because a generator
+    # that never started (HEAD, early disconnect) never runs its finally block
+    if asynchronous:
+        source = body = AsyncRangeReader(fd, ranges, headers, trailer)
+    else:
+        source = RangeFile(fd, 0, size)
+        body = _multipart_body(source, ranges, headers, trailer)
+    response = StreamingHttpResponse(
+        body,
+        status=206,
+        content_type=f'multipart/byteranges; boundary={boundary.decode()}',
+    )
+    response['Content-Length'] = str(length)
+    response._resource_closers.append(source.close)
+    return response
+
+
+@dataclass
+class MediaFile:
+    """An opened media file and what the request asked of it."""
+    fd: int
+    size: int
+    etag: str
+    last_modified: str
+    content_type: str
+    # Inclusive byte ranges to send, or None for the whole file
+    ranges: list[tuple[int, int]] | None
+
+
+def open_media(request: HttpRequest, path: str) -> MediaFile | HttpResponse:
+    """
+    Open ``path`` under MEDIA_ROOT and evaluate the request's conditional and
+    Range headers. Returns the opened file, or a finished 304/412/416 response
+    (the descriptor already closed then). Raises Http404.
+    """
+    # Dot-paths are internal: in-progress uploads and storage temp files.
+    # Kept originals still carry the uploader's location metadata
+    if any(part.startswith('.') for part in path.split('/')) or posixpath.normpath(path).startswith(ORIGINAL_DIR):
+        raise Http404('File not found')
+    try:
+        file_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('File not found')
+
+    try:
+        fd = os.open(file_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError, PermissionError):
+        raise Http404('File not found')
+
+    try:
+        # One fstat on the open descriptor: no exists/getsize race with deletes
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            raise Http404('File not found')
+
+        size = st.st_size
+        etag = make_etag(st)
+
+        # 304 Not Modified / 412 Precondition Failed
+        conditional = get_conditional_response(request, etag=etag, last_modified=int(st.st_mtime))
+        if conditional is not None:
+            os.close(fd)
+            return conditional
+
+        ranges = None
+        range_header = request.META.get('HTTP_RANGE', '').strip()
+        if range_header and request.method in ('GET', 'HEAD') and if_range_matches(request, etag, st.st_mtime):
+            try:
+                ranges = parse_range_header(range_header, size)
+            except RangeNotSatisfiable:
+                os.close(fd)
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                response['Accept-Ranges'] = 'bytes'
+                return response
+    except BaseException:
+        os.close(fd)
+        raise
+    return MediaFile(fd=fd, size=size, etag=etag, last_modified=http_date(st.st_mtime),
+                     content_type=guess_content_type(file_path), ranges=ranges)
+
+
+def finish_response(response: HttpResponse, media: MediaFile) -> HttpResponse:
+    if media.ranges and len(media.ranges) == 1:
+        start, end = media.ranges[0]
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{media.size}'
+    elif not media.ranges:
+        response['Content-Length'] = str(media.size)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = media.etag
+    response['Last-Modified'] = media.last_modified
+    patch_cache_control(response, public=True, max_age=CACHE_MAX_AGE)
+    return response
+
+
+def serve_media(request: HttpRequest, path: str) -> HttpResponse:
+    """
+    Serve a file from MEDIA_ROOT with range and conditional request support.
+    This is required for AVPlayer to stream video efficiently.
+    """
+    media = open_media(request, path)
+    if isinstance(media, HttpResponse):
+        return media
+    try:
+        if media.ranges and len(media.ranges) > 1:
+            response = multipart_response(media.fd, media.ranges, media.size, media.content_type)
+        else:
+            start, end = media.ranges[0] if media.ranges else (0, media.size - 1)
+            response = FileResponse(RangeFile(media.fd, start, end - start + 1),
+                                    status=206 if media.ranges else 200, content_type=media.content_type)
+    except BaseException:
+        try:
+            os.close(media.fd)
+        except OSError:
+            pass
+        raise
+    response.block_size = BLOCK_SIZE
+    return finish_response(response, media)
+
+
+async def aserve_media(request: HttpRequest, path: str) -> HttpResponse:
+    """
+    serve_media for ASGI: the same headers and status codes, with the body
+    streamed from an AsyncRangeReader (see the module docstring). Opening
+    and fstat-ing the file are single syscalls and run on the event loop.
+    """
+    media = open_media(request, path)
+    if isinstance(media, HttpResponse):
+        return media
+    if media.ranges and len(media.ranges) > 1:
+        response = multipart_response(media.fd, media.ranges, media.size, media.content_type, asynchronous=True)
+    else:
+        ranges = media.ranges or ([(0, media.size - 1)] if media.size else [])
+        reader = AsyncRangeReader(media.fd, ranges)
+        # Registered as a closer by StreamingHttpResponse itself (it has close())
+        response = StreamingHttpResponse(reader, status=206 if media.ranges else 200,
+                                         content_type=media.content_type)
+    return finish_response(response, media)
@@ -0,0 +1,244 @@
+"""
+Per-process counters and histograms, exposed in Prometheus text format at
+/api/metrics/ (see core.middleware for what is recorded per request).
+
+Recording never takes a lock. Each thread writes into its own shard: a
+plain dict that only that thread mutates. A scrape sums the shards. When a
+thread exits, its shard is folded into a "retired" total, so runservers
+that start a thread per request don't accumulate shards. Only that fold
+and the scrape share a lock.
+
+Values are per process: each gunicorn worker keeps its own, as with any
+Prometheus client without a multiprocess collector. The media worker
+(core.jobs.Worker) has no HTTP server, so it periodically export()s its
+totals to a JSON file in a shared directory, and render() adds every file
+found there to this process's values.
+
+Nothing here imports Django, so core.media can time steps in processes
+that never set it up.
+"""
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Seconds; Prometheus client defaults
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+WRITE_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class _ShardOwner:
+    """Lives in a threading.local; garbage-collected with the thread's locals when it exits."""
+    __slots__ = ('shard', '__weakref__')
+
+    def __init__(self, shard: dict):
+        self.shard = shard
+
+
+class Metric:
+    """
+    Base for sharded metrics. Each value is a list of numbers keyed by a
+    tuple of label values; shards and the retired total add elementwise.
+    """
+    type_name = ''
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._local = threading.local()
+        self._lock = threading.Lock()  # Guards _live and _retired, never taken to record
+        self._live: dict[int, dict] = {}
+        self._retired: dict[tuple, list] = {}
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.owner.shard
+        except AttributeError:
+            shard = {}
+            owner = _ShardOwner(shard)
+            with self._lock:
+                self._live[id(shard)] = shard
+            weakref.finalize(owner, self._retire, shard)
+            self._local.owner = owner
+            return shard
+
+    def _retire(self, shard: dict) -> None:
+        with self._lock:
+            self._live.pop(id(shard), None)
+            _add_into(self._retired, shard)
+
+    def collect(self) -> dict[tuple, list]:
+        """Current totals per label tuple."""
+        with self._lock:
+            totals = {key: list(values) for key, values in self._retired.items()}
+            live = list(self._live.values())
+        for shard in live:
+            # dict.copy() is atomic under the GIL, unlike iterating a dict another thread writes
+            _add_into(totals, shard.copy())
+        return totals
+
+    def reset(self) -> None:
+        """Zero every value. For tests: it writes to other threads' shards."""
+        with self._lock:
+            self._retired.clear()
+            for shard in self._live.values():
+                shard.clear()
+
+    def render(self, imported: dict[tuple, list] | None = None) -> list[str]:
+        """Exposition lines for this process's totals plus any imported from other processes."""
+        totals = self.collect()
+        if imported:
+            _add_into(totals, imported)
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type_name}']
+        for key, values in sorted(totals.items()):
+            lines.extend(self._render_values(key, values))
+        return lines
+
+    def _render_values(self, key: tuple, values: list) -> list[str]:
+        raise NotImplementedError
+
+    def _label_text(self, key: tuple, extra: str = '') -> str:
+        pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, key: tuple = (), amount: float = 1) -> None:
+        shard = self._shard()
+        values = shard.get(key)
+        if values is None:
+            shard[key] = [amount]
+        else:
+            values[0] += amount
+
+    def _render_values(self, key, values):
+        return [f'{self.name}{self._label_text(key)} {_number(values[0])}']
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, key: tuple, value: float) -> None:
+        shard = self._shard()
+        values = shard.get(key)
+        if values is None:
+            # One count per bucket, one for +Inf, then the sum
+            values = shard[key] = [0] * (len(self.buckets) + 2)
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    @contextmanager
+    def time(self, key: tuple = ()) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(key, time.perf_counter() - started)
+
+    def _render_values(self, key, values):
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), values):
+            cumulative += count
+            le = 'le="{}"'.format(bound if bound == '+Inf' else _number(bound))
+            lines.append(f'{self.name}_bucket{self._label_text(key, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{self._label_text(key)} {_number(values[-1])}')
+        lines.append(f'{self.name}_count{self._label_text(key)} {cumulative}')
+        return lines
+
+
+def _add_into(totals: dict, shard: dict) -> None:
+    for key, values in shard.items():
+        if key in totals:
+            totals[key] = [a + b for a, b in zip(totals[key], values)]
+        else:
+            totals[key] = list(values)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time to build the response, by route.',
+                            ('route', 'method', 'status'))
+REQUEST_QUERIES = Histogram('http_request_db_queries', 'SQL statements executed per request.', ('route',),
+                            buckets=QUERY_COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram('http_request_db_duration_seconds', 'Time spent in SQL per request.', ('route',))
+RESPONSE_BYTES = Counter('http_response_bytes_total', 'Response body bytes sent, by route.', ('route',))
+MEDIA_STEP_SECONDS = Histogram('media_processing_duration_seconds',
+                               'Time spent in each media processing step.', ('step',))
+MEDIA_BYTES_SAVED = Counter('media_normalize_saved_bytes_total',
+                            'Bytes cut from uploaded images by normalization, by output format.', ('format',))
+DB_WRITE_BATCH_SIZE = Histogram('db_write_batch_size', 'Writes committed per coalesced transaction (core.writes).',
+                                buckets=WRITE_BATCH_BUCKETS)
+
+REGISTRY: list[Metric] = [REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_DB_SECONDS, RESPONSE_BYTES, MEDIA_STEP_SECONDS,
+                          MEDIA_BYTES_SAVED, DB_WRITE_BATCH_SIZE]
+# Callables returning extra exposition lines, for stats kept elsewhere (e.g. the feed cache)
+COLLECTORS: list[Callable[[], list[str]]] = []
+
+
+def export(path: str | os.PathLike) -> None:
+    """
+    Write the current totals of every registered metric to path, for
+    render() in another process to merge. Replaces the file atomically, so a
+    scrape never reads half of it.
+    """
+    data = {metric.name: [[list(key), values] for key, values in metric.collect().items()] for metric in REGISTRY}
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def load_exports(directory: str | os.PathLike) -> dict[str, dict[tuple, list]]:
+    """Totals per metric name summed over the export() files in directory."""
+    imported: dict[str, dict[tuple, list]] = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            logger.warning('Skipping unreadable metrics export %s', path, exc_info=True)
+            continue
+        for name, entries in data.items():
+            _add_into(imported.setdefault(name, {}), {tuple(key): values for key, values in entries})
+    return imported
+
+
+def render(import_dir: str | os.PathLike | None = None) -> str:
+    """Prometheus text exposition; with import_dir, includes the totals other processes export()ed there."""
+    imported = load_exports(import_dir) if import_dir else {}
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(imported.get(metric.name)))
+    for collector in COLLECTORS:
+        lines.extend(collector())
+    return '\n'.join(lines) + '\n'
+
+
+def reset() -> None:
+    for metric in REGISTRY:
+        metric.reset()
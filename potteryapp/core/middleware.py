@@ -0,0 +1,131 @@
+"""
+Request instrumentation: latency, SQL and response size per route, recorded
+into core.metrics and scraped from /api/metrics/.
+
+Routes are URL pattern names (``post-list``, ``post-list-on-shelf``,
+``media``...), never raw paths, so label cardinality stays bounded; creates
+and lists of the same route differ by the ``method`` label.
+
+Works in both handler modes. Under ASGI the query recorder is installed on
+the connection of the thread the request's ORM calls run in (Django gives
+each request one; see asgiref's thread_sensitive), not the event loop's.
+
+With ``SLOW_REQUEST_SECONDS`` set, requests slower than that are logged to
+``core.slow_requests`` with every SQL statement they ran and its time.
+"""
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.http import FileResponse
+
+from . import metrics
+
+logger = logging.getLogger('core.slow_requests')
+
+# Statements kept for the slow-request log; later ones are only counted
+SLOW_REQUEST_MAX_STATEMENTS = 200
+
+
+class QueryRecorder:
+    """A connection.execute_wrapper that counts and times the statements of one request."""
+
+    def __init__(self, keep_sql: bool):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: list[tuple[float, str]] | None = [] if keep_sql else None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if self.statements is not None and len(self.statements) < SLOW_REQUEST_MAX_STATEMENTS:
+                self.statements.append((elapsed, sql))
+
+
+def route_name(request) -> str:
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None and match.view_name else 'unmatched'
+
+
+def count_streamed_bytes(content, route: str):
+    for chunk in content:
+        metrics.RESPONSE_BYTES.inc((route,), len(chunk))
+        yield chunk
+
+
+async def acount_streamed_bytes(content, route: str):
+    async for chunk in content:
+        metrics.RESPONSE_BYTES.inc((route,), len(chunk))
+        yield chunk
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        threshold = getattr(settings, 'SLOW_REQUEST_SECONDS', None)
+        queries = QueryRecorder(keep_sql=threshold is not None)
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        return self.record(request, response, time.perf_counter() - started, queries, threshold)
+
+    async def __acall__(self, request):
+        threshold = getattr(settings, 'SLOW_REQUEST_SECONDS', None)
+        queries = QueryRecorder(keep_sql=threshold is not None)
+        started = time.perf_counter()
+        # Lambdas: ``connection`` must be resolved in the ORM's thread, not here
+        await sync_to_async(lambda: connection.execute_wrappers.append(queries))()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(lambda: connection.execute_wrappers.remove(queries))()
+        return self.record(request, response, time.perf_counter() - started, queries, threshold)
+
+    def record(self, request, response, elapsed, queries, threshold):
+        route = route_name(request)
+        metrics.REQUEST_SECONDS.observe((route, request.method, str(response.status_code)), elapsed)
+        metrics.REQUEST_QUERIES.observe((route,), queries.count)
+        metrics.REQUEST_DB_SECONDS.observe((route,), queries.seconds)
+        self.record_bytes(request, response, route)
+
+        if threshold is not None and elapsed >= threshold:
+            self.log_slow_request(request, response, route, elapsed, queries)
+        return response
+
+    def record_bytes(self, request, response, route):
+        if request.method == 'HEAD':
+            return
+        if response.has_header('Content-Length'):
+            metrics.RESPONSE_BYTES.inc((route,), int(response['Content-Length']))
+        elif not response.streaming:
+            metrics.RESPONSE_BYTES.inc((route,), len(response.content))
+        elif not isinstance(response, FileResponse):
+            # Wrapping a FileResponse would lose the server's sendfile path
+            count = acount_streamed_bytes if response.is_async else count_streamed_bytes
+            response.streaming_content = count(response.streaming_content, route)
+
+    def log_slow_request(self, request, response, route, elapsed, queries):
+        lines = [
+            f'{request.method} {request.get_full_path()} ({route}) -> {response.status_code} '
+            f'in {elapsed * 1000:.0f} ms, {queries.count} queries in {queries.seconds * 1000:.0f} ms'
+        ]
+        lines.extend(f'  {seconds * 1000:8.2f} ms  {sql}' for seconds, sql in queries.statements)
+        if queries.count > len(queries.statements):
+            lines.append(f'  ... {queries.count - len(queries.statements)} more')
+        logger.warning('\n'.join(lines))
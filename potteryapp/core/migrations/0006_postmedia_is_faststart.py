@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-16 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_media_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postmedia',
+            name='is_faststart',
+            field=models.BooleanField(blank=True, help_text='Whether moov precedes mdat; empty for non-MP4/MOV files', null=True),
+        ),
+    ]
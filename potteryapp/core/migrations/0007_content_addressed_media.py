@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-16 20:41
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_postmedia_is_faststart'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Storage path, named by SHA-256', max_length=255, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='postmedia',
+            name='file',
+            field=models.FileField(storage=core.storage.media_storage, upload_to='posts/media/'),
+        ),
+        migrations.AlterField(
+            model_name='postmedia',
+            name='thumbnail',
+            field=models.ImageField(blank=True, storage=core.storage.media_storage, upload_to='posts/thumbnails/'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-16 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Bumped on any change to the post, its media or sale item'),
+        ),
+    ]
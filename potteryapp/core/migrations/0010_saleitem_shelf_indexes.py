@@ -0,0 +1,41 @@
+# Generated by Django 6.0 on 2026-10-16 21:30
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_post_created_at(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+    SaleItem = apps.get_model('core', 'SaleItem')
+    SaleItem.objects.update(
+        post_created_at=Subquery(Post.objects.filter(pk=OuterRef('post_id')).values('created_at')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_post_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='saleitem',
+            name='post_created_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(copy_post_created_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='saleitem',
+            name='post_created_at',
+            field=models.DateTimeField(editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='saleitem',
+            index=models.Index(fields=['price'], condition=models.Q(is_sold=False), name='core_saleitem_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='saleitem',
+            index=models.Index(fields=['post_created_at'], condition=models.Q(is_sold=False), name='core_saleitem_recent_idx'),
+        ),
+    ]
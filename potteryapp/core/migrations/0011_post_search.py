@@ -0,0 +1,87 @@
+# Generated by Django 6.0 on 2026-10-16 22:10
+
+from django.conf import settings
+from django.db import migrations
+
+# FTS5 mirror of Post.caption and the creator's username (rowid = post id).
+# prefix='2 3' adds prefix indexes so "gla"* style queries don't scan the vocabulary.
+CREATE_TABLE = '''
+    CREATE VIRTUAL TABLE core_post_fts USING fts5(
+        caption, creator_username,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+'''
+
+TRIGGERS = [
+    '''
+    CREATE TRIGGER core_post_fts_insert AFTER INSERT ON {post} BEGIN
+        INSERT INTO core_post_fts(rowid, caption, creator_username)
+        VALUES (new.id, new.caption, (SELECT username FROM {user} WHERE id = new.creator_id));
+    END
+    ''',
+    '''
+    CREATE TRIGGER core_post_fts_update AFTER UPDATE OF caption, creator_id ON {post} BEGIN
+        UPDATE core_post_fts
+        SET caption = new.caption,
+            creator_username = (SELECT username FROM {user} WHERE id = new.creator_id)
+        WHERE rowid = new.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER core_post_fts_delete AFTER DELETE ON {post} BEGIN
+        DELETE FROM core_post_fts WHERE rowid = old.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER core_post_fts_username AFTER UPDATE OF username ON {user} BEGIN
+        UPDATE core_post_fts SET creator_username = new.username
+        WHERE rowid IN (SELECT id FROM {post} WHERE creator_id = new.id);
+    END
+    ''',
+]
+
+DROP = [
+    'DROP TRIGGER IF EXISTS core_post_fts_username',
+    'DROP TRIGGER IF EXISTS core_post_fts_delete',
+    'DROP TRIGGER IF EXISTS core_post_fts_update',
+    'DROP TRIGGER IF EXISTS core_post_fts_insert',
+    'DROP TABLE IF EXISTS core_post_fts',
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        # core.search falls back to icontains elsewhere
+        return
+    quote = schema_editor.connection.ops.quote_name
+    post_table = quote(apps.get_model('core', 'Post')._meta.db_table)
+    user_table = quote(apps.get_model(settings.AUTH_USER_MODEL)._meta.db_table)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLE)
+        for trigger in TRIGGERS:
+            cursor.execute(trigger.format(post=post_table, user=user_table))
+        cursor.execute(
+            f'INSERT INTO core_post_fts(rowid, caption, creator_username) '
+            f'SELECT p.id, p.caption, u.username FROM {post_table} p JOIN {user_table} u ON u.id = p.creator_id'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for statement in DROP:
+            cursor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_saleitem_shelf_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
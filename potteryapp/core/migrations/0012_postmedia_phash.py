@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-16 22:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_post_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postmedia',
+            name='hashed_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, help_text='When phash was written; other processes sync their index from it', null=True),
+        ),
+        migrations.AddField(
+            model_name='postmedia',
+            name='phash',
+            field=models.BigIntegerField(blank=True, editable=False, help_text='64-bit dHash of the image or video thumbnail, stored signed', null=True),
+        ),
+    ]
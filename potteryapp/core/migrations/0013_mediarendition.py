@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-16 22:21
+
+import core.storage
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_postmedia_phash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('format', models.CharField(choices=[('webp', 'WebP'), ('jpeg', 'JPEG')], max_length=4)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('file', models.FileField(storage=core.storage.media_storage, upload_to='posts/renditions/')),
+                ('media', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='core.postmedia')),
+            ],
+            options={
+                'ordering': ['media', 'format', 'width'],
+                'constraints': [models.UniqueConstraint(fields=('media', 'format', 'width'), name='core_mediarendition_unique')],
+            },
+        ),
+    ]
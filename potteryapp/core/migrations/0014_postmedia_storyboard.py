@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-16 22:25
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_mediarendition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postmedia',
+            name='storyboard',
+            field=models.FileField(blank=True, help_text='WebVTT index of the scrub-preview sprite sheets (videos only)', storage=core.storage.media_storage, upload_to='posts/storyboards/'),
+        ),
+        migrations.AddField(
+            model_name='postmedia',
+            name='storyboard_sheets',
+            field=models.JSONField(blank=True, default=list, editable=False, help_text='Storage names of the JPEG sprite sheets the storyboard refers to'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 6.0 on 2026-10-16 22:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_postmedia_storyboard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postmedia',
+            name='checksum',
+            field=models.CharField(blank=True, editable=False, help_text='SHA-256 of the stored bytes', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='postmedia',
+            name='codec',
+            field=models.CharField(blank=True, editable=False, help_text='FourCC of the video codec', max_length=4),
+        ),
+        migrations.AddField(
+            model_name='postmedia',
+            name='duration',
+            field=models.FloatField(blank=True, editable=False, help_text='Seconds (videos only)', null=True),
+        ),
+        migrations.AddField(
+            model_name='postmedia',
+            name='file_size',
+            field=models.BigIntegerField(blank=True, editable=False, help_text='Bytes, as stored', null=True),
+        ),
+        migrations.AddField(
+            model_name='postmedia',
+            name='fps',
+            field=models.FloatField(blank=True, editable=False, help_text='Frames per second (videos only)', null=True),
+        ),
+        migrations.AddField(
+            model_name='postmedia',
+            name='frame_count',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Videos only', null=True),
+        ),
+        migrations.AddField(
+            model_name='postmedia',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Display height, rotation applied', null=True),
+        ),
+        migrations.AddField(
+            model_name='postmedia',
+            name='rotation',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, help_text='Clockwise degrees the stored frames are turned to display', null=True),
+        ),
+        migrations.AddField(
+            model_name='postmedia',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Display width, rotation applied', null=True),
+        ),
+    ]
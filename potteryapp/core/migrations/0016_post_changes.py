@@ -0,0 +1,58 @@
+# Generated by Django 6.0 on 2026-10-16 22:46
+
+import importlib
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+# SQLite adds Post.updated_at by rebuilding core_post, which the search
+# triggers refer to: drop the search index first and rebuild it afterwards
+search = importlib.import_module('core.migrations.0011_post_search')
+
+
+def stamp_existing_posts(apps, schema_editor):
+    # Existing posts last changed no later than now; created_at is the best we know
+    Post = apps.get_model('core', 'Post')
+    Post.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_postmedia_metadata'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(search.drop_search_index, search.create_search_index),
+        migrations.CreateModel(
+            name='PostTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post_id', models.PositiveIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, help_text='Stamped whenever version is bumped'),
+        ),
+        migrations.RunPython(stamp_existing_posts, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='saleitem',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['updated_at', 'id'], name='core_post_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='posttombstone',
+            index=models.Index(fields=['deleted_at', 'post_id'], name='core_tombstone_changes_idx'),
+        ),
+        migrations.RunPython(search.create_search_index, search.drop_search_index),
+    ]
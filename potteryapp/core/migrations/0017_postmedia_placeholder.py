@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-16 22:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_post_changes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postmedia',
+            name='blurhash',
+            field=models.CharField(blank=True, editable=False, help_text='BlurHash of the image or video thumbnail', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='postmedia',
+            name='dominant_color',
+            field=models.CharField(blank=True, editable=False, help_text='#rrggbb', max_length=7),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-16 23:15
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_postmedia_placeholder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postmedia',
+            name='original',
+            field=models.FileField(blank=True, editable=False, help_text='Cold copy of the upload when normalization replaced it; never served', storage=core.storage.media_storage, upload_to='posts/originals/'),
+        ),
+        migrations.AddField(
+            model_name='postmedia',
+            name='original_size',
+            field=models.BigIntegerField(blank=True, editable=False, help_text='Bytes uploaded; empty until the image is normalized', null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-16 23:33
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_postmedia_original'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='postmedia',
+            name='file',
+            field=models.FileField(db_index=True, storage=core.storage.media_storage, upload_to='posts/media/'),
+        ),
+        migrations.AlterField(
+            model_name='postmedia',
+            name='original',
+            field=models.FileField(blank=True, db_index=True, editable=False, help_text='Cold copy of the upload when normalization replaced it; never served', storage=core.storage.media_storage, upload_to='posts/originals/'),
+        ),
+    ]
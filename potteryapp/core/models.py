@@ -1,11 +1,18 @@
-from django.db import models
+import logging
+import uuid
+from datetime import timedelta
+
+from django.db import models, transaction
 from django.conf import settings
-from django.core.files.base import ContentFile
-from PIL import Image
-import cv2
-import numpy as np
+from django.utils import timezone
 import os
-from io import BytesIO
+
+from . import metrics
+from .faststart import faststart_stored
+from .renditions import FORMAT_JPEG, FORMAT_WEBP
+from .storage import MEDIA_DIR, ORIGINAL_DIR, STORYBOARD_DIR, THUMBNAIL_DIR, media_storage, original_name
+
+logger = logging.getLogger(__name__)
 
 # Create your models here.
 
@@ -13,6 +20,18 @@ class Post(models.Model):
     creator = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='posts')
     caption = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    version = models.PositiveIntegerField(default=0, editable=False,
+                                          help_text='Bumped on any change to the post, its media or sale item')
+    updated_at = models.DateTimeField(default=timezone.now, editable=False,
+                                      help_text='Stamped whenever version is bumped')
+
+    class Meta:
+        indexes = [
+            # Backs the feed's keyset pagination on (created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='core_post_feed_idx'),
+            # Backs /api/posts/changes/, which walks (updated_at, id) upwards
+            models.Index(fields=['updated_at', 'id'], name='core_post_changes_idx'),
+        ]
 
     @property
     def is_for_sale(self):
@@ -21,6 +40,13 @@ class Post(models.Model):
     def __str__(self):
         return f"Post by {self.creator} at {self.created_at}"
 
+    def save(self, *args, **kwargs):
+        # core.signals bumps version and updated_at in pre_save; a partial save must write them too
+        update_fields = kwargs.get('update_fields')
+        if update_fields and self.pk is not None:
+            kwargs['update_fields'] = {*update_fields, 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+
 
 class PostMedia(models.Model):
     MEDIA_TYPE_IMAGE = 'image'
@@ -31,26 +57,79 @@ class PostMedia(models.Model):
         (MEDIA_TYPE_VIDEO, 'Video'),
     ]
     
+    STATUS_PROCESSING = 'processing'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='media')
     media_type = models.CharField(max_length=10, choices=MEDIA_TYPE_CHOICES, default=MEDIA_TYPE_IMAGE)
-    file = models.FileField(upload_to='posts/media/')
-    thumbnail = models.ImageField(upload_to='posts/thumbnails/', blank=True)
+    # Indexed for the duplicate lookup of every upload (same_upload), which
+    # runs while the upload's transaction holds the database write lock
+    file = models.FileField(upload_to=MEDIA_DIR, storage=media_storage, db_index=True)
+    # Set by the media worker's normalization of images (see core.media.normalize)
+    original = models.FileField(upload_to=ORIGINAL_DIR, blank=True, storage=media_storage, editable=False, db_index=True,
+                                help_text='Cold copy of the upload when normalization replaced it; never served')
+    original_size = models.BigIntegerField(null=True, blank=True, editable=False,
+                                           help_text='Bytes uploaded; empty until the image is normalized')
+    thumbnail = models.ImageField(upload_to=THUMBNAIL_DIR, blank=True, storage=media_storage)
+    storyboard = models.FileField(upload_to=STORYBOARD_DIR, blank=True, storage=media_storage,
+                                  help_text='WebVTT index of the scrub-preview sprite sheets (videos only)')
+    storyboard_sheets = models.JSONField(default=list, blank=True, editable=False,
+                                         help_text='Storage names of the JPEG sprite sheets the storyboard refers to')
     order = models.PositiveIntegerField(default=0, help_text='Order in which media appears')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_READY,
+                              help_text='Post-upload processing state (thumbnail etc.)')
+    is_faststart = models.BooleanField(null=True, blank=True,
+                                       help_text='Whether moov precedes mdat; empty for non-MP4/MOV files')
+    phash = models.BigIntegerField(null=True, blank=True, editable=False,
+                                   help_text='64-bit dHash of the image or video thumbnail, stored signed')
+    hashed_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True,
+                                     help_text='When phash was written; other processes sync their index from it')
+    # Probed by the media worker (see core.media.metadata); empty until then
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False, help_text='Display width, rotation applied')
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False, help_text='Display height, rotation applied')
+    rotation = models.PositiveSmallIntegerField(null=True, blank=True, editable=False,
+                                                help_text='Clockwise degrees the stored frames are turned to display')
+    duration = models.FloatField(null=True, blank=True, editable=False, help_text='Seconds (videos only)')
+    fps = models.FloatField(null=True, blank=True, editable=False, help_text='Frames per second (videos only)')
+    frame_count = models.PositiveIntegerField(null=True, blank=True, editable=False, help_text='Videos only')
+    codec = models.CharField(max_length=4, blank=True, editable=False, help_text='FourCC of the video codec')
+    file_size = models.BigIntegerField(null=True, blank=True, editable=False, help_text='Bytes, as stored')
+    checksum = models.CharField(max_length=64, blank=True, editable=False, help_text='SHA-256 of the stored bytes')
+    # Painted before the picture loads (see core.media.placeholders); empty until processed
+    blurhash = models.CharField(max_length=32, blank=True, editable=False,
+                                help_text='BlurHash of the image or video thumbnail')
+    dominant_color = models.CharField(max_length=7, blank=True, editable=False, help_text='#rrggbb')
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['order', 'created_at']
         verbose_name_plural = 'Post Media'
 
+    # Extensions treated as video when the client doesn't say which it is
+    VIDEO_EXTENSIONS = {'.mov', '.mp4', '.m4v', '.avi', '.webm', '.3gp'}
+
     def __str__(self):
         return f"{self.get_media_type_display()} for Post {self.post.id} (order: {self.order})"
     
+    @classmethod
+    def media_type_for_filename(cls, filename):
+        ext = os.path.splitext(filename or '')[1].lower()
+        return cls.MEDIA_TYPE_VIDEO if ext in cls.VIDEO_EXTENSIONS else cls.MEDIA_TYPE_IMAGE
+    
     def save(self, *args, **kwargs):
         # Check if this is a new instance or if file was updated
         is_new = self.pk is None
         file_changed = False
+        update_fields = kwargs.get('update_fields')
         
-        if not is_new:
+        if not is_new and (update_fields is None or 'file' in update_fields):
             # Get the old instance to check if file changed
             try:
                 old_instance = PostMedia.objects.get(pk=self.pk)
@@ -58,66 +137,533 @@ class PostMedia(models.Model):
             except PostMedia.DoesNotExist:
                 pass
         
-        # Save first to ensure file is saved to disk
-        super().save(*args, **kwargs)
+        needs_processing = (is_new or file_changed) and bool(self.file)
+        if needs_processing and update_fields is None:
+            self.status = self.STATUS_PROCESSING
         
-        # Generate thumbnail for videos if it doesn't exist
-        if self.media_type == self.MEDIA_TYPE_VIDEO and self.file:
-            # Check if thumbnail already exists
-            has_thumbnail = self.thumbnail and self.thumbnail.name
+        with transaction.atomic():
+            super().save(*args, **kwargs)
             
-            # Only generate if it's new or file was changed, and thumbnail doesn't exist
-            if (is_new or file_changed) and not has_thumbnail:
-                try:
-                    # Get the video file path
-                    video_path = self.file.path
-                    
-                    # Check if file exists
-                    if os.path.exists(video_path):
-                        # Open video file
-                        cap = cv2.VideoCapture(video_path)
-                        
-                        if cap.isOpened():
-                            # Read the first frame
-                            ret, frame = cap.read()
-                            cap.release()
-                            
-                            if ret and frame is not None:
-                                # Convert BGR to RGB (OpenCV uses BGR, PIL uses RGB)
-                                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                                
-                                # Convert numpy array to PIL Image
-                                pil_image = Image.fromarray(frame_rgb)
-                                
-                                # Save PIL image to BytesIO buffer as JPEG
-                                buffer = BytesIO()
-                                pil_image.save(buffer, format='JPEG', quality=85)
-                                buffer.seek(0)
-                                
-                                # Create ContentFile from buffer
-                                thumbnail_content = ContentFile(buffer.read())
-                                
-                                # Generate thumbnail filename
-                                video_filename = os.path.basename(self.file.name)
-                                thumbnail_filename = f"thumb_{os.path.splitext(video_filename)[0]}.jpg"
-                                
-                                # Save thumbnail - this will update self.thumbnail
-                                # Use update_fields to only update the thumbnail field and avoid the UNIQUE constraint error
-                                self.thumbnail.save(thumbnail_filename, thumbnail_content, save=False)
-                                
-                                # Save again to persist the thumbnail, but only update the thumbnail field
-                                # This prevents the UNIQUE constraint error
-                                super().save(update_fields=['thumbnail'])
-                except Exception as e:
-                    # If thumbnail generation fails, continue without thumbnail
-                    # You might want to log this error in production
-                    pass
+            # Thumbnailing etc. happens in the media worker, not in the request.
+            # The job row is committed together with the media row so it can't be lost.
+            # Byte-identical re-uploads share a stored file, so reuse its results instead.
+            if needs_processing and not self.reuse_processing_from_duplicate():
+                from .jobs import enqueue_media_processing
+                enqueue_media_processing(self)
+    
+    # Serialized as the media's ``metadata``, in this order
+    METADATA_FIELDS = ['width', 'height', 'rotation', 'duration', 'fps', 'frame_count', 'codec',
+                       'file_size', 'checksum']
+    # Serialized as the media's ``placeholder``
+    PLACEHOLDER_FIELDS = ['blurhash', 'dominant_color']
+    # Written by normalize_image(); ``file`` then names the normalized image
+    NORMALIZED_FIELDS = ['file', 'original', 'original_size']
+    # Fields produced by process(); identical files produce identical values
+    DERIVED_FIELDS = (['thumbnail', 'storyboard', 'storyboard_sheets', 'is_faststart', 'phash']
+                      + METADATA_FIELDS + PLACEHOLDER_FIELDS + NORMALIZED_FIELDS)
+    
+    @staticmethod
+    def same_upload(names):
+        """Q for rows whose file is one of the stored ``names``, or was until normalization replaced it."""
+        originals = [name for name in map(original_name, names) if name]
+        return models.Q(file__in=names) | models.Q(original__in=originals)
+    
+    def reuse_processing_from_duplicate(self):
+        """
+        If another processed row already points at the same content-addressed
+        file (or normalized it), copy its derived fields and mark this one
+        ready. Returns True if so.
+        """
+        original = (
+            PostMedia.objects
+            .filter(self.same_upload([self.file.name]), status=self.STATUS_READY)
+            .exclude(pk=self.pk)
+            .first()
+        )
+        if original is None:
+            return False
+        self.copy_processing_from(original)
+        super().save(update_fields=self.DERIVED_FIELDS + ['hashed_at', 'status'])
+        self.copy_renditions_from(original)
+        return True
+    
+    def copy_processing_from(self, original):
+        """Take the derived fields of a processed row with the same file (not saved)."""
+        for field_name in self.DERIVED_FIELDS:
+            setattr(self, field_name, getattr(original, field_name))
+        # A fresh stamp, so similarity indexes in other processes see the copy
+        self.hashed_at = timezone.now() if self.phash is not None else None
+        self.status = self.STATUS_READY
+    
+    def copy_renditions_from(self, original):
+        """Share a processed row's renditions (same file, so the same images)."""
+        # create(), not bulk_create(): post_save adds the blob references
+        for rendition in original.renditions.all():
+            MediaRendition.objects.create(media=self, format=rendition.format, width=rendition.width,
+                                          height=rendition.height, file=rendition.file.name)
+    
+    def decode_video(self, metadata=False):
+        """
+        Open the video once for its metadata, poster thumbnail and scrub
+        storyboard, each only if missing (see core.media.derivatives), or for
+        the metadata of a replaced file if ``metadata``. Runs in
+        the media worker; raises on failure so the job records why.
+        """
+        # core.media loads OpenCV, NumPy and Pillow; only media work pays for that
+        from .media.derivatives import decode_video
+        
+        fields = decode_video(
+            self.file.path, self.file.storage,
+            metadata=metadata or self.file_size is None,
+            thumbnail=not self.thumbnail,
+            storyboard=not self.storyboard,
+        )
+        self.set_metadata(fields)
+        # Only derived columns are written, so this doesn't re-enqueue processing
+        if fields:
+            self.save(update_fields=list(fields))
+    
+    def set_metadata(self, *values):
+        """Assign field value dicts returned by core.media (metadata, derivatives, placeholders); not saved."""
+        for metadata in values:
+            for field_name, value in metadata.items():
+                setattr(self, field_name, value)
+    
+    def read_image_metadata(self):
+        """Store the size, rotation and checksum of an image from its header."""
+        from PIL import Image
+        from .media.metadata import file_metadata, image_metadata
+        
+        path = self.file.path
+        self.set_metadata(file_metadata(path, self.file.name))
+        try:
+            self.set_metadata(image_metadata(path))
+        except (OSError, ValueError, Image.DecompressionBombError) as exc:
+            logger.warning('Could not read the size of %s: %s', self.file.name, exc)
+        self.save(update_fields=self.METADATA_FIELDS)
+    
+    def normalize_image(self):
+        """
+        Replace the uploaded image with its normalized version (see
+        core.media.normalize), keeping the upload as ``original`` if
+        IMAGE_KEEP_ORIGINALS. Returns True if the file was replaced.
+        """
+        from .media.normalize import normalize_stored
+        
+        with metrics.MEDIA_STEP_SECONDS.time(('normalize',)):
+            fields = normalize_stored(
+                self.file.storage, self.file.name,
+                max_edge=settings.IMAGE_MAX_EDGE,
+                max_pixels=settings.IMAGE_MAX_PIXELS,
+                keep_original=settings.IMAGE_KEEP_ORIGINALS,
+            )
+        self.set_metadata(fields)
+        # Past our save(): a file replaced here must not queue processing again
+        super().save(update_fields=list(fields))
+        return 'file' in fields
+    
+    def ensure_faststart(self):
+        """
+        Move the MP4/MOV index in front of the media data so playback starts
+        sooner. Like normalize_image, the remuxed file is stored as a new
+        blob, since the upload's name is its digest. Returns True if the
+        file was replaced.
+        """
+        with metrics.MEDIA_STEP_SECONDS.time(('faststart',)):
+            fields = faststart_stored(self.file.storage, self.file.name)
+        self.set_metadata(fields)
+        # Past our save(): a file replaced here must not queue processing again
+        super().save(update_fields=list(fields))
+        return 'file' in fields
+    
+    def compute_phash(self):
+        """
+        Store the perceptual hash used by "similar posts" (see core.media.phash):
+        of the image itself, or of the poster frame for videos. Formats
+        Pillow can't decode are logged and left unhashed rather than failing
+        the whole job.
+        """
+        from .media.phash import image_dhash, to_signed
+        
+        source = self.still_image
+        if not source:
+            return
+        try:
+            with metrics.MEDIA_STEP_SECONDS.time(('phash',)):
+                value = image_dhash(source.path)
+        except (OSError, ValueError) as exc:
+            logger.warning('Could not hash %s: %s', source.name, exc)
+            return
+        self.phash = to_signed(value)
+        self.hashed_at = timezone.now()
+        self.save(update_fields=['phash', 'hashed_at'])
+    
+    @property
+    def still_image(self):
+        """The picture shown for this media in the feed: the image itself or the video's poster frame."""
+        return self.thumbnail if self.media_type == self.MEDIA_TYPE_VIDEO else self.file
+    
+    def generate_renditions(self):
+        """
+        Store downscaled WebP/JPEG copies of still_image (see core.media.renditions),
+        and its placeholder if decode_video hasn't already made one. Like
+        compute_phash, undecodable images are logged and skipped.
+        """
+        from PIL import Image
+        from .media.renditions import render_ladder, store as store_renditions
+        
+        source = self.still_image
+        if not source:
+            return
+        try:
+            with metrics.MEDIA_STEP_SECONDS.time(('renditions',)):
+                ladder = render_ladder(source.path, placeholder=not self.blurhash)
+        except (OSError, ValueError, Image.DecompressionBombError) as exc:
+            logger.warning('Could not make renditions of %s: %s', source.name, exc)
+            return
+        self.save_renditions(store_renditions(ladder.renditions), ladder.placeholder)
+    
+    def save_renditions(self, rendered, placeholder=None):
+        """
+        Replace this media's MediaRendition rows with already stored ``rendered``
+        ones, and store ``placeholder`` field values if given.
+        """
+        from . import feed_cache
+        
+        with transaction.atomic():
+            if placeholder:
+                self.set_metadata(placeholder)
+                self.save(update_fields=self.PLACEHOLDER_FIELDS)
+            self.renditions.all().delete()
+            for rendition in rendered:
+                MediaRendition.objects.create(media=self, format=rendition.format, width=rendition.width,
+                                              height=rendition.height, file=rendition.name)
+            feed_cache.invalidate([self.post_id])
+    
+    def process(self):
+        """Run all post-upload processing for this media and mark it ready."""
+        if self.media_type == self.MEDIA_TYPE_VIDEO:
+            # Remux first so the decode pass reads the final file
+            remuxed = not self.is_faststart and self.ensure_faststart()
+            if remuxed or not self.thumbnail or not self.storyboard or self.file_size is None:
+                self.decode_video(metadata=remuxed)
+        else:
+            # First, so metadata, hash and renditions describe the file served
+            normalized = self.original_size is None and self.normalize_image()
+            if normalized or self.file_size is None:
+                self.read_image_metadata()
+        if self.phash is None:
+            self.compute_phash()
+        if not self.renditions.exists():
+            self.generate_renditions()
+        self.status = self.STATUS_READY
+        self.save(update_fields=['status'])
+
+
+class MediaRendition(models.Model):
+    """
+    A downscaled WebP or progressive JPEG copy of a PostMedia's still image,
+    one per rung of the width ladder in core.media.renditions. Files live in
+    content-addressed storage and are reference-counted like PostMedia's.
+    """
+    FORMAT_CHOICES = [
+        (FORMAT_WEBP, 'WebP'),
+        (FORMAT_JPEG, 'JPEG'),
+    ]
+    
+    media = models.ForeignKey(PostMedia, on_delete=models.CASCADE, related_name='renditions')
+    format = models.CharField(max_length=4, choices=FORMAT_CHOICES)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    file = models.FileField(upload_to='posts/renditions/', storage=media_storage)
+    
+    class Meta:
+        ordering = ['media', 'format', 'width']
+        constraints = [
+            models.UniqueConstraint(fields=['media', 'format', 'width'], name='core_mediarendition_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.width}px {self.get_format_display()} of PostMedia {self.media_id}"
+
 
 class SaleItem(models.Model):
     post = models.OneToOneField(Post, on_delete=models.CASCADE, related_name='saleitem')
     price = models.DecimalField(max_digits=10, decimal_places=2)
     is_sold = models.BooleanField(default=False)
+    # Copy of post.created_at (which never changes) so the shelf can sort by
+    # recency from an index on this table instead of joining Post
+    post_created_at = models.DateTimeField(editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Shelf listings: unsold items by price, and by recency. Partial
+            # indexes rather than (is_sold, ...): Django filters booleans as
+            # "WHERE NOT is_sold", which can't seek on a leading is_sold column
+            # but does match an index with the same WHERE; sold items also
+            # drop out of the index entirely
+            models.Index(fields=['price'], condition=models.Q(is_sold=False), name='core_saleitem_price_idx'),
+            models.Index(fields=['post_created_at'], condition=models.Q(is_sold=False), name='core_saleitem_recent_idx'),
+        ]
 
     def __str__(self):
         return f"SaleItem for Post {self.post.id} - {'Sold' if self.is_sold else 'Available'}"
 
+    def save(self, *args, **kwargs):
+        if self.post_created_at is None:
+            self.post_created_at = self.post.created_at
+        super().save(*args, **kwargs)
+
+
+class PostTombstone(models.Model):
+    """
+    A deleted post, so /api/posts/changes/ can tell clients to drop it.
+    Kept for RETENTION; clients whose cursor is older must reload the feed.
+    """
+    RETENTION = timedelta(days=30)
+
+    post_id = models.PositiveIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_at', 'post_id'], name='core_tombstone_changes_idx'),
+        ]
+
+    def __str__(self):
+        return f"Post {self.post_id} deleted at {self.deleted_at}"
+
+    @classmethod
+    def purge_expired(cls):
+        cls.objects.filter(deleted_at__lt=timezone.now() - cls.RETENTION).delete()
+
+
+
+class MediaJob(models.Model):
+    """
+    A unit of background work on a PostMedia, claimed and run by the media
+    worker (see core.jobs and the run_media_worker command).
+    """
+    KIND_PROCESS = 'process_media'
+    
+    KIND_CHOICES = [
+        (KIND_PROCESS, 'Process media'),
+    ]
+    
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    
+    media = models.ForeignKey(PostMedia, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES, default=KIND_PROCESS)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['run_after', 'id']
+        indexes = [
+            # The worker's claim query: next runnable queued jobs
+            models.Index(fields=['status', 'run_after'], name='core_mediajob_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} for PostMedia {self.media_id} ({self.status})"
+
+
+class MediaBlob(models.Model):
+    """
+    Reference count for a content-addressed file in media storage. Several
+    PostMedia rows (files and thumbnails) can point at the same blob; the file
+    is deleted when the count drops to zero. Maintained by core.signals.
+    """
+    name = models.CharField(max_length=255, unique=True, help_text='Storage path, named by SHA-256')
+    size = models.BigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload. Chunks are written with pwrite straight into
+    ``partial_path`` under MEDIA_ROOT; finalize() renames that file into
+    content-addressed storage (no copy) and creates the Post and PostMedia.
+    """
+    STATUS_OPEN = 'open'
+    STATUS_FINALIZING = 'finalizing'
+    STATUS_FINALIZED = 'finalized'
+    
+    STATUS_CHOICES = [
+        (STATUS_OPEN, 'Open'),
+        (STATUS_FINALIZING, 'Finalizing'),
+        (STATUS_FINALIZED, 'Finalized'),
+    ]
+    
+    # Sessions not finalized within this window are purged with their partial file
+    EXPIRY = timedelta(days=1)
+    PARTIAL_DIR = '.uploads'
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    creator = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    media_type = models.CharField(max_length=10, choices=PostMedia.MEDIA_TYPE_CHOICES)
+    total_size = models.BigIntegerField()
+    caption = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_OPEN)
+    post = models.ForeignKey(Post, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.filename}, {self.status})"
+
+    @property
+    def partial_path(self):
+        # Hidden directory: never served by core.media_server
+        return os.path.join(settings.MEDIA_ROOT, self.PARTIAL_DIR, f'{self.id}.part')
+
+    def received_ranges(self):
+        """Merged, sorted list of inclusive (start, end) byte ranges received so far."""
+        merged = []
+        for start, end in self.chunks.order_by('start').values_list('start', 'end'):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return [tuple(r) for r in merged]
+
+    def missing_ranges(self, received=None):
+        received = self.received_ranges() if received is None else received
+        missing = []
+        position = 0
+        for start, end in received:
+            if start > position:
+                missing.append((position, start - 1))
+            position = max(position, end + 1)
+        if position < self.total_size:
+            missing.append((position, self.total_size - 1))
+        return missing
+
+    def allocate(self):
+        """Create the sparse partial file the chunks are written into."""
+        os.makedirs(os.path.dirname(self.partial_path), exist_ok=True)
+        fd = os.open(self.partial_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, self.total_size)
+        finally:
+            os.close(fd)
+
+    def write_chunk(self, start, stream, length, block_size=1024 * 1024):
+        """
+        pwrite up to ``length`` bytes from ``stream`` at ``start``. Whatever
+        arrived is recorded even if the client disconnects part-way, so the
+        next attempt resumes from the first missing byte. Returns bytes written.
+        """
+        written = 0
+        fd = os.open(self.partial_path, os.O_WRONLY)
+        try:
+            while written < length:
+                block = stream.read(min(block_size, length - written))
+                if not block:
+                    break
+                os.pwrite(fd, block, start + written)
+                written += len(block)
+        finally:
+            os.close(fd)
+            if written:
+                UploadChunk.objects.create(session=self, start=start, end=start + written - 1)
+        return written
+
+    def finalize(self):
+        """
+        Move the completed file into media storage and create its Post and
+        PostMedia. The rename stays on one filesystem, so nothing is copied.
+        Returns the Post, or None if another request claimed the session first.
+        If anything fails, the file is moved back and the session reopened,
+        so the client can finalize again.
+        """
+        from .storage import content_addressed_name, hash_file, media_storage
+        
+        # Conditional UPDATE: of two overlapping requests only one moves the file
+        claimed = UploadSession.objects.filter(pk=self.pk, status=self.STATUS_OPEN).update(
+            status=self.STATUS_FINALIZING, updated_at=timezone.now())
+        if not claimed:
+            return None
+        self.status = self.STATUS_FINALIZING
+        moved = False
+        try:
+            storage = media_storage()
+            digest = hash_file(self.partial_path)
+            name = content_addressed_name('posts/media', digest, os.path.splitext(self.filename)[1])
+            final_path = storage.path(name)
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            # Holding the write lock, so the blob's last reference can't be released and
+            # its file deleted between the exists() check and our row (see core.signals)
+            with transaction.atomic():
+                if not os.path.exists(final_path):
+                    os.chmod(self.partial_path, 0o644)
+                    os.replace(self.partial_path, final_path)
+                    moved = True
+                post = Post.objects.create(creator=self.creator, caption=self.caption)
+                # Assigning the stored name (not a File) means Django won't re-save it
+                PostMedia.objects.create(post=post, media_type=self.media_type, file=name, order=0)
+                self.post = post
+                self.status = self.STATUS_FINALIZED
+                self.save(update_fields=['post', 'status', 'updated_at'])
+                self.chunks.all().delete()
+        except BaseException:
+            # Nothing references the moved file: put it back and let the client retry
+            if moved:
+                os.replace(final_path, self.partial_path)
+            self.post = None
+            self.status = self.STATUS_OPEN
+            UploadSession.objects.filter(pk=self.pk).update(status=self.STATUS_OPEN)
+            raise
+        if not moved:
+            # Already stored: the upload becomes another reference to it
+            os.unlink(self.partial_path)
+        return post
+
+    def discard(self):
+        if os.path.exists(self.partial_path):
+            os.unlink(self.partial_path)
+        self.delete()
+
+    @classmethod
+    def purge_expired(cls):
+        cutoff = timezone.now() - cls.EXPIRY
+        for session in cls.objects.filter(status=cls.STATUS_OPEN, updated_at__lt=cutoff):
+            session.discard()
+
+
+class UploadChunk(models.Model):
+    """
+    A byte range received for an UploadSession. One row per chunk means
+    concurrent or out-of-order PUTs only ever insert, never race on an update.
+    """
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    start = models.BigIntegerField()
+    end = models.BigIntegerField(help_text='Inclusive')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['session', 'start'], name='core_uploadchunk_session_idx'),
+        ]
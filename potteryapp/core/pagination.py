@@ -0,0 +1,195 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset ("seek") pagination over a fixed, unique ordering.
+
+    The cursor is the tuple of ordering values of the last row on the page, so
+    fetching page N costs the same as fetching page 1: one indexed range scan
+    with a LIMIT, no OFFSET and no COUNT(*).
+
+    Pagination is opt-in: it only kicks in when the client sends ``cursor`` or
+    ``page_size``. Without either, the view keeps returning a plain list so
+    existing clients continue to work. Subclasses for new endpoints can set
+    ``opt_in = False`` to always paginate.
+    """
+    opt_in = True
+    # Must end in a unique field so every row has a distinct position
+    ordering = ('-created_at', '-id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 20
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def is_requested(self, request: Request) -> bool:
+        if not self.opt_in:
+            return True
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_ordering(self, view=None) -> tuple[str, ...]:
+        return tuple(getattr(view, 'keyset_ordering', None) or self.ordering)
+
+    def get_page_size(self, request: Request) -> int:
+        raw = request.query_params.get(self.page_size_query_param)
+        if raw is None:
+            return self.page_size
+        try:
+            size = int(raw)
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, values: list) -> str:
+        payload = json.dumps(values, separators=(',', ':'), default=str)
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor: str, queryset: QuerySet, ordering: tuple[str, ...]) -> list:
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if not isinstance(values, list) or len(values) != len(ordering):
+                raise ValueError
+            # Coerce each JSON value back through the model field so dates,
+            # decimals etc. compare correctly in the WHERE clause
+            return [
+                self._get_field(queryset.model, name.lstrip('-')).to_python(value)
+                for name, value in zip(ordering, values)
+            ]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def _get_field(self, model, path: str):
+        field = None
+        for part in path.split('__'):
+            field = model._meta.get_field(part)
+            model = field.related_model
+        return field
+
+    def _get_value(self, obj, path: str):
+        # Pages may hold model instances or .values() rows
+        if isinstance(obj, dict):
+            return obj[path]
+        for part in path.split('__'):
+            obj = getattr(obj, part)
+        return obj
+
+    def seek_filter(self, ordering: tuple[str, ...], values: list) -> Q:
+        """
+        Build the lexicographic "strictly after" predicate for the cursor.
+
+        For ordering (a, b) that is: a > x OR (a = x AND b > y), with the
+        comparison flipped for descending fields.
+        """
+        condition = Q()
+        equal_prefix = Q()
+        for name, value in zip(ordering, values):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            condition |= equal_prefix & Q(**{f'{field}__{lookup}': value})
+            equal_prefix &= Q(**{field: value})
+        return condition
+
+    def paginate_queryset(self, queryset: QuerySet, request: Request, view=None) -> list | None:
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset: QuerySet, request: Request, view=None) -> list | None:
+        """paginate_queryset() evaluating the page through the async ORM."""
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page([row async for row in queryset])
+
+    def page_queryset(self, queryset: QuerySet, request: Request, view=None) -> QuerySet | None:
+        """The unevaluated page query, one row longer than the page; None when not paginating."""
+        if not self.is_requested(request):
+            return None
+
+        self.request = request
+        self.page_ordering = self.get_ordering(view)
+        self.limit = self.get_page_size(request)
+        queryset = queryset.order_by(*self.page_ordering)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            values = self.decode_cursor(cursor, queryset, self.page_ordering)
+            queryset = queryset.filter(self.seek_filter(self.page_ordering, values))
+
+        # Fetch one extra row to know whether there is a next page
+        return queryset[:self.limit + 1]
+
+    def set_page(self, rows: list) -> list:
+        self.has_next = len(rows) > self.limit
+        self.page = rows[:self.limit]
+
+        self.next_cursor = None
+        if self.has_next:
+            last = self.page[-1]
+            self.next_cursor = self.encode_cursor(
+                [self._get_value(last, name.lstrip('-')) for name in self.page_ordering]
+            )
+        return self.page
+
+    def get_next_link(self) -> str | None:
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data) -> Response:
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema: dict) -> dict:
+        paginated = {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+        if not self.opt_in:
+            return paginated
+        # Unpaginated requests still get the bare list, so document both shapes
+        return {'oneOf': [schema, paginated]}
+
+    def get_schema_operation_parameters(self, view) -> list[dict]:
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Opaque keyset cursor taken from the previous page\'s "next" link.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': f'Number of results per page (max {self.max_page_size}).'
+                               + (' Enables pagination.' if self.opt_in else ''),
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+
+class ShelfPagination(KeysetPagination):
+    """The shelf is a new endpoint with no list-shaped clients: always paginate."""
+    opt_in = False
@@ -0,0 +1,29 @@
+"""
+Rendition widths and formats, and how renditions are serialized.
+
+Rendering and storing the ladder needs Pillow and lives in
+core.media.renditions; this module is what models, serializers and the
+fast feed path need, and imports nothing heavy.
+"""
+from collections.abc import Iterable
+
+WIDTHS = (320, 640, 1080)
+FORMAT_WEBP = 'webp'
+FORMAT_JPEG = 'jpeg'
+# Order of the formats in the serialized ``renditions`` map
+FORMATS = (FORMAT_WEBP, FORMAT_JPEG)
+
+
+def rendition_map(rows: Iterable[tuple[str, int, str]]) -> dict[str, dict[str, str]]:
+    """
+    The ``renditions`` value of a serialized media item from (format, width,
+    url) rows: ``{"webp": {"320": url, ...}, "jpeg": {...}}``, formats in
+    FORMATS order and widths ascending.
+    """
+    by_format: dict[str, dict[int, str]] = {}
+    for fmt, width, url in rows:
+        by_format.setdefault(fmt, {})[width] = url
+    return {
+        fmt: {str(width): by_format[fmt][width] for width in sorted(by_format[fmt])}
+        for fmt in FORMATS if fmt in by_format
+    }
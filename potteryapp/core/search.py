@@ -0,0 +1,138 @@
+"""
+Full-text search over post captions and creator usernames.
+
+``core_post_fts`` is an SQLite FTS5 table with one row per post (rowid = post
+id). Triggers created in migration 0011 keep it in sync with every insert,
+update and delete on core_post and username change on the user table, so
+bulk_create, queryset.update() and raw SQL are covered as well as save().
+``manage.py rebuild_search_index`` repopulates it from scratch.
+
+On databases without FTS5 ``is_available()`` is False and callers fall back to
+``icontains``.
+"""
+import html
+import re
+from dataclasses import dataclass
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Q, QuerySet
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+
+FTS_TABLE = 'core_post_fts'
+# bm25() column weights: a caption hit counts for more than a username hit
+CAPTION_WEIGHT = 2.0
+USERNAME_WEIGHT = 1.0
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_END = '</mark>'
+# What highlight() wraps matches in: private-use characters that survive
+# HTML escaping and are then swapped for the tags above
+MATCH_START = '\ue000'
+MATCH_END = '\ue001'
+# Queries are ANDed prefix terms; more than this is not a caption search
+MAX_TERMS = 8
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+@dataclass
+class SearchHit:
+    post_id: int
+    # Negated bm25(): higher is a better match
+    score: float
+    caption: str
+    creator_username: str
+
+
+def is_available() -> bool:
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query: str) -> str | None:
+    """
+    Turn user input into an FTS5 MATCH expression: each word becomes a quoted
+    prefix term (so FTS syntax in the input is never interpreted) and all
+    terms must match. Returns None if the input has no words.
+    """
+    terms = TERM_RE.findall(query)[:MAX_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def highlight_html(text: str) -> str:
+    """``text`` HTML-escaped, with the MATCH_START/MATCH_END spans turned into <mark> tags."""
+    return html.escape(text).replace(MATCH_START, HIGHLIGHT_START).replace(MATCH_END, HIGHLIGHT_END)
+
+
+def search_posts(query: str, limit: int = 20, offset: int = 0) -> list[SearchHit]:
+    """
+    Best matches first (bm25). Caption and username are HTML: escaped, with
+    matched terms wrapped in <mark> tags. Without FTS5 this is an unranked
+    icontains search, newest first, without highlights.
+    """
+    if not is_available():
+        rows = (
+            filter_posts(Post.objects.order_by('-created_at', '-id'), query)
+            .values_list('id', 'caption', 'creator__username')[offset:offset + limit]
+        )
+        return [SearchHit(post_id, 0.0, html.escape(caption), html.escape(username))
+                for post_id, caption, username in rows]
+
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    sql = f'''
+        SELECT rowid, -bm25({FTS_TABLE}, %s, %s) AS score,
+               highlight({FTS_TABLE}, 0, %s, %s),
+               highlight({FTS_TABLE}, 1, %s, %s)
+        FROM {FTS_TABLE}
+        WHERE {FTS_TABLE} MATCH %s
+        ORDER BY score DESC, rowid DESC
+        LIMIT %s OFFSET %s
+    '''
+    params = [
+        CAPTION_WEIGHT, USERNAME_WEIGHT,
+        MATCH_START, MATCH_END, MATCH_START, MATCH_END,
+        expression, limit, offset,
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [SearchHit(post_id, score, highlight_html(caption), highlight_html(username))
+                for post_id, score, caption, username in cursor.fetchall()]
+
+
+def filter_posts(queryset: QuerySet, query: str, post_field: str = 'pk') -> QuerySet:
+    """
+    Restrict a queryset to rows whose post matches ``query``, via the FTS
+    index where available and caption/username ``icontains`` otherwise.
+    """
+    if not is_available():
+        prefix = '' if post_field == 'pk' else post_field + '__'
+        condition = Q()
+        for term in query.split():
+            condition &= Q(**{f'{prefix}caption__icontains': term}) | Q(**{f'{prefix}creator__username__icontains': term})
+        return queryset.filter(condition)
+    expression = match_expression(query)
+    if expression is None:
+        return queryset.none()
+    matches = RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [expression])
+    return queryset.filter(**{f'{post_field}__in': matches})
+
+
+def rebuild() -> int:
+    """Repopulate the index from core_post. Returns the number of rows indexed."""
+    user_table = connection.ops.quote_name(get_user_model()._meta.db_table)
+    post_table = connection.ops.quote_name(Post._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE}(rowid, caption, creator_username) '
+            f'SELECT p.id, p.caption, u.username FROM {post_table} p JOIN {user_table} u ON u.id = p.creator_id'
+        )
+        count = cursor.rowcount
+        # Merge the b-trees written by the bulk insert
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+    return count
@@ -1,20 +1,47 @@
 from rest_framework import serializers
-from .models import Post, SaleItem, PostMedia
+from django.conf import settings
+from .models import Post, SaleItem, PostMedia, UploadSession
+from .renditions import rendition_map
+from .search import match_expression
+from .sync import Cursor, InvalidCursor
 
 class SaleItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = SaleItem
         fields = ['id', 'price', 'is_sold']
 
+class MediaMetadataSerializer(serializers.ModelSerializer):
+    """What a client needs to size a media cell before fetching the file; empty until processed."""
+    class Meta:
+        model = PostMedia
+        fields = PostMedia.METADATA_FIELDS
+
+class MediaPlaceholderSerializer(serializers.ModelSerializer):
+    """Painted in the media's cell until its picture loads; empty until processed."""
+    class Meta:
+        model = PostMedia
+        fields = PostMedia.PLACEHOLDER_FIELDS
+
 class PostMediaSerializer(serializers.ModelSerializer):
     file_url = serializers.SerializerMethodField()
     thumbnail_url = serializers.SerializerMethodField()
+    storyboard_url = serializers.SerializerMethodField(
+        help_text='WebVTT scrub-preview index (videos only); its cues point at JPEG sprite sheets '
+                  'with #xywh fragments, relative to the VTT'
+    )
+    metadata = MediaMetadataSerializer(source='*', read_only=True)
+    placeholder = MediaPlaceholderSerializer(source='*', read_only=True)
+    renditions = serializers.SerializerMethodField(
+        help_text='Downscaled copies of the image (or video thumbnail): {format: {width: url}}, '
+                  'widths ascending. Empty until processing finishes.'
+    )
     
     class Meta:
         model = PostMedia
-        fields = ['id', 'file_url', 'thumbnail_url', 'media_type', 'order']
+        fields = ['id', 'file_url', 'thumbnail_url', 'storyboard_url', 'media_type', 'order', 'status', 'metadata',
+                  'placeholder', 'renditions']
     
-    def get_file_url(self, obj):
+    def get_file_url(self, obj) -> str | None:
         request = self.context.get('request')
         if obj.file and obj.file.name:
             # Get the URL from the file field
@@ -36,7 +63,7 @@ class PostMediaSerializer(serializers.ModelSerializer):
                 return None
         return None
     
-    def get_thumbnail_url(self, obj):
+    def get_thumbnail_url(self, obj) -> str | None:
         request = self.context.get('request')
         if obj.thumbnail and obj.thumbnail.name:
             try:
@@ -49,10 +76,26 @@ class PostMediaSerializer(serializers.ModelSerializer):
                 return None
         return None
 
+    def get_storyboard_url(self, obj) -> str | None:
+        if not obj.storyboard:
+            return None
+        request = self.context.get('request')
+        url = obj.storyboard.url
+        return request.build_absolute_uri(url) if request else url
+    
+    def get_renditions(self, obj) -> dict[str, dict[str, str]]:
+        request = self.context.get('request')
+        rows = []
+        # .all() so a prefetch_related('media__renditions') is used
+        for rendition in obj.renditions.all():
+            url = rendition.file.url
+            rows.append((rendition.format, rendition.width, request.build_absolute_uri(url) if request else url))
+        return rendition_map(rows)
+
 class PostSerializer(serializers.ModelSerializer):
     # Explicitly tell Django this is a Boolean, not a String
     is_for_sale = serializers.BooleanField(read_only=True)
-    sale_item = SaleItemSerializer(read_only=True, source='saleitem')
+    sale_item = SaleItemSerializer(read_only=True, allow_null=True, source='saleitem')
     creator_username = serializers.CharField(read_only=True, source='creator.username')
     media = PostMediaSerializer(many=True, read_only=True)
 
@@ -62,4 +105,113 @@ class PostSerializer(serializers.ModelSerializer):
 
 # NEW: A tiny serializer just for the "List on Shelf" action
 class ShelfListingSerializer(serializers.Serializer):
-    price = serializers.DecimalField(max_digits=10, decimal_places=2)
\ No newline at end of file
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+class ShelfItemSerializer(serializers.ModelSerializer):
+    post = PostSerializer(read_only=True)
+    
+    class Meta:
+        model = SaleItem
+        fields = ['id', 'price', 'is_sold', 'post']
+
+class ShelfQuerySerializer(serializers.Serializer):
+    """Query parameters accepted by GET /api/shelf/."""
+    ORDERING_CHOICES = ['-created_at', 'created_at', 'price', '-price']
+    
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, min_value=0)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, min_value=0)
+    creator = serializers.IntegerField(required=False, min_value=1, help_text='Only items posted by this user id')
+    ordering = serializers.ChoiceField(choices=ORDERING_CHOICES, default='-created_at',
+                                       help_text='Newest first by default; "price" / "-price" sort by price')
+    
+    def validate(self, attrs):
+        low, high = attrs.get('min_price'), attrs.get('max_price')
+        if low is not None and high is not None and low > high:
+            raise serializers.ValidationError({'max_price': 'max_price must not be less than min_price'})
+        return attrs
+
+class SearchQuerySerializer(serializers.Serializer):
+    """Query parameters accepted by GET /api/posts/search/."""
+    q = serializers.CharField(help_text='Words to find in captions and usernames; each matches as a prefix')
+    limit = serializers.IntegerField(required=False, default=20, min_value=1, max_value=100)
+    offset = serializers.IntegerField(required=False, default=0, min_value=0)
+    
+    def validate_q(self, value):
+        if match_expression(value) is None:
+            raise serializers.ValidationError('Enter at least one word to search for.')
+        return value
+
+class SearchResultSerializer(serializers.Serializer):
+    score = serializers.FloatField(help_text='Relevance; higher is better')
+    caption_highlight = serializers.CharField(
+        help_text='Caption as HTML: escaped, with matched terms wrapped in <mark></mark>')
+    creator_username_highlight = serializers.CharField(
+        help_text='Username as HTML: escaped, with matched terms wrapped in <mark></mark>')
+    post = PostSerializer()
+
+class SimilarQuerySerializer(serializers.Serializer):
+    """Query parameters accepted by GET /api/posts/{id}/similar/."""
+    radius = serializers.IntegerField(required=False, default=6, min_value=0, max_value=10,
+                                      help_text='Maximum Hamming distance between perceptual hashes (bits of 64)')
+    limit = serializers.IntegerField(required=False, default=20, min_value=1, max_value=100)
+
+class SimilarPostSerializer(serializers.Serializer):
+    distance = serializers.IntegerField(help_text='Hamming distance of the closest pair of media; 0 is a near-exact match')
+    post = PostSerializer()
+
+class ChangesQuerySerializer(serializers.Serializer):
+    """Query parameters accepted by GET /api/posts/changes/."""
+    since = serializers.CharField(required=False, help_text='The cursor of the previous sync; omit to get every post')
+    limit = serializers.IntegerField(required=False, default=100, min_value=1, max_value=500)
+    
+    def validate_since(self, value):
+        try:
+            return Cursor.decode(value)
+        except InvalidCursor as e:
+            raise serializers.ValidationError(str(e))
+
+class PostChangesSerializer(serializers.Serializer):
+    created = PostSerializer(many=True, help_text='Posts created since the cursor')
+    updated = PostSerializer(many=True, help_text='Posts changed since the cursor (upsert these too)')
+    deleted = serializers.ListField(child=serializers.IntegerField(), help_text='Ids of posts deleted since the cursor')
+    cursor = serializers.CharField(allow_null=True, help_text='Pass as "since" next time; null until a post exists')
+    has_more = serializers.BooleanField(help_text='More changes are waiting: sync again with the new cursor')
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    received_bytes = serializers.SerializerMethodField()
+    missing_ranges = serializers.SerializerMethodField()
+    next_offset = serializers.SerializerMethodField()
+    media_type = serializers.ChoiceField(choices=PostMedia.MEDIA_TYPE_CHOICES, required=False)
+    
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'filename', 'media_type', 'total_size', 'caption', 'status', 'post',
+                  'received_bytes', 'missing_ranges', 'next_offset', 'created_at']
+        read_only_fields = ['id', 'status', 'post', 'created_at']
+    
+    def _missing(self, obj):
+        # Computed once per object; three fields read it
+        if getattr(obj, '_missing_cache', None) is None:
+            obj._missing_cache = obj.missing_ranges()
+        return obj._missing_cache
+    
+    def get_received_bytes(self, obj) -> int:
+        return obj.total_size - sum(end - start + 1 for start, end in self._missing(obj))
+    
+    def get_missing_ranges(self, obj) -> list[list[int]]:
+        return [[start, end] for start, end in self._missing(obj)]
+    
+    def get_next_offset(self, obj) -> int | None:
+        missing = self._missing(obj)
+        return missing[0][0] if missing else None
+    
+    def validate_total_size(self, value):
+        limit = settings.UPLOAD_MAX_SIZE
+        if value <= 0 or value > limit:
+            raise serializers.ValidationError(f'total_size must be between 1 and {limit} bytes')
+        return value
+    
+    def validate(self, attrs):
+        if not attrs.get('media_type'):
+            attrs['media_type'] = PostMedia.media_type_for_filename(attrs['filename'])
+        return attrs
@@ -0,0 +1,163 @@
+"""
+Model signal handlers for the core app. Connected in CoreConfig.ready().
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import feed_cache, similarity
+from .models import MediaBlob, MediaRendition, Post, PostMedia, PostTombstone, SaleItem
+from .storage import BlobMissing, digest_from_name, media_storage
+
+# PostMedia fields whose files live in content-addressed storage
+BLOB_FIELDS = ('file', 'original', 'thumbnail', 'storyboard')
+# PostMedia fields holding lists of storage names
+BLOB_LIST_FIELDS = ('storyboard_sheets',)
+
+
+def send_bulk_post_save(model, instances, *, created: bool, update_fields=None) -> None:
+    """
+    Send post_save for rows written by bulk_create or bulk_update, which send
+    no signals. Blob references, the feed cache and the similarity index are
+    all maintained by post_save receivers.
+    """
+    update_fields = frozenset(update_fields) if update_fields is not None else None
+    for instance in instances:
+        post_save.send(sender=model, instance=instance, created=created, update_fields=update_fields,
+                       raw=False, using=instance._state.db)
+
+
+def stored_blob_names(instance: PostMedia) -> set[str]:
+    names = [getattr(instance, field_name).name for field_name in BLOB_FIELDS]
+    for field_name in BLOB_LIST_FIELDS:
+        names.extend(getattr(instance, field_name) or [])
+    # Legacy, suffix-named files are never shared, so they aren't counted
+    return {name for name in names if name and digest_from_name(name)}
+
+
+def add_blob_reference(name: str) -> None:
+    # A MediaBlob row means nothing can delete the file until it is released
+    if MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1):
+        return
+    storage = media_storage()
+    try:
+        with transaction.atomic():
+            # Storage found the file, but its last reference may have been
+            # released since. The write lock orders this check with the one
+            # in delete_unreferenced_file: either it sees this row, or the
+            # file is already gone here
+            if not storage.exists(name):
+                raise BlobMissing(name)
+            MediaBlob.objects.create(name=name, size=storage.size(name), refcount=1)
+    except IntegrityError:
+        # Another request created it first
+        MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+
+def release_blob_reference(name: str) -> None:
+    MediaBlob.objects.filter(name=name, refcount__gt=0).update(refcount=F('refcount') - 1)
+    if MediaBlob.objects.filter(name=name, refcount=0).delete()[0]:
+        delete_unreferenced_file(name)
+
+
+def delete_unreferenced_file(name: str) -> None:
+    """Delete a stored file once the transaction commits, unless a MediaBlob references it by then."""
+    def delete_file():
+        # An identical upload may have re-created the blob since; keep the file then.
+        # atomic() takes SQLite's write lock (transaction_mode IMMEDIATE), so no
+        # transaction can add a reference between this check and the delete
+        with transaction.atomic():
+            if not MediaBlob.objects.filter(name=name).exists():
+                media_storage().delete(name)
+    transaction.on_commit(delete_file)
+
+
+@receiver(post_init, sender=PostMedia)
+def remember_blob_names(sender, instance, **kwargs):
+    instance._stored_blob_names = stored_blob_names(instance) if instance.pk else set()
+
+
+@receiver(post_save, sender=PostMedia)
+def update_blob_references(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & {*BLOB_FIELDS, *BLOB_LIST_FIELDS}:
+        return
+    old = set() if created else instance._stored_blob_names
+    new = stored_blob_names(instance)
+    for name in new - old:
+        add_blob_reference(name)
+    for name in old - new:
+        release_blob_reference(name)
+    instance._stored_blob_names = new
+
+
+@receiver(post_delete, sender=PostMedia)
+def release_blob_references(sender, instance, **kwargs):
+    for name in instance._stored_blob_names:
+        release_blob_reference(name)
+
+
+@receiver(post_save, sender=MediaRendition)
+def add_rendition_blob_reference(sender, instance, created, **kwargs):
+    # Renditions are replaced, never edited, so only creation adds a reference
+    if created and digest_from_name(instance.file.name):
+        add_blob_reference(instance.file.name)
+
+
+@receiver(post_delete, sender=MediaRendition)
+def release_rendition_blob_reference(sender, instance, **kwargs):
+    if digest_from_name(instance.file.name):
+        release_blob_reference(instance.file.name)
+
+
+@receiver(pre_save, sender=Post)
+def bump_post_version(sender, instance, **kwargs):
+    # Saved with the row itself (Post.save adds both to update_fields); see core.feed_cache
+    if instance.pk is not None:
+        instance.version += 1
+        instance.updated_at = timezone.now()
+        feed_cache.stats.record(invalidations=1)
+
+
+@receiver(post_delete, sender=Post)
+def record_post_tombstone(sender, instance, **kwargs):
+    # Tells delta-sync clients to drop it (see PostViewSet.changes)
+    PostTombstone.purge_expired()
+    PostTombstone.objects.create(post_id=instance.pk)
+
+
+@receiver(post_save, sender=PostMedia)
+@receiver(post_delete, sender=PostMedia)
+@receiver(post_save, sender=SaleItem)
+@receiver(post_delete, sender=SaleItem)
+def invalidate_parent_post_fragment(sender, instance, **kwargs):
+    feed_cache.invalidate([instance.post_id])
+
+
+@receiver(post_init, sender=settings.AUTH_USER_MODEL)
+def remember_username(sender, instance, **kwargs):
+    instance._saved_username = instance.get_username() if instance.pk else None
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_creator_fragments(sender, instance, created, update_fields=None, **kwargs):
+    # Fragments embed creator_username; other saves (last_login on every
+    # login) must not touch the creator's posts
+    username = instance.get_username()
+    renamed = not created and username != instance._saved_username
+    if renamed and (update_fields is None or sender.USERNAME_FIELD in update_fields):
+        feed_cache.invalidate(Post.objects.filter(creator=instance).values_list('pk', flat=True))
+    instance._saved_username = username
+
+
+@receiver(post_save, sender=PostMedia)
+def update_similarity_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: similarity.media_saved(instance))
+
+
+@receiver(post_delete, sender=PostMedia)
+def remove_from_similarity_index(sender, instance, **kwargs):
+    media_id = instance.pk
+    transaction.on_commit(lambda: similarity.media_deleted(media_id))
@@ -0,0 +1,119 @@
+"""
+"More like this": posts whose media look like a given post's media.
+
+Every image PostMedia and every video thumbnail gets a 64-bit dHash
+(PostMedia.phash, computed by the media worker). This module keeps a
+process-wide HashIndex of them:
+
+- it is loaded lazily on the first query;
+- media hashed in this process are added as they are saved (core.signals);
+- hashes written by other processes (the media worker) are picked up by a
+  cheap catch-up query on ``hashed_at`` at most every SYNC_INTERVAL seconds.
+
+Deleted media and posts are removed in-process by signals; results are always
+re-read from the database, so a post deleted elsewhere never comes back.
+"""
+import threading
+import time
+from datetime import timedelta
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .media.phash import HashIndex
+
+# Seconds between catch-up queries for hashes written by other processes
+SYNC_INTERVAL = 1.0
+# Re-read rows hashed this long before the newest one seen, so a transaction
+# that committed late with an older timestamp is still picked up
+SYNC_OVERLAP = timedelta(seconds=60)
+LOAD_BATCH = 10_000
+
+# core.media.phash (NumPy) is imported on the first query, not at startup
+_index: 'HashIndex | None' = None
+_watermark = None
+_synced_at = 0.0
+_lock = threading.Lock()
+
+
+def _load_rows(queryset) -> None:
+    global _watermark
+    from .media.phash import to_unsigned
+
+    rows = queryset.values_list('id', 'post_id', 'phash', 'hashed_at').order_by().iterator(chunk_size=LOAD_BATCH)
+    for media_id, post_id, value, hashed_at in rows:
+        _index.add(media_id, post_id, to_unsigned(value))
+        if _watermark is None or hashed_at > _watermark:
+            _watermark = hashed_at
+
+
+def get_index() -> 'HashIndex':
+    """The loaded, up-to-date index for this process."""
+    global _index, _synced_at
+    from .media.phash import HashIndex
+    from .models import PostMedia
+
+    with _lock:
+        hashed = PostMedia.objects.filter(phash__isnull=False)
+        if _index is None:
+            _index = HashIndex()
+            _load_rows(hashed)
+            _synced_at = time.monotonic()
+        elif time.monotonic() - _synced_at >= SYNC_INTERVAL:
+            if _watermark is not None:
+                hashed = hashed.filter(hashed_at__gte=_watermark - SYNC_OVERLAP)
+            _load_rows(hashed)
+            _synced_at = time.monotonic()
+        return _index
+
+
+def reset() -> None:
+    """Forget the in-process index; the next query reloads it."""
+    global _index, _watermark, _synced_at
+    with _lock:
+        _index = None
+        _watermark = None
+        _synced_at = 0.0
+
+
+def media_saved(media) -> None:
+    """Keep a loaded index current with a PostMedia saved in this process."""
+    with _lock:
+        if _index is None:
+            return
+        from .media.phash import to_unsigned
+
+        if media.phash is None:
+            _index.remove(media.pk)
+        else:
+            _index.add(media.pk, media.post_id, to_unsigned(media.phash))
+
+
+def media_deleted(media_id: int) -> None:
+    with _lock:
+        if _index is not None:
+            _index.remove(media_id)
+
+
+def similar_posts(post_id: int, radius: int, limit: int) -> list[tuple[int, int]]:
+    """
+    Posts with any media within ``radius`` bits of any of ``post_id``'s media,
+    as (post id, smallest distance), closest first, then newest first.
+    """
+    from .media.phash import to_unsigned
+    from .models import Post, PostMedia
+
+    own = [to_unsigned(value) for value in
+           PostMedia.objects.filter(post_id=post_id, phash__isnull=False).values_list('phash', flat=True)]
+    if not own:
+        return []
+    index = get_index()
+    best: dict[int, int] = {}
+    with _lock:
+        for value in own:
+            for _, group, distance in index.search(value, radius):
+                if group != post_id and distance < best.get(group, radius + 1):
+                    best[group] = distance
+    # Drop posts deleted by another process since the index saw them
+    existing = set(Post.objects.filter(pk__in=list(best)).values_list('pk', flat=True))
+    ranked = sorted((item for item in best.items() if item[0] in existing), key=lambda item: (item[1], -item[0]))
+    return ranked[:limit]
@@ -0,0 +1,157 @@
+"""
+Content-addressed storage for uploaded media.
+
+Files are stored under their SHA-256 digest::
+
+    posts/media/ab/cd/abcd1234...ef.mov
+
+The digest is computed incrementally while the upload streams to disk, so an
+identical re-upload lands on the existing blob instead of creating
+``upload_XXXXXXX.mov``. Several rows can then share one file; MediaBlob keeps
+a reference count per stored name so a file is only deleted when its last
+reference goes away (see core.signals). Uploads too large to keep in memory
+are hashed as they are received by HashingFileUploadHandler, so they aren't
+read again here.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Where uploads and derived files are stored (PostMedia's upload_to for them)
+MEDIA_DIR = 'posts/media/'
+THUMBNAIL_DIR = 'posts/thumbnails/'
+STORYBOARD_DIR = 'posts/storyboards/'
+# Uploads replaced by their normalized version (core.media.normalize); never served
+ORIGINAL_DIR = 'posts/originals/'
+
+DIGEST_NAME_RE = re.compile(r'(?:^|/)[0-9a-f]{2}/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})(?:\.[^/]*)?$')
+
+
+class BlobMissing(FileNotFoundError):
+    """
+    A stored file was deleted, with its last reference, before a new row
+    could reference it. Store the content again and retry.
+    """
+
+
+def digest_from_name(name: str) -> str | None:
+    """Return the digest encoded in a content-addressed name, or None for legacy names."""
+    match = DIGEST_NAME_RE.search(name or '')
+    return match.group('digest') if match else None
+
+
+def content_addressed_name(directory: str, digest: str, ext: str) -> str:
+    directory = directory.strip('/')
+    name = f'{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}'
+    return f'{directory}/{name}' if directory else name
+
+
+def original_name(name: str) -> str | None:
+    """Where the cold copy of the upload stored as ``name`` goes once it is normalized."""
+    digest = digest_from_name(name)
+    return content_addressed_name(ORIGINAL_DIR, digest, os.path.splitext(name)[1]) if digest else None
+
+
+def hash_file(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    TemporaryFileUploadHandler that hashes each chunk as it is written, and
+    sets the upload's ``sha256`` to the hex digest.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        upload = super().file_complete(file_size)
+        upload.sha256 = self.sha.hexdigest()
+        return upload
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that names files by the SHA-256 of their content."""
+
+    def get_available_name(self, name, max_length=None):
+        # The final name comes from the content in _save; never add suffixes
+        return name
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        ext = os.path.splitext(filename)[1]
+        target_dir = self.path(directory)
+        os.makedirs(target_dir, exist_ok=True)
+
+        if hasattr(content, 'temporary_file_path'):
+            # Large uploads are already on disk, usually hashed on the way
+            tmp_path = content.temporary_file_path()
+            digest = getattr(content, 'sha256', None) or hash_file(tmp_path)
+            final_name = content_addressed_name(directory, digest, ext)
+            final_path = self.path(final_name)
+            if not os.path.exists(final_path):
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                file_move_safe(tmp_path, final_path)
+                self._set_permissions(final_path)
+            return final_name
+
+        # Stream to a temp file next to the target while hashing every chunk
+        sha = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=target_dir, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    sha.update(chunk)
+                    out.write(chunk)
+            digest = sha.hexdigest()
+            final_name = content_addressed_name(directory, digest, ext)
+            final_path = self.path(final_name)
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            if os.path.exists(final_path):
+                # Already stored: the upload becomes another reference to it. If
+                # the file loses its last reference before then, the new row's
+                # add_blob_reference raises BlobMissing
+                os.unlink(tmp_path)
+            else:
+                # Atomic; two identical uploads racing here write the same bytes
+                os.replace(tmp_path, final_path)
+                self._set_permissions(final_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return final_name
+
+    def _set_permissions(self, path):
+        # mkstemp creates 0600 files; give blobs the usual readable mode
+        os.chmod(path, self.file_permissions_mode if self.file_permissions_mode is not None else 0o644)
+
+
+_storage = None
+
+
+def media_storage() -> ContentAddressedStorage:
+    """Callable storage for FileField(storage=...), so migrations don't serialise an instance."""
+    global _storage
+    if _storage is None:
+        _storage = ContentAddressedStorage()
+    return _storage
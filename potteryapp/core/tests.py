@@ -1,3 +1,2084 @@
-from django.test import TestCase
+import asyncio
+import atexit
+import gc
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import struct
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import cv2
+import numpy as np
+import yaml
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import update_last_login
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from jsonschema import Draft202012Validator
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import feed_cache, feed_render, jobs, metrics, similarity, sync, uploads, writes
+from .faststart import Box, is_faststart, make_faststart, read_top_level_boxes, shift_chunk_offsets
+from .media_server import BLOCK_SIZE, RangeNotSatisfiable, aserve_media, parse_range_header
+from .middleware import MetricsMiddleware, QueryRecorder
+from .models import MediaBlob, MediaJob, MediaRendition, Post, PostMedia, PostTombstone, SaleItem, UploadSession
+from .media import placeholders
+from .media.metadata import image_metadata
+from .media.normalize import normalize, strip_jpeg_metadata
+from .media.phash import HashIndex, dhash, image_dhash, to_signed, to_unsigned
+from .serializers import PostSerializer, ShelfItemSerializer
+from .storage import MEDIA_DIR, content_addressed_name, digest_from_name, hash_file, media_storage
+from .media.storyboards import build_storyboard, tile_grid
+from .media.thumbnails import score_frames, select_poster_frame
+from .views import ShelfViewSet, post_detail_async, post_list_async
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, MEDIA_ROOT, True)
+
+
+def fade_in_frame(i: int, frames: int, size: tuple[int, int]) -> np.ndarray:
+    return np.full((size[1], size[0], 3), int(255 * i / max(frames - 1, 1)), dtype=np.uint8)
+
+
+def make_video_bytes(frames: int = 12, size: tuple[int, int] = (64, 48), fps: float = 12.0,
+                     frame_fn=fade_in_frame) -> bytes:
+    """Encode a tiny MJPEG .avi; by default its frames get brighter over time."""
+    path = os.path.join(tempfile.mkdtemp(), 'clip.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    for i in range(frames):
+        writer.write(frame_fn(i, frames, size))
+    writer.release()
+    with open(path, 'rb') as f:
+        data = f.read()
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    return data
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, METRICS_EXPORT_DIR=None)
+class MediaTestCase(TestCase):
+    """Base class that keeps uploaded files and worker metrics out of the real directories."""
+
+    def setUp(self):
+        feed_cache.get_cache().clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='potter', password='pw')
+
+    def make_post(self, caption: str = '', media_count: int = 1, for_sale: bool = False) -> Post:
+        post = Post.objects.create(creator=self.user, caption=caption)
+        for order in range(media_count):
+            PostMedia.objects.create(
+                post=post,
+                media_type=PostMedia.MEDIA_TYPE_IMAGE,
+                file=SimpleUploadedFile(f'p{post.id}_{order}.jpg', b'jpeg', content_type='image/jpeg'),
+                order=order,
+            )
+        if for_sale:
+            SaleItem.objects.create(post=post, price='25.00')
+        return post
+
+
+class FeedPaginationTests(MediaTestCase):
+    def test_unpaginated_list_is_a_plain_array(self):
+        self.make_post('a')
+        response = self.client.get('/api/posts/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.json(), list)
+
+    def test_keyset_pages_cover_every_post_once(self):
+        posts = [self.make_post(str(i)) for i in range(7)]
+        seen = []
+        url = '/api/posts/?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            seen.extend(item['id'] for item in body['results'])
+            url = body['next']
+        self.assertEqual(seen, [p.id for p in reversed(posts)])
+
+    def test_query_count_is_constant(self):
+        for i in range(3):
+            self.make_post(str(i), media_count=2, for_sale=i % 2 == 0)
+        # One query for posts (+creator, +saleitem joins), one for media
+        # (measured with a cold fragment cache; see FeedFragmentCacheTests)
+        with self.assertNumQueries(2):
+            small = self.client.get('/api/posts/?page_size=50')
+        for i in range(30):
+            self.make_post(str(i), media_count=2, for_sale=i % 2 == 0)
+        feed_cache.get_cache().clear()
+        with self.assertNumQueries(2):
+            large = self.client.get('/api/posts/?page_size=50')
+        feed_cache.get_cache().clear()
+        with self.assertNumQueries(2):
+            self.client.get('/api/posts/')
+        self.assertEqual(len(small.json()['results']), 3)
+        self.assertEqual(len(large.json()['results']), 33)
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get('/api/posts/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+
+class InlineExecutor:
+    """ThreadPoolExecutor stand-in that runs tasks in the calling thread, inside the test's transaction."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, fn, *args, **kwargs):
+        fn(*args, **kwargs)
+
+
+class MediaJobQueueTests(MediaTestCase):
+    def upload_video(self, data: bytes | None = None):
+        video = SimpleUploadedFile('clip.avi', data if data is not None else make_video_bytes(), content_type='video/x-msvideo')
+        return self.client.post('/api/posts/', {'caption': 'wheel', 'video': video}, format='multipart')
+
+    def test_create_returns_immediately_with_processing_media(self):
+        response = self.upload_video()
+        self.assertEqual(response.status_code, 201)
+        media = response.json()['media'][0]
+        self.assertEqual(media['status'], PostMedia.STATUS_PROCESSING)
+        self.assertIsNone(media['thumbnail_url'])
+        self.assertEqual(MediaJob.objects.filter(status=MediaJob.STATUS_QUEUED).count(), 1)
+
+    def test_worker_generates_thumbnail(self):
+        self.upload_video()
+        self.assertEqual(jobs.run_pending(), 1)
+        media = PostMedia.objects.get()
+        self.assertEqual(media.status, PostMedia.STATUS_READY)
+        self.assertTrue(media.thumbnail.name.endswith('.jpg'))
+        self.assertEqual(MediaJob.objects.get().status, MediaJob.STATUS_DONE)
+        # Saving the thumbnail must not enqueue another job
+        self.assertEqual(MediaJob.objects.count(), 1)
+
+    def test_failures_are_recorded_and_retried(self):
+        self.upload_video(b'not a video')
+        jobs.run_pending()
+        job = MediaJob.objects.get()
+        self.assertEqual(job.status, MediaJob.STATUS_QUEUED)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('could not open', job.last_error)
+        MediaJob.objects.update(run_after=job.created_at, max_attempts=1)
+        jobs.run_pending()
+        self.assertEqual(MediaJob.objects.get().status, MediaJob.STATUS_FAILED)
+        self.assertEqual(PostMedia.objects.get().status, PostMedia.STATUS_FAILED)
+
+    def test_claim_is_exclusive(self):
+        self.upload_video()
+        self.assertEqual(len(jobs.claim_jobs('a', 5)), 1)
+        self.assertEqual(jobs.claim_jobs('b', 5), [])
+
+    def test_jobs_that_kill_their_worker_run_out_of_attempts(self):
+        self.upload_video()
+        job = MediaJob.objects.get()
+        for attempt in range(1, job.max_attempts + 1):
+            # Claimed, then the process dies before run_job records anything
+            self.assertEqual(len(jobs.claim_jobs('doomed', 5)), 1)
+            MediaJob.objects.update(locked_at=timezone.now() - jobs.STALE_LOCK_TIMEOUT * 2)
+            self.assertEqual(jobs.requeue_stale_jobs(), 1)
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, attempt)
+        self.assertEqual(job.status, MediaJob.STATUS_FAILED)
+        self.assertEqual(PostMedia.objects.get().status, PostMedia.STATUS_FAILED)
+        self.assertEqual(jobs.claim_jobs('doomed', 5), [])
+
+    def test_worker_keeps_requeueing_stale_jobs(self):
+        self.upload_video()
+        with mock.patch.object(jobs, 'STALE_CHECK_INTERVAL', 0), \
+                mock.patch.object(jobs, 'requeue_stale_jobs', wraps=jobs.requeue_stale_jobs) as requeue, \
+                mock.patch.object(jobs, 'ThreadPoolExecutor', InlineExecutor):
+            jobs.Worker(concurrency=1, poll_interval=0).run(once=True)
+        self.assertGreaterEqual(requeue.call_count, 2)
+        self.assertEqual(MediaJob.objects.get().status, MediaJob.STATUS_DONE)
+
+    def test_eager_jobs_are_claimed_before_running(self):
+        with self.settings(MEDIA_JOBS_EAGER=True), self.captureOnCommitCallbacks() as callbacks:
+            self.upload_video()
+        # A worker polling meanwhile claims the job first: the eager run must leave it alone
+        self.assertEqual(len(jobs.claim_jobs('worker', 5)), 1)
+        with mock.patch.object(jobs, 'run_job') as run_job:
+            for callback in callbacks:
+                callback()
+        run_job.assert_not_called()
+
+        MediaJob.objects.update(status=MediaJob.STATUS_QUEUED, locked_by='')
+        for callback in callbacks:
+            callback()
+        job = MediaJob.objects.get()
+        self.assertEqual(job.status, MediaJob.STATUS_DONE)
+        self.assertTrue(job.locked_by.startswith('eager:'))
+
+
+def checkerboard(size: tuple[int, int], cell: int = 4) -> np.ndarray:
+    ys, xs = np.indices((size[1], size[0]))
+    board = (((xs // cell) + (ys // cell)) % 2 * 200 + 30).astype(np.uint8)
+    return cv2.cvtColor(board, cv2.COLOR_GRAY2BGR)
+
+
+class PosterFrameTests(TestCase):
+    def test_black_frames_are_never_chosen(self):
+        grays = np.stack([np.zeros((30, 40), np.uint8), np.full((30, 40), 128, np.uint8)])
+        scores = score_frames(grays)
+        self.assertEqual(scores[0], -1.0)
+        self.assertGreater(scores[1], scores[0])
+
+    def test_sharp_frame_beats_blurred_one(self):
+        sharp = cv2.cvtColor(checkerboard((40, 30)), cv2.COLOR_BGR2GRAY)
+        blurred = cv2.GaussianBlur(sharp, (9, 9), 5)
+        scores = score_frames(np.stack([blurred, sharp]))
+        self.assertGreater(scores[1], scores[0])
+
+    def test_skips_black_opening_of_a_clip(self):
+        def covered_lens_then_pot(i, frames, size):
+            return np.zeros((size[1], size[0], 3), np.uint8) if i < frames // 2 else checkerboard(size)
+
+        path = os.path.join(MEDIA_ROOT, 'covered.avi')
+        with open(path, 'wb') as f:
+            f.write(make_video_bytes(frames=24, frame_fn=covered_lens_then_pot))
+        cap = cv2.VideoCapture(path)
+        try:
+            poster = select_poster_frame(cap, candidates=6)
+        finally:
+            cap.release()
+        self.assertGreaterEqual(poster.index, 12)
+        self.assertGreater(poster.frame.mean(), 50)
+
+
+class RangeHeaderParsingTests(TestCase):
+    def test_forms(self):
+        self.assertEqual(parse_range_header('bytes=0-9', 100), [(0, 9)])
+        self.assertEqual(parse_range_header('bytes=90-', 100), [(90, 99)])
+        self.assertEqual(parse_range_header('bytes=-10', 100), [(90, 99)])
+        # Suffix longer than the file and end past EOF are clamped
+        self.assertEqual(parse_range_header('bytes=-500', 100), [(0, 99)])
+        self.assertEqual(parse_range_header('bytes=50-500', 100), [(50, 99)])
+
+    def test_overlapping_ranges_are_coalesced(self):
+        self.assertEqual(parse_range_header('bytes=20-29, 0-9,5-14', 100), [(0, 14), (20, 29)])
+        self.assertEqual(parse_range_header('bytes=0-9,10-19', 100), [(0, 19)])
+
+    def test_malformed_headers_are_ignored(self):
+        for header in ('items=0-1', 'bytes=', 'bytes=abc', 'bytes=5-1', 'bytes=--1', 'bytes=1'):
+            self.assertIsNone(parse_range_header(header, 100), header)
+
+    def test_unsatisfiable(self):
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header('bytes=100-', 100)
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header('bytes=-0', 100)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class MediaServerTests(TestCase):
+    data = bytes(range(256)) * 40  # 10240 bytes
+
+    @classmethod
+    def setUpTestData(cls):
+        os.makedirs(os.path.join(MEDIA_ROOT, 'posts', 'media'), exist_ok=True)
+        with open(os.path.join(MEDIA_ROOT, 'posts', 'media', 'clip.mov'), 'wb') as f:
+            f.write(cls.data)
+
+    def get(self, **headers):
+        response = self.client.get('/media/posts/media/clip.mov', headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_full_file(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+        self.assertEqual(response['Content-Type'], 'video/quicktime')
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertTrue(response['ETag'].startswith('"'))
+
+    def test_single_range_has_real_content_type_and_exact_length(self):
+        response, body = self.get(Range='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[100:200])
+        self.assertEqual(response['Content-Type'], 'video/quicktime')
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.data)}')
+        self.assertEqual(response['Content-Length'], '100')
+
+    def test_suffix_range(self):
+        response, body = self.get(Range='bytes=-16')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[-16:])
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.get(Range=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+    def test_multiple_ranges(self):
+        response, body = self.get(Range='bytes=0-9,1000-1009')
+        self.assertEqual(response.status_code, 206)
+        content_type = response['Content-Type']
+        self.assertTrue(content_type.startswith('multipart/byteranges; boundary='))
+        boundary = content_type.split('boundary=')[1].encode()
+        self.assertEqual(len(body), int(response['Content-Length']))
+        parts = body.split(b'--' + boundary)[1:-1]
+        self.assertEqual(len(parts), 2)
+        headers, payload = parts[1].split(b'\r\n\r\n', 1)
+        self.assertIn(b'Content-Range: bytes 1000-1009/10240', headers)
+        self.assertIn(b'Content-Type: video/quicktime', headers)
+        self.assertEqual(payload[:-2], self.data[1000:1010])
+
+    def test_if_none_match_returns_304(self):
+        etag = self.get()[0]['ETag']
+        response, body = self.get(If_None_Match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(body, b'')
+
+    def test_if_range(self):
+        etag = self.get()[0]['ETag']
+        response, _ = self.get(Range='bytes=0-9', If_Range=etag)
+        self.assertEqual(response.status_code, 206)
+        # Stale validator: the client must get the whole new file
+        response, body = self.get(Range='bytes=0-9', If_Range='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+
+    def test_missing_file_and_traversal_are_404(self):
+        self.assertEqual(self.client.get('/media/posts/media/nope.mov').status_code, 404)
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/posts/media/').status_code, 404)
+
+
+def mp4_box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', len(payload) + 8, box_type) + payload
+
+
+def stco_box(offsets: list[int]) -> bytes:
+    return mp4_box(b'stco', b'\0\0\0\0' + struct.pack(f'>I{len(offsets)}I', len(offsets), *offsets))
+
+
+class FaststartTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+
+    def write(self, name: str, data: bytes) -> str:
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def remux(self, path: str) -> bool | None:
+        """make_faststart into a copy, which replaces ``path`` if written."""
+        copy = path + '.faststart'
+        with open(copy, 'wb') as dst:
+            written = make_faststart(path, dst)
+        if written:
+            os.replace(copy, path)
+        return written
+
+    def chunks_at(self, path: str) -> list[bytes]:
+        """Follow every stco offset and read the 4-byte chunk it points to."""
+        with open(path, 'rb') as f:
+            data = f.read()
+        start = data.index(b'stco') + 8
+        count = struct.unpack_from('>I', data, start)[0]
+        offsets = struct.unpack_from(f'>{count}I', data, start + 4)
+        return [data[offset:offset + 4] for offset in offsets]
+
+    def test_moov_is_moved_before_mdat_and_offsets_fixed(self):
+        ftyp = mp4_box(b'ftyp', b'isom\0\0\0\0')
+        mdat_payload = b'AAAABBBBCCCC'
+        mdat_start = len(ftyp) + 8
+        moov = mp4_box(b'moov', mp4_box(b'trak', mp4_box(b'mdia', mp4_box(b'minf', mp4_box(
+            b'stbl', stco_box([mdat_start, mdat_start + 4, mdat_start + 8]))))))
+        path = self.write('tail.mov', ftyp + mp4_box(b'mdat', mdat_payload) + moov)
+        self.assertEqual(self.chunks_at(path), [b'AAAA', b'BBBB', b'CCCC'])
+        self.assertFalse(is_faststart(path))
+
+        self.assertTrue(self.remux(path))
+
+        with open(path, 'rb') as f:
+            boxes = read_top_level_boxes(f, os.path.getsize(path))
+        self.assertEqual([box.type for box in boxes], [b'ftyp', b'moov', b'mdat'])
+        self.assertEqual(self.chunks_at(path), [b'AAAA', b'BBBB', b'CCCC'])
+        self.assertEqual(os.path.getsize(path), len(ftyp) + len(moov) + len(mdat_payload) + 8)
+        self.assertFalse(self.remux(path))
+
+    def test_data_after_moov_keeps_its_chunks(self):
+        ftyp = mp4_box(b'ftyp', b'isom\0\0\0\0')
+        first = mp4_box(b'mdat', b'AAAABBBB')
+        stco_size = len(stco_box([0, 0, 0, 0]))
+        moov_size = 8 * 5 + stco_size
+        second_start = len(ftyp) + len(first) + moov_size + 8
+        moov = mp4_box(b'moov', mp4_box(b'trak', mp4_box(b'mdia', mp4_box(b'minf', mp4_box(
+            b'stbl', stco_box([len(ftyp) + 8, len(ftyp) + 12, second_start, second_start + 4]))))))
+        self.assertEqual(len(moov), moov_size)
+        path = self.write('split.mov', ftyp + first + moov + mp4_box(b'mdat', b'CCCCDDDD') + mp4_box(b'free', b''))
+        self.assertEqual(self.chunks_at(path), [b'AAAA', b'BBBB', b'CCCC', b'DDDD'])
+
+        self.assertTrue(self.remux(path))
+
+        with open(path, 'rb') as f:
+            boxes = read_top_level_boxes(f, os.path.getsize(path))
+        self.assertEqual([box.type for box in boxes], [b'ftyp', b'moov', b'mdat', b'mdat', b'free'])
+        self.assertEqual(self.chunks_at(path), [b'AAAA', b'BBBB', b'CCCC', b'DDDD'])
+
+    def test_stco_overflow_is_upgraded_to_co64(self):
+        stbl = Box(b'stbl', children=[Box(b'stco', payload=b'\0\0\0\0' + struct.pack('>II', 1, 0xFFFFFFF0))])
+        shift_chunk_offsets(stbl, lambda offset: offset + 0x100)
+        self.assertEqual(stbl.children[0].type, b'co64')
+        self.assertEqual(struct.unpack_from('>Q', stbl.children[0].payload, 8)[0], 0xFFFFFFF0 + 0x100)
+
+    def test_non_mp4_is_left_alone(self):
+        path = self.write('clip.avi', make_video_bytes())
+        with open(path, 'rb') as f:
+            before = f.read()
+        self.assertIsNone(self.remux(path))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), before)
+
+    def test_real_mp4_still_decodes_identically(self):
+        path = os.path.join(self.dir, 'clip.mp4')
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 10, (64, 48))
+        for i in range(10):
+            writer.write(fade_in_frame(i, 10, (64, 48)))
+        writer.release()
+
+        def decode() -> list[float]:
+            cap = cv2.VideoCapture(path)
+            means = []
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                means.append(float(frame.mean()))
+            cap.release()
+            return means
+
+        before = decode()
+        self.remux(path)
+        self.assertTrue(is_faststart(path))
+        self.assertEqual(decode(), before)
+
+
+class ContentAddressedStorageTests(MediaTestCase):
+    def upload(self, data: bytes, name: str = 'pot.jpg'):
+        return self.client.post('/api/posts/', {'image': SimpleUploadedFile(name, data, content_type='image/jpeg')},
+                                format='multipart')
+
+    def test_identical_uploads_share_one_blob(self):
+        self.upload(b'same bytes', 'a.jpg')
+        self.upload(b'same bytes', 'b.jpg')
+        first, second = PostMedia.objects.order_by('pk')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertIsNotNone(digest_from_name(first.file.name))
+        self.assertEqual(MediaBlob.objects.get(name=first.file.name).refcount, 2)
+
+    def test_duplicate_video_reuses_thumbnail_without_a_job(self):
+        data = make_video_bytes()
+        video = lambda: SimpleUploadedFile('clip.avi', data, content_type='video/x-msvideo')
+        self.client.post('/api/posts/', {'video': video()}, format='multipart')
+        jobs.run_pending()
+        response = self.client.post('/api/posts/', {'video': video()}, format='multipart')
+        media = response.json()['media'][0]
+        self.assertEqual(media['status'], PostMedia.STATUS_READY)
+        self.assertIsNotNone(media['thumbnail_url'])
+        self.assertEqual(MediaJob.objects.count(), 1)
+
+    def test_faststart_remux_is_stored_as_a_new_blob(self):
+        ftyp = mp4_box(b'ftyp', b'isom\0\0\0\0')
+        moov = mp4_box(b'moov', mp4_box(b'trak', mp4_box(b'mdia', mp4_box(b'minf', mp4_box(
+            b'stbl', stco_box([len(ftyp) + 8]))))))
+        upload = SimpleUploadedFile('tail.mov', ftyp + mp4_box(b'mdat', b'AAAA') + moov, content_type='video/quicktime')
+        self.client.post('/api/posts/', {'video': upload}, format='multipart')
+        media = PostMedia.objects.get()
+        uploaded = media.file.name
+        self.assertFalse(media.is_faststart)
+        with self.captureOnCommitCallbacks(execute=True):
+            media.ensure_faststart()
+        media.refresh_from_db()
+        self.assertTrue(media.is_faststart)
+        self.assertNotEqual(media.file.name, uploaded)
+        self.assertEqual(digest_from_name(media.file.name), hash_file(media.file.path))
+        self.assertEqual(MediaBlob.objects.get(name=media.file.name).refcount, 1)
+        self.assertFalse(MediaBlob.objects.filter(name=uploaded).exists())
+        self.assertFalse(media_storage().exists(uploaded))
+
+    def test_file_is_deleted_with_its_last_reference(self):
+        self.upload(b'shared')
+        self.upload(b'shared')
+        name = PostMedia.objects.first().file.name
+        storage = media_storage()
+        with self.captureOnCommitCallbacks(execute=True):
+            PostMedia.objects.first().delete()
+        self.assertTrue(storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            PostMedia.objects.get().delete()
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_reupload_racing_the_last_delete_stores_the_file_again(self):
+        self.upload(b'racing')
+        name = PostMedia.objects.get().file.name
+        store_uploads = uploads.store_uploads
+
+        def store_then_delete(files):
+            # Storage finds the file and keeps no copy; then its last post goes
+            stored = store_uploads(files)
+            if Post.objects.exists():
+                with self.captureOnCommitCallbacks(execute=True):
+                    Post.objects.get().delete()
+            return stored
+
+        with mock.patch.object(uploads, 'store_uploads', side_effect=store_then_delete) as store:
+            response = self.upload(b'racing')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(store.call_count, 2)
+        self.assertEqual(PostMedia.objects.get().file.name, name)
+        self.assertTrue(media_storage().exists(name))
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 1)
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=100)
+    def test_large_uploads_are_hashed_while_received(self):
+        data = os.urandom(10_000)
+        with mock.patch('core.storage.hash_file', side_effect=AssertionError('read again')):
+            response = self.upload(data)
+        self.assertEqual(response.status_code, 201)
+        media = PostMedia.objects.get()
+        self.assertEqual(digest_from_name(media.file.name), hashlib.sha256(data).hexdigest())
+
+    def test_dedupe_media_backfill(self):
+        storage = media_storage()
+        post = Post.objects.create(creator=self.user)
+        os.makedirs(storage.path('posts/media'), exist_ok=True)
+        for name in ('posts/media/legacy.png', 'posts/media/legacy_mX6KUn4.png'):
+            with open(storage.path(name), 'wb') as f:
+                f.write(b'screenshot')
+            PostMedia.objects.bulk_create([PostMedia(post=post, file=name)])
+        cached = self.client.get('/api/posts/').json()[0]['media']
+        self.assertIn('legacy_mX6KUn4.png', cached[1]['file_url'])
+        updated_at = Post.objects.get().updated_at
+        call_command('dedupe_media', stdout=StringIO())
+        names = set(PostMedia.objects.values_list('file', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertIsNotNone(digest_from_name(name))
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 2)
+        self.assertFalse(os.path.exists(storage.path('posts/media/legacy_mX6KUn4.png')))
+        # The renames reach cached fragments and delta-sync clients
+        self.assertGreater(Post.objects.get().updated_at, updated_at)
+        for media in self.client.get('/api/posts/').json()[0]['media']:
+            self.assertTrue(media['file_url'].endswith(name))
+
+
+class MultiMediaPostTests(MediaTestCase):
+    def create(self, *files, **data):
+        return self.client.post('/api/posts/', {'caption': 'set', 'media': list(files), **data}, format='multipart')
+
+    def test_mixed_media_keep_their_order(self):
+        response = self.create(
+            SimpleUploadedFile('a.jpg', b'first', content_type='image/jpeg'),
+            SimpleUploadedFile('clip.avi', make_video_bytes(), content_type='video/x-msvideo'),
+            SimpleUploadedFile('c.png', b'third'),
+        )
+        self.assertEqual(response.status_code, 201)
+        media = response.json()['media']
+        self.assertEqual([m['order'] for m in media], [0, 1, 2])
+        self.assertEqual([m['media_type'] for m in media], ['image', 'video', 'image'])
+        self.assertEqual(MediaJob.objects.count(), 3)
+        self.assertEqual(MediaBlob.objects.count(), 3)
+        jobs.run_pending()
+        video = PostMedia.objects.get(media_type=PostMedia.MEDIA_TYPE_VIDEO)
+        self.assertEqual(video.status, PostMedia.STATUS_READY)
+        self.assertTrue(video.thumbnail)
+
+    def test_media_are_inserted_in_one_statement(self):
+        files = [SimpleUploadedFile(f'{i}.jpg', f'image {i}'.encode()) for i in range(6)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.create(*files)
+        self.assertEqual(response.status_code, 201)
+        inserts = [q['sql'] for q in queries if q['sql'].startswith('INSERT INTO "core_postmedia"')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_already_processed_files_are_reused(self):
+        data = make_video_bytes()
+        self.create(SimpleUploadedFile('clip.avi', data))
+        jobs.run_pending()
+        response = self.create(SimpleUploadedFile('again.avi', data), SimpleUploadedFile('new.jpg', b'new'))
+        media = response.json()['media']
+        self.assertEqual([m['status'] for m in media], [PostMedia.STATUS_READY, PostMedia.STATUS_PROCESSING])
+        self.assertIsNotNone(media[0]['thumbnail_url'])
+        self.assertEqual(MediaJob.objects.count(), 2)
+        self.assertEqual(MediaBlob.objects.get(name=PostMedia.objects.get(pk=media[0]['id']).thumbnail.name).refcount, 2)
+
+    def stored_name(self, data: bytes) -> str:
+        return content_addressed_name(MEDIA_DIR, hashlib.sha256(data).hexdigest(), '.jpg')
+
+    def test_failed_create_deletes_the_files_it_stored(self):
+        self.create(SimpleUploadedFile('kept.jpg', b'already posted'))
+        kept = PostMedia.objects.get().file.name
+        storage = media_storage()
+        self.client.raise_request_exception = False
+        with mock.patch.object(uploads, 'create_post', side_effect=IntegrityError('boom')), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.create(SimpleUploadedFile('new.jpg', b'never posted'),
+                                   SimpleUploadedFile('again.jpg', b'already posted'))
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(set(MediaBlob.objects.values_list('name', flat=True)), {kept})
+        self.assertTrue(storage.exists(kept))
+        self.assertFalse(storage.exists(self.stored_name(b'never posted')))
+
+    def test_files_stored_before_a_failed_store_are_deleted(self):
+        real_store = uploads.store_upload
+
+        def store(media_type, upload):
+            if upload.name == 'bad.jpg':
+                raise OSError('disk full')
+            return real_store(media_type, upload)
+
+        with mock.patch.object(uploads, 'store_upload', side_effect=store), self.assertRaises(OSError), \
+                self.captureOnCommitCallbacks(execute=True):
+            uploads.store_uploads([(PostMedia.MEDIA_TYPE_IMAGE, SimpleUploadedFile('ok.jpg', b'stored first')),
+                                   (PostMedia.MEDIA_TYPE_IMAGE, SimpleUploadedFile('bad.jpg', b'bad'))])
+        self.assertFalse(media_storage().exists(self.stored_name(b'stored first')))
+
+    def test_invalid_requests_store_nothing(self):
+        self.assertEqual(self.client.post('/api/posts/', {'caption': 'x'}, format='multipart').status_code, 400)
+        too_many = [SimpleUploadedFile(f'{i}.jpg', b'x') for i in range(3)]
+        with self.settings(POST_MAX_MEDIA=2):
+            self.assertEqual(self.create(*too_many).status_code, 400)
+        self.assertEqual(self.create(SimpleUploadedFile('ok.jpg', b'ok'), SimpleUploadedFile('empty.jpg', b'')).status_code, 400)
+        self.assertFalse(Post.objects.exists())
+        self.assertFalse(MediaBlob.objects.exists())
+
+
+class ResumableUploadTests(MediaTestCase):
+    data = os.urandom(300_000)
+
+    def start(self, **extra):
+        payload = {'filename': 'IMG_0001.MOV', 'total_size': len(self.data), 'caption': 'big bowl', **extra}
+        response = self.client.post('/api/uploads/', payload, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def put(self, session_id: str, start: int, end: int, body: bytes | None = None):
+        body = self.data[start:end + 1] if body is None else body
+        return self.client.put(
+            f'/api/uploads/{session_id}/chunk/', data=body, content_type='application/octet-stream',
+            headers={'Content-Range': f'bytes {start}-{end}/{len(self.data)}'},
+        )
+
+    def test_out_of_order_chunks_then_finalize(self):
+        session = self.start()
+        self.assertEqual(session['media_type'], PostMedia.MEDIA_TYPE_VIDEO)
+        self.assertEqual(session['next_offset'], 0)
+        for start, end in [(200_000, 299_999), (0, 99_999), (100_000, 199_999)]:
+            self.assertEqual(self.put(session['id'], start, end).status_code, 200)
+
+        response = self.client.post(f'/api/uploads/{session["id"]}/finalize/')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['caption'], 'big bowl')
+        media = PostMedia.objects.get()
+        self.assertIsNotNone(digest_from_name(media.file.name))
+        with media.file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(os.path.exists(UploadSession.objects.get().partial_path))
+        self.assertEqual(MediaJob.objects.count(), 1)
+
+    def test_interrupted_chunk_resumes_from_last_byte_received(self):
+        session = self.start()
+        # Client claims 0-149999 but the connection drops after 60000 bytes
+        response = self.put(session['id'], 0, 149_999, body=self.data[:60_000])
+        self.assertEqual(response.status_code, 400)
+        progress = self.client.get(f'/api/uploads/{session["id"]}/').json()
+        self.assertEqual(progress['received_bytes'], 60_000)
+        self.assertEqual(progress['missing_ranges'], [[60_000, len(self.data) - 1]])
+
+        resume = progress['next_offset']
+        self.assertEqual(self.put(session['id'], resume, len(self.data) - 1).status_code, 200)
+        self.assertEqual(self.client.post(f'/api/uploads/{session["id"]}/finalize/').status_code, 201)
+        with PostMedia.objects.get().file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_overlapping_finalizes_move_the_file_once(self):
+        session = self.start()
+        self.put(session['id'], 0, len(self.data) - 1)
+        first, second = UploadSession.objects.get(), UploadSession.objects.get()
+        self.assertIsNotNone(first.finalize())
+        # The second request read the session while it was still open
+        self.assertIsNone(second.finalize())
+        self.assertEqual(Post.objects.count(), 1)
+        self.assertEqual(UploadSession.objects.get().status, UploadSession.STATUS_FINALIZED)
+        self.assertEqual(self.client.post(f'/api/uploads/{session["id"]}/finalize/').status_code, 409)
+
+    def test_failed_finalize_reopens_the_session(self):
+        session = self.start()
+        self.put(session['id'], 0, len(self.data) - 1)
+        upload = UploadSession.objects.get()
+        with mock.patch.object(Post.objects, 'create', side_effect=DatabaseError('disk I/O error')):
+            with self.assertRaises(DatabaseError):
+                upload.finalize()
+        upload.refresh_from_db()
+        self.assertEqual(upload.status, UploadSession.STATUS_OPEN)
+        # The file is back where the chunks were written, not left unreferenced in storage
+        name = content_addressed_name(MEDIA_DIR, hashlib.sha256(self.data).hexdigest(), '.mov')
+        self.assertFalse(media_storage().exists(name))
+        with open(upload.partial_path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+        response = self.client.post(f'/api/uploads/{session["id"]}/finalize/')
+        self.assertEqual(response.status_code, 201, response.content)
+        with PostMedia.objects.get().file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_finalize_incomplete_upload_is_rejected(self):
+        session = self.start()
+        self.put(session['id'], 0, 999)
+        response = self.client.post(f'/api/uploads/{session["id"]}/finalize/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['missing_ranges'], [[1000, len(self.data) - 1]])
+
+    def test_bad_requests(self):
+        session = self.start()
+        self.assertEqual(self.put(session['id'], 0, len(self.data)).status_code, 400)
+        response = self.client.put(f'/api/uploads/{session["id"]}/chunk/', data=b'x',
+                                   content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/uploads/', {'filename': 'a.mov', 'total_size': 0}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class FeedFragmentCacheTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        feed_cache.stats.reset()
+
+    def test_warm_feed_is_one_query_and_identical(self):
+        for i in range(5):
+            self.make_post(str(i), for_sale=i == 0)
+        cold = self.client.get('/api/posts/').json()
+        with self.assertNumQueries(1):
+            warm = self.client.get('/api/posts/').json()
+        self.assertEqual(warm, cold)
+        self.assertEqual(feed_cache.stats.as_dict()['hits'], 5)
+        self.assertEqual(feed_cache.stats.as_dict()['misses'], 5)
+
+    def test_changes_invalidate_the_post(self):
+        post = self.make_post('before')
+        self.client.get('/api/posts/')
+        SaleItem.objects.create(post=post, price='40.00')
+        self.assertTrue(self.client.get('/api/posts/').json()[0]['is_for_sale'])
+        post.refresh_from_db()
+        post.caption = 'after'
+        post.save()
+        self.assertEqual(self.client.get('/api/posts/').json()[0]['caption'], 'after')
+        PostMedia.objects.get().delete()
+        self.assertEqual(self.client.get('/api/posts/').json()[0]['media'], [])
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(self.client.get('/api/posts/').json()[0]['creator_username'], 'renamed')
+
+    def test_partial_save_bumps_the_version(self):
+        post = self.make_post('before')
+        self.client.get('/api/posts/')
+        post.refresh_from_db()
+        version = post.version
+        post.caption = 'after'
+        post.save(update_fields=['caption'])
+        post.refresh_from_db()
+        self.assertEqual(post.version, version + 1)
+        self.assertEqual(self.client.get('/api/posts/').json()[0]['caption'], 'after')
+
+    def test_only_renames_invalidate_the_creators_posts(self):
+        post = self.make_post()
+        version = Post.objects.get(pk=post.pk).version
+        update_last_login(None, self.user)
+        self.user.first_name = 'Ada'
+        self.user.save()
+        self.assertEqual(Post.objects.get(pk=post.pk).version, version)
+        self.user.username = 'renamed'
+        self.user.save(update_fields=['username'])
+        self.assertEqual(Post.objects.get(pk=post.pk).version, version + 1)
+
+    def test_worker_updates_reach_the_feed(self):
+        self.client.post('/api/posts/', {'video': SimpleUploadedFile('clip.avi', make_video_bytes())}, format='multipart')
+        self.assertEqual(self.client.get('/api/posts/').json()[0]['media'][0]['status'], 'processing')
+        jobs.run_pending()
+        self.assertEqual(self.client.get('/api/posts/').json()[0]['media'][0]['status'], 'ready')
+
+    def test_stats_endpoint(self):
+        self.make_post()
+        self.client.get('/api/posts/')
+        stats = self.client.get('/api/posts/cache-stats/').json()
+        self.assertEqual(stats['misses'], 1)
+
+
+def openapi_to_json_schema(node):
+    """Translate OpenAPI 3.0 'nullable' into JSON Schema so jsonschema can validate."""
+    if isinstance(node, list):
+        return [openapi_to_json_schema(item) for item in node]
+    if not isinstance(node, dict):
+        return node
+    node = {key: openapi_to_json_schema(value) for key, value in node.items()}
+    if node.pop('nullable', False):
+        return {'anyOf': [node, {'type': 'null'}]}
+    return node
+
+
+class FastFeedRenderTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.request = APIRequestFactory().get('/api/posts/', HTTP_HOST='testserver:8000')
+        for i, price in enumerate(['12.5', '0.99', None]):
+            post = self.make_post(f'pot {i} – glazed ✨', media_count=i + 1)
+            if price:
+                SaleItem.objects.create(post=post, price=price, is_sold=i == 1)
+        post = Post.objects.create(creator=self.user, caption='')
+        PostMedia.objects.create(post=post, media_type=PostMedia.MEDIA_TYPE_VIDEO, order=0,
+                                 file=SimpleUploadedFile('my clip (1).mov', b'mov'))
+        PostMedia.objects.filter(post=post).update(thumbnail='posts/thumbnails/thumb clip.jpg',
+                                                    storyboard='posts/storyboards/my clip.vtt')
+        video = PostMedia.objects.get(post=post)
+        for fmt, width in [('jpeg', 640), ('webp', 640), ('jpeg', 320), ('webp', 320)]:
+            MediaRendition.objects.create(media=video, format=fmt, width=width, height=width // 2,
+                                          file=f'posts/renditions/{fmt} {width}.{fmt}')
+
+    def render_both(self):
+        posts = Post.objects.select_related('creator', 'saleitem').prefetch_related('media__renditions').order_by('-created_at', '-id')
+        slow = PostSerializer(posts, many=True, context={'request': self.request}).data
+        rows = list(feed_render.post_rows(Post.objects.order_by('-created_at', '-id')))
+        fast = feed_render.render_posts(rows, self.request)
+        return slow, fast
+
+    def test_output_is_byte_identical_to_post_serializer(self):
+        slow, fast = self.render_both()
+        self.assertEqual(JSONRenderer().render(fast), JSONRenderer().render(slow))
+
+    def test_output_matches_openapi_schema(self):
+        with open(os.path.join(settings.BASE_DIR, 'schema.yaml')) as f:
+            components = openapi_to_json_schema(yaml.safe_load(f)['components'])
+        validator = Draft202012Validator({'$ref': '#/components/schemas/Post', 'components': components})
+        _, fast = self.render_both()
+        for post in fast:
+            validator.validate(post)
+        # Every property the schema declares is present, and nothing else
+        declared = set(components['schemas']['Post']['properties'])
+        self.assertEqual(set(fast[0]), declared)
+        media_declared = set(components['schemas']['PostMedia']['properties'])
+        self.assertEqual(set(fast[0]['media'][0]), media_declared)
+
+    def test_retrieve_unknown_post_is_404(self):
+        self.assertEqual(self.client.get('/api/posts/999999/').status_code, 404)
+        self.assertEqual(self.client.get('/api/posts/abc/').status_code, 404)
+
+
+class ShelfTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user(username='other')
+        self.items = []
+        for i, price in enumerate(['30.00', '10.00', '20.00', '10.00', '55.50']):
+            post = self.make_post(f'pot {i}')
+            if i == 4:
+                post.creator = self.other
+                post.save()
+            self.items.append(SaleItem.objects.create(post=post, price=price))
+        self.sold = SaleItem.objects.create(post=self.make_post('sold'), price='5.00', is_sold=True)
+
+    def ids(self, url: str) -> list[int]:
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()['results']]
+
+    def test_lists_unsold_items_newest_first(self):
+        self.assertEqual(self.ids('/api/shelf/'), [item.id for item in reversed(self.items)])
+
+    def test_price_ordering_and_filters(self):
+        by_price = sorted(self.items, key=lambda item: (Decimal(item.price), item.id))
+        self.assertEqual(self.ids('/api/shelf/?ordering=price'), [item.id for item in by_price])
+        self.assertEqual(self.ids('/api/shelf/?ordering=-price'), [item.id for item in reversed(by_price)])
+        self.assertEqual(self.ids('/api/shelf/?ordering=price&min_price=15&max_price=30'),
+                         [self.items[2].id, self.items[0].id])
+        self.assertEqual(self.ids(f'/api/shelf/?creator={self.other.id}'), [self.items[4].id])
+
+    def test_keyset_pages_cover_every_item_once(self):
+        for ordering in ShelfViewSet.KEYSET_ORDERINGS:
+            seen = []
+            url = f'/api/shelf/?ordering={ordering}&page_size=2'
+            while url:
+                body = self.client.get(url).json()
+                seen.extend(item['id'] for item in body['results'])
+                url = body['next']
+            self.assertEqual(seen, self.ids(f'/api/shelf/?ordering={ordering}&page_size=100'))
+            self.assertEqual(len(seen), len(self.items))
+
+    def test_invalid_query_returns_400(self):
+        self.assertEqual(self.client.get('/api/shelf/?ordering=caption').status_code, 400)
+        self.assertEqual(self.client.get('/api/shelf/?min_price=abc').status_code, 400)
+        self.assertEqual(self.client.get('/api/shelf/?min_price=20&max_price=10').status_code, 400)
+
+    def test_matches_shelf_item_serializer(self):
+        request = APIRequestFactory().get('/api/shelf/', HTTP_HOST='testserver')
+        expected = ShelfItemSerializer(
+            SaleItem.objects.filter(is_sold=False).order_by('-post_created_at', '-id'),
+            many=True, context={'request': request},
+        ).data
+        response = self.client.get('/api/shelf/')
+        self.assertEqual(JSONRenderer().render(response.json()['results']), JSONRenderer().render(expected))
+
+    def test_list_on_shelf_records_post_created_at(self):
+        post = self.make_post('new listing')
+        response = self.client.post(f'/api/posts/{post.id}/list_on_shelf/', {'price': '12.00'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(SaleItem.objects.get(post=post).post_created_at, post.created_at)
+
+    def test_relisting_returns_the_new_price(self):
+        post = self.make_post('relisted')
+        self.client.post(f'/api/posts/{post.id}/list_on_shelf/', {'price': '10.00'}, format='json')
+        response = self.client.post(f'/api/posts/{post.id}/list_on_shelf/', {'price': '99.00'}, format='json')
+        self.assertEqual(response.json()['sale_item']['price'], '99.00')
+        self.assertEqual(SaleItem.objects.get(post=post).price, Decimal('99.00'))
+
+    def query_plans(self, url: str) -> list[str]:
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        shelf_sql = [q['sql'] for q in queries if q['sql'].startswith('SELECT') and 'FROM "core_saleitem"' in q['sql']]
+        self.assertEqual(len(shelf_sql), 1)
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + shelf_sql[0])
+            return [row[-1] for row in cursor.fetchall()]
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite-specific')
+    def test_shelf_queries_use_saleitem_indexes(self):
+        cases = {
+            '/api/shelf/': 'core_saleitem_recent_idx',
+            '/api/shelf/?ordering=created_at&page_size=2': 'core_saleitem_recent_idx',
+            '/api/shelf/?ordering=price': 'core_saleitem_price_idx',
+            '/api/shelf/?ordering=-price&min_price=10&max_price=40': 'core_saleitem_price_idx',
+        }
+        for url, index in cases.items():
+            plan = self.query_plans(url)
+            self.assertTrue(any(index in line for line in plan), (url, plan))
+            # No full table scans, and the ORDER BY comes straight from the index
+            self.assertFalse([line for line in plan if line.startswith('SCAN') and 'USING' not in line], (url, plan))
+            self.assertFalse([line for line in plan if 'TEMP B-TREE' in line], (url, plan))
+
+        # Creator filter: reached through indexes on Post and the one-to-one
+        plan = self.query_plans(f'/api/shelf/?creator={self.other.id}')
+        self.assertFalse([line for line in plan if line.startswith('SCAN') and 'USING' not in line], plan)
+        # A cursor page is a range seek, not a re-scan from the start
+        cursor = self.client.get('/api/shelf/?ordering=price&page_size=2').json()['next']
+        plan = self.query_plans(cursor)
+        self.assertTrue(any('core_saleitem_price_idx' in line for line in plan), plan)
+
+
+class CaptionSearchTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.glaze = self.make_post('Celadon glaze on a stoneware bowl')
+        self.mug = self.make_post('Tall mug, speckled clay')
+        self.bowl = self.make_post('Bowl bowl bowl, trimmed today')
+
+    def search(self, q: str, **params) -> list[dict]:
+        response = self.client.get('/api/posts/search/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_ranked_prefix_search_with_highlights(self):
+        results = self.search('bow')
+        self.assertEqual([r['post']['id'] for r in results], [self.bowl.id, self.glaze.id])
+        self.assertGreater(results[0]['score'], results[1]['score'])
+        self.assertEqual(results[1]['caption_highlight'], 'Celadon glaze on a stoneware <mark>bowl</mark>')
+        self.assertEqual(results[1]['post']['caption'], self.glaze.caption)
+        # Every word must match
+        self.assertEqual([r['post']['id'] for r in self.search('glaze bowl')], [self.glaze.id])
+
+    def test_matches_creator_username(self):
+        results = self.search(self.user.username[:3])
+        self.assertEqual(len(results), 3)
+        self.assertIn('<mark>', results[0]['creator_username_highlight'])
+
+    def test_highlights_escape_user_html(self):
+        self.make_post('<img src=x onerror=alert(1)> raku & <b>bowl</b>')
+        results = self.search('raku')
+        self.assertEqual(results[0]['caption_highlight'],
+                         '&lt;img src=x onerror=alert(1)&gt; <mark>raku</mark> &amp; &lt;b&gt;bowl&lt;/b&gt;')
+        self.assertEqual(results[0]['post']['caption'], '<img src=x onerror=alert(1)> raku & <b>bowl</b>')
+
+    def test_fts_syntax_in_query_is_treated_as_text(self):
+        self.assertEqual([r['post']['id'] for r in self.search('mug" ) (*:^')], [self.mug.id])
+        self.assertEqual(self.search('"celadon'), self.search('celadon'))
+
+    def test_empty_query_returns_400(self):
+        self.assertEqual(self.client.get('/api/posts/search/').status_code, 400)
+        self.assertEqual(self.client.get('/api/posts/search/', {'q': '  *" '}).status_code, 400)
+        self.assertEqual(self.client.get('/api/posts/search/', {'q': 'bowl', 'limit': 0}).status_code, 400)
+
+    def test_index_follows_updates_deletes_and_renames(self):
+        self.mug.caption = 'Porcelain teapot'
+        self.mug.save()
+        self.assertEqual(self.search('mug'), [])
+        self.assertEqual([r['post']['id'] for r in self.search('teapot')], [self.mug.id])
+
+        Post.objects.filter(pk=self.glaze.pk).update(caption='Ash glaze vase')
+        self.assertEqual([r['post']['id'] for r in self.search('vase')], [self.glaze.id])
+
+        self.bowl.delete()
+        self.assertEqual([r['post']['id'] for r in self.search('trimmed')], [])
+
+        self.user.username = 'wheelthrower'
+        self.user.save()
+        self.assertEqual(len(self.search('wheelthr')), 2)
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM core_post_fts')
+        self.assertEqual(self.search('bowl'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 3 posts', out.getvalue())
+        self.assertEqual(len(self.search('bowl')), 2)
+
+    def test_admin_search_uses_index(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(admin_user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/core/post/', {'q': 'speckl'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Tall mug, speckled clay')
+        self.assertNotContains(response, 'Celadon glaze')
+        self.assertTrue(any('core_post_fts' in q['sql'] for q in queries))
+
+
+def pottery_photo(seed: int, size: int = 256) -> np.ndarray:
+    """A smooth random grayscale pattern standing in for a photo."""
+    coarse = np.random.default_rng(seed).integers(0, 256, (12, 12), dtype=np.uint8)
+    return cv2.resize(coarse, (size, size), interpolation=cv2.INTER_CUBIC)
+
+
+def jpeg_bytes(image: np.ndarray, quality: int = 90) -> bytes:
+    buffer = BytesIO()
+    Image.fromarray(image).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+class PerceptualHashTests(TestCase):
+    def test_dhash_survives_resize_recompression_and_exposure(self):
+        original = pottery_photo(1)
+        repost = np.clip(cv2.resize(original, (180, 180)).astype(int) + 12, 0, 255).astype(np.uint8)
+        path = os.path.join(MEDIA_ROOT, 'repost.jpg')
+        with open(path, 'wb') as f:
+            f.write(jpeg_bytes(repost, quality=60))
+        self.assertLessEqual((dhash(original) ^ image_dhash(path)).bit_count(), 4)
+        self.assertGreater((dhash(original) ^ dhash(pottery_photo(2))).bit_count(), 16)
+
+    def test_signed_round_trip(self):
+        for value in (0, 1, 2 ** 63 - 1, 2 ** 63, 2 ** 64 - 1):
+            self.assertTrue(-2 ** 63 <= to_signed(value) < 2 ** 63)
+            self.assertEqual(to_unsigned(to_signed(value)), value)
+
+    def test_index_matches_brute_force(self):
+        rng = random.Random(7)
+        hashes = [rng.getrandbits(64) for _ in range(2000)]
+        # Plant neighbours at every distance up to 12 bits from a few hashes
+        for base in hashes[:20]:
+            for distance in range(13):
+                flipped = base
+                for bit in rng.sample(range(64), distance):
+                    flipped ^= 1 << bit
+                hashes.append(flipped)
+        index = HashIndex()
+        index.extend((key, key // 3, value) for key, value in enumerate(hashes))
+        for query in hashes[:20] + [rng.getrandbits(64) for _ in range(5)]:
+            for radius in (0, 3, 7, 8, 12):
+                expected = sorted(
+                    (key, key // 3, (value ^ query).bit_count())
+                    for key, value in enumerate(hashes) if (value ^ query).bit_count() <= radius
+                )
+                self.assertEqual(sorted(index.search(query, radius)), expected)
+
+    def test_index_replace_and_remove(self):
+        index = HashIndex()
+        index.add(1, 10, 0b1111)
+        index.add(1, 10, 2 ** 40)
+        self.assertEqual(index.search(0b1111, 0), [])
+        self.assertEqual(index.search(2 ** 40, 0), [(1, 10, 0)])
+        index.remove(1)
+        self.assertEqual(index.search(2 ** 40, 0), [])
+        self.assertEqual(len(index), 0)
+
+
+class SimilarPostsTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        similarity.reset()
+        self.addCleanup(similarity.reset)
+
+    def photo_post(self, image: np.ndarray, quality: int = 90) -> Post:
+        post = Post.objects.create(creator=self.user, caption='piece')
+        PostMedia.objects.create(post=post, media_type=PostMedia.MEDIA_TYPE_IMAGE,
+                                 file=SimpleUploadedFile(f'{post.pk}.jpg', jpeg_bytes(image, quality)))
+        return post
+
+    def similar(self, post: Post, **params) -> list[dict]:
+        response = self.client.get(f'/api/posts/{post.id}/similar/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_finds_reposts_of_the_same_piece(self):
+        original = self.photo_post(pottery_photo(1))
+        repost = self.photo_post(cv2.resize(pottery_photo(1), (200, 200)), quality=50)
+        other = self.photo_post(pottery_photo(2))
+        jobs.run_pending()
+        self.assertIsNotNone(PostMedia.objects.get(post=original).phash)
+
+        results = self.similar(original)
+        self.assertEqual([r['post']['id'] for r in results], [repost.id])
+        self.assertLessEqual(results[0]['distance'], 6)
+        self.assertEqual(results[0]['post']['caption'], 'piece')
+        self.assertEqual(self.similar(other), [])
+
+    def test_video_thumbnails_are_hashed(self):
+        def frame(i, frames, size):
+            return cv2.cvtColor(cv2.resize(pottery_photo(3), size), cv2.COLOR_GRAY2BGR)
+        post = Post.objects.create(creator=self.user)
+        PostMedia.objects.create(post=post, media_type=PostMedia.MEDIA_TYPE_VIDEO,
+                                 file=SimpleUploadedFile('clip.avi', make_video_bytes(size=(128, 128), frame_fn=frame)))
+        photo = self.photo_post(pottery_photo(3))
+        jobs.run_pending()
+        self.assertEqual([r['post']['id'] for r in self.similar(photo)], [post.id])
+
+    def test_index_updates_incrementally(self):
+        original = self.photo_post(pottery_photo(4))
+        jobs.run_pending()
+        self.assertEqual(self.similar(original), [])  # loads the index
+
+        # Hashed in this process: added by the post_save signal on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            repost = self.photo_post(pottery_photo(4), quality=40)
+            jobs.run_pending()
+        self.assertEqual([r['post']['id'] for r in self.similar(original)], [repost.id])
+
+        # Hashed by another process (no signal here): found by the catch-up sync
+        third = self.photo_post(pottery_photo(4), quality=70)
+        PostMedia.objects.filter(post=third).update(
+            phash=PostMedia.objects.get(post=original).phash, hashed_at=timezone.now(),
+        )
+        with mock.patch.object(similarity, 'SYNC_INTERVAL', 0):
+            self.assertEqual({r['post']['id'] for r in self.similar(original)}, {repost.id, third.id})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            repost.delete()
+        self.assertEqual([r['post']['id'] for r in self.similar(original)], [third.id])
+
+    def test_undecodable_images_are_left_unhashed(self):
+        post = self.make_post('broken')
+        jobs.run_pending()
+        media = PostMedia.objects.get(post=post)
+        self.assertEqual(media.status, PostMedia.STATUS_READY)
+        self.assertIsNone(media.phash)
+        self.assertEqual(self.similar(post), [])
+
+    def test_invalid_requests(self):
+        post = self.photo_post(pottery_photo(5))
+        self.assertEqual(self.client.get('/api/posts/999999/similar/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/posts/{post.id}/similar/', {'radius': 99}).status_code, 400)
+
+    def test_hash_media_command_backfills(self):
+        post = self.photo_post(pottery_photo(6))
+        PostMedia.objects.filter(post=post).update(status=PostMedia.STATUS_READY)
+        out = StringIO()
+        call_command('hash_media', stdout=out)
+        self.assertIn('Hashed 1 media', out.getvalue())
+        self.assertIsNotNone(PostMedia.objects.get(post=post).phash)
+
+
+class RenditionTests(MediaTestCase):
+    def upload(self, data: bytes, name: str = 'pot.jpg'):
+        response = self.client.post('/api/posts/', {'image': SimpleUploadedFile(name, data)}, format='multipart')
+        jobs.run_pending()
+        return self.client.get(f"/api/posts/{response.json()['id']}/").json()['media'][0]
+
+    def open_rendition(self, url: str) -> Image.Image:
+        return Image.open(os.path.join(MEDIA_ROOT, url.split(settings.MEDIA_URL, 1)[1]))
+
+    def test_ladder_in_both_formats(self):
+        photo = cv2.cvtColor(cv2.resize(pottery_photo(1), (1600, 1200)), cv2.COLOR_GRAY2RGB)
+        renditions = self.upload(jpeg_bytes(photo))['renditions']
+        self.assertEqual(list(renditions), ['webp', 'jpeg'])
+        self.assertEqual(list(renditions['jpeg']), ['320', '640', '1080'])
+        for fmt, urls in renditions.items():
+            for width, url in urls.items():
+                image = self.open_rendition(url)
+                self.assertEqual(image.format, fmt.upper())
+                self.assertEqual(image.size, (int(width), int(width) * 3 // 4))
+        self.assertTrue(self.open_rendition(renditions['jpeg']['640']).info.get('progressive'))
+
+    def test_small_images_are_not_upscaled_and_alpha_is_flattened(self):
+        buffer = BytesIO()
+        Image.new('RGBA', (200, 100), (200, 0, 0, 0)).save(buffer, format='PNG')
+        renditions = self.upload(buffer.getvalue(), 'screenshot.png')['renditions']
+        self.assertEqual(list(renditions['webp']), ['200'])
+        self.assertEqual(self.open_rendition(renditions['webp']['200']).mode, 'RGBA')
+        flattened = self.open_rendition(renditions['jpeg']['200'])
+        self.assertEqual(flattened.mode, 'RGB')
+        self.assertGreater(min(flattened.getpixel((100, 50))), 240)
+
+    def test_exif_orientation_is_applied(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Stored landscape, displayed portrait
+        buffer = BytesIO()
+        Image.fromarray(cv2.resize(pottery_photo(2), (1200, 400))).save(buffer, format='JPEG', exif=exif)
+        renditions = self.upload(buffer.getvalue())['renditions']
+        self.assertEqual(list(renditions['jpeg']), ['320', '400'])
+        self.assertEqual(self.open_rendition(renditions['jpeg']['320']).size, (320, 960))
+
+    def test_video_thumbnails_and_undecodable_images(self):
+        response = self.client.post('/api/posts/', {'video': SimpleUploadedFile('clip.avi', make_video_bytes())},
+                                    format='multipart')
+        self.make_post('broken')
+        jobs.run_pending()
+        video = self.client.get(f"/api/posts/{response.json()['id']}/").json()['media'][0]
+        self.assertEqual(list(video['renditions']['webp']), ['64'])
+        broken = PostMedia.objects.get(post__caption='broken')
+        self.assertEqual(broken.status, PostMedia.STATUS_READY)
+        self.assertFalse(broken.renditions.exists())
+
+    def test_duplicates_share_rendition_files(self):
+        data = jpeg_bytes(pottery_photo(3, size=700))
+        first = self.upload(data)
+        second = self.upload(data)
+        self.assertEqual(MediaJob.objects.count(), 1)
+        self.assertEqual(first['renditions'], second['renditions'])
+        names = set(MediaRendition.objects.values_list('file', flat=True))
+        self.assertEqual(MediaRendition.objects.count(), 2 * len(names))
+        self.assertEqual({MediaBlob.objects.get(name=name).refcount for name in names}, {2})
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.all().delete()
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertFalse(any(media_storage().exists(name) for name in names))
+
+    def test_backfill_command(self):
+        post = Post.objects.create(creator=self.user)
+        PostMedia.objects.create(post=post, file=SimpleUploadedFile('old.jpg', jpeg_bytes(pottery_photo(4, size=500))))
+        # As if processed before renditions existed
+        MediaJob.objects.all().delete()
+        PostMedia.objects.update(status=PostMedia.STATUS_READY)
+        self.client.get('/api/posts/')  # caches the fragment without renditions
+        out = StringIO()
+        call_command('generate_renditions', '--workers', '2', stdout=out)
+        self.assertIn('Generated renditions for 1 media', out.getvalue())
+        self.assertEqual(list(self.client.get('/api/posts/').json()[0]['media'][0]['renditions']['webp']),
+                         ['320', '500'])
+
+
+class PlaceholderTests(MediaTestCase):
+    def test_encoder_matches_the_reference(self):
+        rng = np.random.default_rng(1)
+        pixels = (rng.random((24, 32, 3)) * 255).astype(np.uint8)
+        pixels[:, :16] //= 3
+        # From the reference C encoder (blurhash-python) with 4x3 components
+        self.assertEqual(placeholders.blurhash(pixels), 'LTD9-d00V@%ft6V]XOr?jrW:n,W:')
+        self.assertEqual(placeholders.blurhash(pixels.transpose(1, 0, 2))[0], 'T')  # 3x4 when portrait
+
+        solid = np.full((20, 30, 3), (200, 120, 60), dtype=np.uint8)
+        dc = placeholders.base83((200 << 16) + (120 << 8) + 60, 4)
+        self.assertEqual(placeholders.blurhash(solid)[2:6], dc)
+        self.assertEqual(placeholders.dominant_color(solid), '#c8783c')
+
+    def test_dominant_color_is_the_most_common_one(self):
+        pixels = np.zeros((10, 10, 3), dtype=np.uint8)
+        pixels[:, :7] = (30, 90, 160)
+        pixels[:, 7:] = (250, 250, 250)
+        self.assertEqual(placeholders.dominant_color(pixels), '#1e5aa0')
+
+    def test_images_get_a_placeholder_from_their_smallest_rendition(self):
+        photo = cv2.cvtColor(cv2.resize(pottery_photo(3), (1600, 1200)), cv2.COLOR_GRAY2RGB)
+        self.client.post('/api/posts/', {'image': SimpleUploadedFile('pot.jpg', jpeg_bytes(photo))}, format='multipart')
+        with mock.patch('core.media.renditions.compute_placeholder', wraps=placeholders.placeholder) as compute:
+            jobs.run_pending()
+        self.assertEqual(compute.call_args.args[0].size, (320, 240))
+
+        placeholder = self.client.get('/api/posts/').json()[0]['media'][0]['placeholder']
+        self.assertEqual(len(placeholder['blurhash']), 28)
+        self.assertEqual(placeholder['blurhash'][0], 'L')
+        self.assertRegex(placeholder['dominant_color'], r'^#[0-9a-f]{6}$')
+
+    def test_videos_reuse_the_poster_frame(self):
+        video = make_video_bytes(frames=24, size=(64, 48), frame_fn=lambda i, n, size: np.full((*size[::-1], 3), 90, np.uint8))
+        self.client.post('/api/posts/', {'video': SimpleUploadedFile('clip.avi', video)}, format='multipart')
+        with mock.patch('core.media.renditions.compute_placeholder', wraps=placeholders.placeholder) as from_ladder:
+            jobs.run_pending()
+        from_ladder.assert_not_called()
+        media = PostMedia.objects.get()
+        self.assertEqual(media.blurhash[0], 'L')
+        self.assertEqual(media.dominant_color[:2], '#5')
+
+
+def exif_jpeg(image: Image.Image, orientation: int = 1, **save_args) -> bytes:
+    """A camera-style JPEG: orientation, GPS position and a comment."""
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    exif[0x8825] = {2: (51.0, 30.0, 0.0)}
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', exif=exif, comment=b'Pixel 9 Pro', quality=92, **save_args)
+    return buffer.getvalue()
+
+
+def noisy_photo(width: int, height: int) -> Image.Image:
+    rng = np.random.default_rng(7)
+    pixels = np.stack([cv2.resize(pottery_photo(seed), (width, height)) for seed in (1, 2, 3)], axis=-1)
+    return Image.fromarray(np.clip(pixels + rng.normal(0, 6, pixels.shape), 0, 255).astype(np.uint8))
+
+
+class NormalizeTests(MediaTestCase):
+    def test_rotated_oversized_photo_is_upright_capped_and_stripped(self):
+        data = exif_jpeg(noisy_photo(1200, 600), orientation=6)
+        result = normalize(data, max_edge=800, max_pixels=10 ** 7)
+        self.assertEqual((result.ext, result.width, result.height), ('.jpg', 400, 800))
+        with Image.open(BytesIO(result.data)) as image:
+            self.assertEqual(image.size, (400, 800))
+            self.assertEqual(len(image.getexif()), 0)
+            self.assertNotIn('comment', image.info)
+
+    def test_upright_jpeg_is_stripped_losslessly(self):
+        data = exif_jpeg(noisy_photo(320, 240), icc_profile=b'\0' * 128)
+        stripped = strip_jpeg_metadata(data)
+        self.assertLess(len(stripped), len(data))
+        self.assertNotIn(b'Exif', stripped)
+        self.assertNotIn(b'Pixel 9 Pro', stripped)
+        with Image.open(BytesIO(data)) as before, Image.open(BytesIO(stripped)) as after:
+            self.assertEqual(after.info['icc_profile'], b'\0' * 128)
+            self.assertEqual(np.asarray(before).tobytes(), np.asarray(after).tobytes())
+        self.assertEqual(normalize(stripped, max_edge=800, max_pixels=10 ** 7), None)
+
+    def test_photo_png_becomes_jpeg_and_screenshot_stays_png(self):
+        buffer = BytesIO()
+        noisy_photo(400, 300).save(buffer, format='PNG')
+        self.assertEqual(normalize(buffer.getvalue(), max_edge=800, max_pixels=10 ** 7).ext, '.jpg')
+
+        screenshot = Image.new('RGB', (400, 300), 'white')
+        screenshot.paste((30, 90, 160), (0, 0, 400, 40))
+        buffer = BytesIO()
+        screenshot.save(buffer, format='PNG')
+        result = normalize(buffer.getvalue(), max_edge=200, max_pixels=10 ** 7)
+        self.assertEqual((result.ext, result.width, result.height), ('.png', 200, 150))
+
+    @override_settings(IMAGE_MAX_PIXELS=1000)
+    def test_decode_over_the_pixel_limit_keeps_the_upload(self):
+        data = exif_jpeg(noisy_photo(200, 100), orientation=6)
+        self.client.post('/api/posts/', {'image': SimpleUploadedFile('big.jpg', data)}, format='multipart')
+        with self.assertLogs('core.media.normalize', 'WARNING'):
+            jobs.run_pending()
+        media = PostMedia.objects.get()
+        self.assertEqual((media.status, media.original_size, media.file_size), (PostMedia.STATUS_READY, len(data), len(data)))
+        self.assertFalse(media.original)
+
+    @override_settings(IMAGE_MAX_EDGE=300)
+    def test_upload_keeps_a_cold_original_and_reuploads_reuse_it(self):
+        data = exif_jpeg(noisy_photo(600, 400), orientation=8)
+        self.client.post('/api/posts/', {'image': SimpleUploadedFile('pot.jpg', data)}, format='multipart')
+        jobs.run_pending()
+        media = PostMedia.objects.get()
+        self.assertTrue(media.file.name.startswith('posts/media/'))
+        self.assertTrue(media.original.name.startswith('posts/originals/'))
+        self.assertEqual((media.width, media.height, media.original_size), (200, 300, len(data)))
+        self.assertLess(media.file_size, len(data))
+        with media.original.open('rb') as f:
+            self.assertEqual(f.read(), data)
+        # Originals aren't served: they still carry the location
+        self.assertEqual(self.client.get(media.original.url).status_code, 404)
+
+        self.client.post('/api/posts/', {'image': SimpleUploadedFile('again.jpg', data)}, format='multipart')
+        self.assertFalse(MediaJob.objects.filter(status=MediaJob.STATUS_QUEUED).exists())
+        again = PostMedia.objects.latest('pk')
+        self.assertEqual((again.file.name, again.original.name), (media.file.name, media.original.name))
+        self.assertEqual(MediaBlob.objects.get(name=media.file.name).refcount, 2)
+        self.assertEqual(MediaBlob.objects.get(name=media.original.name).refcount, 2)
+
+    @override_settings(IMAGE_MAX_EDGE=300)
+    def test_regenerate_media_normalizes_existing_images(self):
+        data = exif_jpeg(noisy_photo(600, 400))
+        self.client.post('/api/posts/', {'image': SimpleUploadedFile('pot.jpg', data)}, format='multipart')
+        with mock.patch.object(PostMedia, 'normalize_image', return_value=False):
+            jobs.run_pending()
+        self.assertIsNone(PostMedia.objects.get().original_size)
+
+        out = StringIO()
+        checkpoint = os.path.join(MEDIA_ROOT, 'checkpoint.json')
+        call_command('regenerate_media', '--workers', '1', '--checkpoint', checkpoint, stdout=out)
+        self.assertIn('Normalized 1 images, saving', out.getvalue())
+        media = PostMedia.objects.get()
+        self.assertEqual((media.width, media.height, media.original_size), (300, 200, len(data)))
+        self.assertEqual(MediaBlob.objects.get(name=media.file.name).refcount, 1)
+        self.assertEqual(MediaBlob.objects.get(name=media.original.name).refcount, 1)
+
+
+def numbered_frame(i: int, frames: int, size: tuple[int, int]) -> np.ndarray:
+    """Each frame a distinct flat grey, so a tile tells which frame it came from."""
+    return np.full((size[1], size[0], 3), 10 + i * 2, dtype=np.uint8)
+
+
+class StoryboardTests(MediaTestCase):
+    def parse_vtt(self, text: str) -> list[tuple[str, str, list[int]]]:
+        lines = text.split('\n')
+        self.assertEqual(lines[0], 'WEBVTT')
+        cues = []
+        for timing, target in zip(lines[2::3], lines[3::3]):
+            sheet, xywh = target.split('#xywh=')
+            cues.append((timing, sheet, [int(v) for v in xywh.split(',')]))
+        return cues
+
+    def test_tiles_are_laid_out_row_major(self):
+        tiles = np.stack([np.full((2, 3, 3), value, dtype=np.uint8) for value in (1, 2, 3)])
+        grid = tile_grid(tiles, columns=2)
+        self.assertEqual(grid.shape, (4, 6, 3))
+        self.assertEqual([grid[0, 0, 0], grid[0, 3, 0], grid[2, 0, 0], grid[2, 3, 0]], [1, 2, 3, 0])
+
+    def test_video_gets_storyboard_in_the_thumbnail_pass(self):
+        video = make_video_bytes(frames=60, size=(96, 64), frame_fn=numbered_frame)
+        response = self.client.post('/api/posts/', {'video': SimpleUploadedFile('clip.avi', video)}, format='multipart')
+        with mock.patch('core.media.derivatives.cv2.VideoCapture', wraps=cv2.VideoCapture) as capture:
+            jobs.run_pending()
+        self.assertEqual(capture.call_count, 1)
+
+        media = self.client.get(f"/api/posts/{response.json()['id']}/").json()['media'][0]
+        self.assertIsNotNone(media['thumbnail_url'])
+        vtt_name = media['storyboard_url'].split(settings.MEDIA_URL, 1)[1]
+        with open(os.path.join(MEDIA_ROOT, vtt_name)) as f:
+            cues = self.parse_vtt(f.read())
+        # 5 seconds at the default 2 second interval
+        self.assertEqual([timing for timing, _, _ in cues], [
+            '00:00:00.000 --> 00:00:02.000', '00:00:02.000 --> 00:00:04.000', '00:00:04.000 --> 00:00:05.000',
+        ])
+        sheet_name = posixpath.normpath(posixpath.join(posixpath.dirname(vtt_name), cues[0][1]))
+        self.assertEqual(PostMedia.objects.get().storyboard_sheets, [sheet_name])
+        sheet = cv2.imread(os.path.join(MEDIA_ROOT, sheet_name), cv2.IMREAD_GRAYSCALE)
+        for i, (_, _, (x, y, w, h)) in enumerate(cues):
+            self.assertEqual((w, h), (160, 106))
+            # Tile i shows frame 24 * i
+            self.assertAlmostEqual(int(sheet[y + h // 2, x + w // 2]), 10 + 48 * i, delta=3)
+
+    def test_long_videos_span_several_sheets(self):
+        path = os.path.join(MEDIA_ROOT, 'long.avi')
+        with open(path, 'wb') as f:
+            f.write(make_video_bytes(frames=120, size=(32, 24), fps=24.0, frame_fn=numbered_frame))
+        cap = cv2.VideoCapture(path)
+        try:
+            storyboard = build_storyboard(cap, interval=0.01)
+        finally:
+            cap.release()
+        # Capped at MAX_TILES, 100 per sheet
+        self.assertEqual(len(storyboard.cues), 200)
+        self.assertEqual([sheet.shape[:2] for sheet in storyboard.sheets], [(1200, 1600), (1200, 1600)])
+        self.assertEqual(storyboard.cues[100].sheet, 1)
+        self.assertEqual((storyboard.cues[100].x, storyboard.cues[100].y), (0, 0))
+        self.assertEqual(storyboard.cues[-1].end, 5.0)
+
+    def test_sheets_are_reference_counted(self):
+        video = lambda: SimpleUploadedFile('clip.avi', make_video_bytes(frames=30), content_type='video/x-msvideo')
+        self.client.post('/api/posts/', {'video': video()}, format='multipart')
+        jobs.run_pending()
+        self.client.post('/api/posts/', {'video': video()}, format='multipart')
+        first, second = PostMedia.objects.order_by('pk')
+        self.assertEqual(second.storyboard, first.storyboard)
+        for name in [first.storyboard.name, *first.storyboard_sheets]:
+            self.assertEqual(MediaBlob.objects.get(name=name).refcount, 2)
+        call_command('dedupe_media', stdout=StringIO())
+        self.assertEqual(MediaBlob.objects.get(name=first.storyboard_sheets[0]).refcount, 2)
+
+
+class MediaMetadataTests(MediaTestCase):
+    def test_video_metadata_comes_from_the_decode_pass(self):
+        video = make_video_bytes(frames=60, size=(96, 64), fps=12.0)
+        response = self.client.post('/api/posts/', {'video': SimpleUploadedFile('clip.avi', video)}, format='multipart')
+        with mock.patch('core.media.derivatives.cv2.VideoCapture', wraps=cv2.VideoCapture) as capture:
+            jobs.run_pending()
+        self.assertEqual(capture.call_count, 1)
+
+        metadata = self.client.get(f"/api/posts/{response.json()['id']}/").json()['media'][0]['metadata']
+        self.assertEqual(metadata, {
+            'width': 96, 'height': 64, 'rotation': 0, 'duration': 5.0, 'fps': 12.0, 'frame_count': 60,
+            'codec': 'MJPG', 'file_size': len(video), 'checksum': hashlib.sha256(video).hexdigest(),
+        })
+
+    def test_image_size_is_upright(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Rotate 90 degrees clockwise to display
+        buffer = BytesIO()
+        Image.new('RGB', (80, 40), (200, 120, 60)).save(buffer, format='JPEG', exif=exif)
+        data = buffer.getvalue()
+        self.client.post('/api/posts/', {'image': SimpleUploadedFile('side.jpg', data)}, format='multipart')
+        jobs.run_pending()
+
+        # Normalization stored it turned upright, so clients have nothing left to rotate
+        metadata = self.client.get('/api/posts/').json()[0]['media'][0]['metadata']
+        self.assertEqual((metadata['width'], metadata['height'], metadata['rotation']), (40, 80, 0))
+        self.assertEqual((metadata['duration'], metadata['codec']), (None, ''))
+        with PostMedia.objects.get().file.open('rb') as f:
+            self.assertEqual(metadata['checksum'], hashlib.sha256(f.read()).hexdigest())
+        with PostMedia.objects.get().original.open('rb') as f:
+            self.assertEqual(image_metadata(f), {'width': 40, 'height': 80, 'rotation': 90})
+
+    def test_backfill_is_resumable(self):
+        video = make_video_bytes(frames=24, size=(64, 48))
+        self.client.post('/api/posts/', {'video': SimpleUploadedFile('clip.avi', video)}, format='multipart')
+        self.make_post('bowl', media_count=2)
+        jobs.run_pending()
+        PostMedia.objects.update(**{field: None for field in PostMedia.METADATA_FIELDS if field not in ('codec', 'checksum')},
+                                 codec='', checksum='')
+
+        out = StringIO()
+        call_command('backfill_media_metadata', '--workers', '2', '--limit', '1', stdout=out)
+        self.assertIn('Stored metadata for 1 media', out.getvalue())
+        call_command('backfill_media_metadata', '--workers', '2', stdout=out)
+        self.assertIn('Stored metadata for 2 media', out.getvalue())
+
+        clip = PostMedia.objects.get(media_type=PostMedia.MEDIA_TYPE_VIDEO)
+        self.assertEqual((clip.width, clip.frame_count, clip.codec, clip.file_size), (64, 24, 'MJPG', len(video)))
+        self.assertFalse(PostMedia.objects.filter(file_size__isnull=True).exists())
+
+
+class RegenerateMediaTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.checkpoint), True)
+
+    def upload_video(self, data: bytes, name: str = 'upload.avi') -> PostMedia:
+        """A video whose processing job gave up, as before the worker retried anything."""
+        response = self.client.post('/api/posts/', {'video': SimpleUploadedFile(name, data)}, format='multipart')
+        MediaJob.objects.update(status=MediaJob.STATUS_FAILED)
+        media = PostMedia.objects.get(post_id=response.json()['id'])
+        media.status = PostMedia.STATUS_FAILED
+        media.save(update_fields=['status'])
+        return media
+
+    def regenerate(self, *args) -> tuple[str, str]:
+        out, err = StringIO(), StringIO()
+        call_command('regenerate_media', '--workers', '2', '--checkpoint', self.checkpoint, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_missing_thumbnails_are_generated_out_of_process(self):
+        media = self.upload_video(make_video_bytes(frames=36))
+        out, err = self.regenerate('--missing-thumbnail')
+        self.assertIn('Regenerated 1 media', out)
+        self.assertEqual(err, '')
+
+        media.refresh_from_db()
+        self.assertEqual(media.status, PostMedia.STATUS_READY)
+        self.assertEqual((media.frame_count, media.codec), (36, 'MJPG'))
+        self.assertIsNotNone(media.phash)
+        self.assertTrue(media.storyboard_sheets)
+        # post_save ran for the bulk update, so the new files are referenced
+        self.assertEqual(MediaBlob.objects.get(name=media.thumbnail.name).refcount, 1)
+        self.assertTrue(os.path.exists(media.thumbnail.path))
+        self.assertFalse(os.path.exists(self.checkpoint))
+        self.assertEqual(self.regenerate('--missing-thumbnail')[0].count('Regenerated 0 media'), 1)
+
+    def test_remuxed_videos_get_a_new_blob(self):
+        path = os.path.join(os.path.dirname(self.checkpoint), 'clip.mp4')
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 10, (64, 48))
+        for i in range(10):
+            writer.write(fade_in_frame(i, 10, (64, 48)))
+        writer.release()
+        with open(path, 'rb') as f:
+            media = self.upload_video(f.read(), 'clip.mp4')
+        uploaded = media.file.name
+        self.assertIs(media.is_faststart, False)
+
+        out, err = self.regenerate()
+        self.assertEqual(err, '')
+        media.refresh_from_db()
+        self.assertTrue(media.is_faststart)
+        self.assertNotEqual(media.file.name, uploaded)
+        self.assertTrue(is_faststart(media.file.path))
+        self.assertEqual(media.checksum, digest_from_name(media.file.name))
+        self.assertEqual(media.checksum, hash_file(media.file.path))
+        self.assertEqual(MediaBlob.objects.get(name=media.file.name).refcount, 1)
+        self.assertFalse(MediaBlob.objects.filter(name=uploaded).exists())
+
+    def test_failures_report_the_exception(self):
+        broken = self.upload_video(b'not a video at all')
+        out, err = self.regenerate()
+        self.assertIn(f'PostMedia {broken.pk}: ValueError: OpenCV could not open', err)
+        self.assertIn('1 failed', out)
+        broken.refresh_from_db()
+        self.assertEqual(broken.status, PostMedia.STATUS_FAILED)
+
+    def test_interrupted_run_resumes_from_checkpoint(self):
+        first = self.upload_video(make_video_bytes(frames=24))
+        second = self.upload_video(make_video_bytes(frames=30))
+        out, _ = self.regenerate('--limit', '1', '--batch-size', '1')
+        self.assertTrue(os.path.exists(self.checkpoint))
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f)['last_pk'], first.pk)
+
+        with self.assertRaisesMessage(CommandError, 'different options'):
+            self.regenerate('--media-type', 'image')
+        out, _ = self.regenerate()
+        self.assertIn(f'Resuming after PostMedia {first.pk}', out)
+        self.assertIn('Regenerated 1 media', out)
+        self.assertIn('Including earlier runs: 2 regenerated', out)
+        second.refresh_from_db()
+        self.assertTrue(second.thumbnail)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+
+class DeltaSyncTests(MediaTestCase):
+    def sync(self, cursor=None, **params):
+        if cursor:
+            params['since'] = cursor
+        response = self.client.get('/api/posts/changes/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_changes_since_cursor(self):
+        kept, sold, dropped = self.make_post('kept'), self.make_post('sold'), self.make_post('dropped')
+        first = self.sync()
+        self.assertEqual([post['id'] for post in first['created']], [kept.id, sold.id, dropped.id])
+        self.assertEqual((first['updated'], first['deleted'], first['has_more']), ([], [], False))
+        self.assertEqual(self.sync(first['cursor'])['created'], [])
+
+        kept.refresh_from_db()
+        kept.caption = 'kept, glazed'
+        kept.save()
+        self.client.post(f'/api/posts/{sold.id}/list_on_shelf/', {'price': '30.00'})
+        dropped_id = dropped.id
+        dropped.delete()
+        new = self.make_post('new')
+
+        changes = self.sync(first['cursor'])
+        self.assertEqual([post['id'] for post in changes['created']], [new.id])
+        self.assertEqual([post['id'] for post in changes['updated']], [kept.id, sold.id])
+        self.assertEqual(changes['updated'][0]['caption'], 'kept, glazed')
+        self.assertEqual(changes['updated'][1]['sale_item']['price'], '30.00')
+        self.assertEqual(changes['deleted'], [dropped_id])
+        # Same rendering as the feed
+        self.assertEqual(changes['created'][0], self.client.get(f'/api/posts/{new.id}/').json())
+        self.assertEqual(self.sync(changes['cursor']), {
+            'created': [], 'updated': [], 'deleted': [], 'cursor': changes['cursor'], 'has_more': False,
+        })
+
+    def test_pages_cover_every_change_once(self):
+        posts = [self.make_post(str(i)) for i in range(5)]
+        ids = [post.id for post in posts]
+        cursor = self.sync()['cursor']
+        for post in posts[:3]:
+            post.delete()
+        for post in posts[3:]:
+            post.refresh_from_db()
+            post.save()
+        seen = []
+        while True:
+            changes = self.sync(cursor, limit=2)
+            seen += [post['id'] for post in changes['updated']] + changes['deleted']
+            cursor = changes['cursor']
+            if not changes['has_more']:
+                break
+        self.assertEqual(sorted(seen), ids)
+
+    def test_bad_and_expired_cursors(self):
+        self.assertEqual(self.client.get('/api/posts/changes/', {'since': 'nope'}).status_code, 400)
+        old = sync.Cursor(timezone.now() - PostTombstone.RETENTION - timedelta(days=1), sync.KIND_POST, 1)
+        self.assertEqual(self.client.get('/api/posts/changes/', {'since': old.encode()}).status_code, 410)
+
+    def test_unchanged_lists_are_not_modified(self):
+        post = self.make_post('bowl', for_sale=True)
+        for url in ('/api/posts/', '/api/posts/?page_size=10', '/api/shelf/'):
+            response = self.client.get(url)
+            etag = response['ETag']
+            # Rows only: no media query, nothing rendered
+            with self.assertNumQueries(1 if url.startswith('/api/posts/') else 2):
+                response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+
+        etag = self.client.get('/api/shelf/')['ETag']
+        post.saleitem.price = '12.00'
+        post.saleitem.save()
+        response = self.client.get('/api/shelf/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class MetricsTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+
+    def scrape(self) -> str:
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        return response.content.decode()
+
+    def test_request_latency_queries_and_bytes_by_route(self):
+        self.make_post('bowl')
+        body = self.client.get('/api/posts/').content
+        text = self.scrape()
+        self.assertIn('http_request_duration_seconds_count{route="post-list",method="GET",status="200"} 1', text)
+        self.assertIn('http_request_duration_seconds_bucket{route="post-list",method="GET",status="200",le="+Inf"} 1',
+                      text)
+        # Cold fragment cache: the two feed queries
+        self.assertIn('http_request_db_queries_bucket{route="post-list",le="2"} 1', text)
+        self.assertIn('http_request_db_queries_bucket{route="post-list",le="1"} 0', text)
+        self.assertIn(f'http_response_bytes_total{{route="post-list"}} {len(body)}', text)
+        self.assertIn('feed_cache_misses_total', text)
+
+    def test_streamed_media_bytes_are_counted(self):
+        self.make_post('bowl')
+        response = self.client.get(PostMedia.objects.get().file.url)
+        size = len(b''.join(response.streaming_content))
+        response.close()
+        self.assertIn(f'http_response_bytes_total{{route="media"}} {size}', self.scrape())
+
+    def test_media_processing_steps_are_timed(self):
+        video = make_video_bytes(frames=24, size=(64, 48))
+        self.client.post('/api/posts/', {'video': SimpleUploadedFile('clip.avi', video)}, format='multipart')
+        jobs.run_pending()
+        text = self.scrape()
+        for step in ('poster_frame', 'thumbnail_encode', 'storyboard', 'phash'):
+            self.assertIn(f'media_processing_duration_seconds_count{{step="{step}"}} 1', text)
+
+    def test_media_worker_metrics_reach_the_endpoint(self):
+        video = make_video_bytes(frames=24, size=(64, 48))
+        self.client.post('/api/posts/', {'video': SimpleUploadedFile('clip.avi', video)}, format='multipart')
+        export_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, export_dir, True)
+        with self.settings(METRICS_EXPORT_DIR=export_dir), \
+                mock.patch.object(jobs, 'ThreadPoolExecutor', InlineExecutor):
+            jobs.Worker(concurrency=1, poll_interval=0).run(once=True)
+            # As if the worker were another process: all the web process has is its export
+            metrics.reset()
+            text = self.scrape()
+        for step in ('poster_frame', 'thumbnail_encode', 'storyboard', 'phash'):
+            self.assertIn(f'media_processing_duration_seconds_count{{step="{step}"}} 1', text)
+        self.assertNotIn('media_processing_duration_seconds_count', self.scrape())
+
+    @override_settings(SLOW_REQUEST_SECONDS=0)
+    def test_slow_requests_log_their_sql(self):
+        self.make_post('bowl')
+        with self.assertLogs('core.slow_requests', 'WARNING') as logs:
+            self.client.get('/api/posts/')
+        self.assertIn('GET /api/posts/ (post-list) -> 200', logs.output[0])
+        self.assertIn('2 queries', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_shards_of_finished_threads_are_kept(self):
+        counter = metrics.Counter('test_total', 'Test.', ('worker',))
+        threads = [threading.Thread(target=counter.inc, args=(('a',), 2)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        del threads, thread
+        gc.collect()
+        self.assertEqual(counter.collect(), {('a',): [10]})
+        self.assertEqual(counter._live, {})
+
+
+class AsyncViewTests(MediaTestCase):
+    """The ASGI views (settings.ASYNC_VIEWS) against their sync counterparts."""
+    data = os.urandom(BLOCK_SIZE * 3 + 100)
+
+    def setUp(self):
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+        os.makedirs(os.path.join(MEDIA_ROOT, 'posts', 'media'), exist_ok=True)
+        with open(os.path.join(MEDIA_ROOT, 'posts', 'media', 'big.mov'), 'wb') as f:
+            f.write(self.data)
+
+    async def serve(self, **headers):
+        response = await aserve_media(self.factory.get('/media/posts/media/big.mov', headers=headers),
+                                      'posts/media/big.mov')
+        body = b''.join([chunk async for chunk in response]) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    async def test_media_bodies_and_headers(self):
+        response, body = await self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertEqual(response['Content-Type'], 'video/quicktime')
+
+        start, end = BLOCK_SIZE - 10, 2 * BLOCK_SIZE + 10
+        response, body = await self.serve(Range=f'bytes={start}-{end}')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[start:end + 1])
+        self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{len(self.data)}')
+
+        response, body = await self.serve(Range='bytes=0-9,1000-1009')
+        self.assertEqual(len(body), int(response['Content-Length']))
+        boundary = response['Content-Type'].split('boundary=')[1].encode()
+        parts = body.split(b'--' + boundary)[1:-1]
+        self.assertEqual(parts[1].split(b'\r\n\r\n', 1)[1][:-2], self.data[1000:1010])
+
+        response, body = await self.serve(If_None_Match=response['ETag'])
+        self.assertEqual((response.status_code, body), (304, b''))
+
+    async def test_disconnect_closes_the_descriptor(self):
+        started = asyncio.Event()
+
+        async def process_request():
+            # Like Django's ASGI handler task: it alone holds the response
+            response = await aserve_media(self.factory.get('/media/posts/media/big.mov'), 'posts/media/big.mov')
+            async for _ in response:
+                started.set()
+                await asyncio.sleep(60)
+
+        with mock.patch('os.close', wraps=os.close) as close:
+            task = asyncio.create_task(process_request())
+            await started.wait()
+            # What the handler does when the client goes away; response.close() is never called
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            for _ in range(100):
+                if close.called:
+                    break
+                await asyncio.sleep(0.01)
+        self.assertEqual(close.call_count, 1)
+
+    def test_feed_matches_sync_views(self):
+        for i in range(5):
+            self.make_post(str(i), media_count=2, for_sale=i % 2 == 0)
+        post_id = Post.objects.latest('id').id
+        for url in ['/api/posts/', '/api/posts/?page_size=2', '/api/posts/?page_size=2&cursor=bad']:
+            expected = self.client.get(url)
+            feed_cache.get_cache().clear()
+            with self.assertNumQueries(0 if expected.status_code == 404 else 2):
+                response = async_to_sync(post_list_async)(self.factory.get(url))
+            self.assertEqual((response.status_code, response.content), (expected.status_code, expected.content))
+            self.assertEqual(response.get('ETag'), expected.get('ETag'))
+
+        expected = self.client.get(f'/api/posts/{post_id}/')
+        response = async_to_sync(post_detail_async)(self.factory.get(f'/api/posts/{post_id}/'), pk=str(post_id))
+        self.assertEqual(response.content, expected.content)
+        response = async_to_sync(post_detail_async)(self.factory.get('/api/posts/0/'), pk='0')
+        self.assertEqual((response.status_code, response.content), (404, self.client.get('/api/posts/0/').content))
+
+        etag = self.client.get('/api/posts/').get('ETag')
+        response = async_to_sync(post_list_async)(self.factory.get('/api/posts/', headers={'If-None-Match': etag}))
+        self.assertEqual((response.status_code, response['ETag']), (304, etag))
+
+    def test_metrics_middleware_records_async_requests(self):
+        self.make_post('bowl')
+        metrics.reset()
+        request = self.factory.get('/api/posts/')
+        request.resolver_match = resolve('/api/posts/')
+        middleware = MetricsMiddleware(post_list_async)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(request)
+        text = metrics.render()
+        self.assertIn('http_request_db_queries_bucket{route="post-list",le="1"} 0', text)
+        self.assertIn('http_request_db_queries_bucket{route="post-list",le="2"} 1', text)
+        self.assertIn(f'http_response_bytes_total{{route="post-list"}} {len(response.content)}', text)
+
+
+# What a web worker does before serving its first request
+BOOT_SCRIPT = """
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+import core.admin, core.jobs, core.uploads
+# Peak RSS of this process; ru_maxrss would include the parent's, from before exec
+peak = -1
+try:
+    with open('/proc/self/status') as f:
+        peak = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmHWM:'))
+except OSError:
+    pass
+print(peak)
+"""
+
+
+class RecordingCoalescer(writes.WriteCoalescer):
+    def __init__(self):
+        self.batches = []
+        super().__init__()
+
+    def commit(self, batch):
+        self.batches.append(len(batch))
+        return super().commit(batch)
+
+
+class WriteCoalescingTests(TransactionTestCase):
+    def hold_writer(self, coalescer) -> threading.Event:
+        """Block the writer thread in a write until the returned event is set."""
+        holding, gate = threading.Event(), threading.Event()
+        coalescer.submit(lambda: holding.set() or gate.wait())
+        holding.wait(timeout=10)
+        return gate
+
+    def test_connections_get_the_pragmas(self):
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], 20000)
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone()[0], 1)  # NORMAL
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def test_queued_writes_share_a_transaction(self):
+        coalescer = RecordingCoalescer()
+        user = User.objects.create(username='potter')
+        # Holds the writer in its first batch while the others queue up
+        gate = self.hold_writer(coalescer)
+        created = [coalescer.submit(Post.objects.create, creator=user, caption=f'Bowl {i}') for i in range(5)]
+        duplicate = coalescer.submit(User.objects.create, username='potter')
+        gate.set()
+        self.assertEqual(sorted(future.result(timeout=10).caption for future in created),
+                         [f'Bowl {i}' for i in range(5)])
+        with self.assertRaises(IntegrityError):
+            duplicate.result(timeout=10)
+        self.assertEqual(coalescer.batches, [1, 6])
+
+    def test_a_write_failing_at_commit_is_retried_alone(self):
+        coalescer = RecordingCoalescer()
+        user = User.objects.create(username='potter')
+        gate = self.hold_writer(coalescer)
+        good = coalescer.submit(Post.objects.create, creator=user, caption='Vase')
+        # SQLite checks foreign keys at COMMIT, failing the whole shared transaction
+        orphan = coalescer.submit(Post.objects.create, creator_id=user.pk + 100, caption='Orphan')
+        with self.assertLogs('core.writes', 'WARNING'):
+            gate.set()
+            self.assertEqual(good.result(timeout=10).caption, 'Vase')
+        with self.assertRaises(IntegrityError):
+            orphan.result(timeout=10)
+        self.assertEqual(list(Post.objects.values_list('caption', flat=True)), ['Vase'])
+        self.assertEqual(coalescer.batches, [1, 2, 1, 1])
+
+    def test_the_submitting_request_is_charged_for_the_sql(self):
+        user = User.objects.create(username='potter')
+        recorder = QueryRecorder(keep_sql=False)
+        with connection.execute_wrapper(recorder):
+            writes.coalesced_write(Post.objects.create, creator=user, caption='Jar')
+        # SAVEPOINT, INSERT, RELEASE SAVEPOINT, run on the writer thread
+        self.assertEqual(recorder.count, 3)
+
+    def test_on_commit_callbacks_run_off_the_writer_thread(self):
+        coalescer = writes.get_coalescer()
+        done, ran_on = threading.Event(), []
+        callback = lambda: ran_on.append(threading.current_thread()) or done.set()
+        writes.coalesced_write(transaction.on_commit, callback)
+        self.assertTrue(done.wait(timeout=10))
+        self.assertIsNot(ran_on[0], coalescer.thread)
+        self.assertTrue(ran_on[0].name.startswith('db-on-commit'))
+
+    def test_a_dead_writer_thread_is_replaced(self):
+        previous = writes._coalescer
+        self.addCleanup(setattr, writes, '_coalescer', previous)
+        dead = writes._coalescer = RecordingCoalescer()
+        with mock.patch.object(threading, 'excepthook'):
+            dead.queue.put(None)  # Not a PendingWrite: the writer thread raises and exits
+            dead.thread.join(timeout=10)
+        self.assertFalse(dead.thread.is_alive())
+        user = User.objects.create(username='potter')
+        self.assertEqual(writes.coalesced_write(Post.objects.create, creator=user, caption='Jug').caption, 'Jug')
+        self.assertIsNot(writes._coalescer, dead)
+
+    def test_a_stuck_writer_is_bypassed_after_the_timeout(self):
+        previous = writes._coalescer
+        self.addCleanup(setattr, writes, '_coalescer', previous)
+        stuck = writes._coalescer = RecordingCoalescer()
+        # Stuck before BEGIN, so the direct write can take the lock
+        holding, gate = threading.Event(), threading.Event()
+        self.addCleanup(gate.set)
+        commit = stuck.commit
+        stuck.commit = lambda batch: holding.set() or gate.wait() and commit(batch)
+        stuck.submit(lambda: None)
+        holding.wait(timeout=10)
+        user = User.objects.create(username='potter')
+        with mock.patch.object(writes, 'WRITE_TIMEOUT', 0.1), self.assertLogs('core.writes', 'WARNING'):
+            post = writes.coalesced_write(Post.objects.create, creator=user, caption='Cup')
+        self.assertEqual(post.caption, 'Cup')
+        self.assertIsNot(writes._coalescer, stuck)
+        # The withdrawn write is skipped once the old writer wakes up
+        gate.set()
+        stuck.submit(lambda: None).result(timeout=10)
+        self.assertEqual(stuck.batches, [1, 1])
+        self.assertEqual(Post.objects.count(), 1)
+
+    def test_writes_inside_a_transaction_run_inline(self):
+        with transaction.atomic():
+            self.assertIs(writes.coalesced_write(threading.current_thread), threading.current_thread())
+
+    def test_concurrent_creates_and_listings(self):
+        user = User.objects.create(username='potter')
+        posts = [Post.objects.create(creator=user, caption=f'Mug {i}') for i in range(10)]
+        errors, listed = [], set()
+
+        def client_thread(index):
+            rng = random.Random(index)
+            try:
+                for i in range(20):
+                    if i % 2:
+                        writes.coalesced_write(Post.objects.create, creator=user, caption=f'Thread {index}')
+                    else:
+                        post = rng.choice(posts)
+                        writes.coalesced_write(SaleItem.objects.update_or_create, post=post,
+                                               defaults={'price': Decimal(rng.randint(10, 90)), 'is_sold': False})
+                        listed.add(post.pk)
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=client_thread, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(Post.objects.count(), 10 + 8 * 10)
+        self.assertEqual(set(SaleItem.objects.values_list('post_id', flat=True)), listed)
+
+
+class StartupImportTests(TestCase):
+    """Booting Django must not load the media libraries (see core.media)."""
+    HEAVY_MODULES = {'cv2', 'numpy', 'PIL'}
+    # Generous, so slow CI machines pass; OpenCV alone costs more RSS than the headroom
+    IMPORT_TIME_BUDGET = 1.5  # Seconds, as reported by -X importtime
+    RSS_BUDGET = 70 * 2 ** 20
+
+    def test_boot_stays_within_budget(self):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'backend.settings'}
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', BOOT_SCRIPT], cwd=settings.BASE_DIR,
+                                env=env, capture_output=True, text=True, check=True)
+        imported = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line.split('|')
+            imported[name.strip()] = (int(cumulative), not name.startswith('  '))
+
+        self.assertEqual(self.HEAVY_MODULES & {name.split('.')[0] for name in imported}, set())
+        total = sum(cumulative for cumulative, top_level in imported.values() if top_level) / 1e6
+        self.assertLess(total, self.IMPORT_TIME_BUDGET)
+        peak_rss = int(result.stdout)
+        if peak_rss >= 0:  # Linux only
+            self.assertLess(peak_rss, self.RSS_BUDGET)
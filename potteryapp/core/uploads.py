@@ -0,0 +1,129 @@
+"""
+Creating a post with several images and videos in one request.
+
+Per-file work runs on a bounded thread pool: checking the upload, streaming
+it into content-addressed storage (SHA-256 and file I/O both release the
+GIL) and probing MP4/MOV files for faststart. The Post and all of its
+PostMedia rows are then inserted in one transaction, with one bulk_create
+for the media and one for their jobs. Decoding (thumbnails, hashes, renditions) stays in
+the media worker (core.jobs), which has its own thread pool.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Sequence
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+
+from .faststart import is_faststart
+from .models import Post, PostMedia
+from .signals import delete_unreferenced_file, send_bulk_post_save
+
+
+class InvalidUpload(ValueError):
+    """An upload the request has to be rejected for; the message is shown to the client."""
+
+
+@dataclass
+class StoredMedia:
+    media_type: str
+    name: str
+    is_faststart: bool | None = None
+
+
+def media_type_for_upload(upload: UploadedFile) -> str:
+    """The client's content type if it names one, else the file extension."""
+    major = (upload.content_type or '').split('/')[0]
+    if major in (PostMedia.MEDIA_TYPE_IMAGE, PostMedia.MEDIA_TYPE_VIDEO):
+        return major
+    return PostMedia.media_type_for_filename(upload.name)
+
+
+def check_uploads(uploads: Sequence[tuple[str, UploadedFile]]) -> None:
+    """Reject the request up front, before anything is written to storage."""
+    if not uploads:
+        raise InvalidUpload('At least one image or video file is required')
+    if len(uploads) > settings.POST_MAX_MEDIA:
+        raise InvalidUpload(f'A post can have at most {settings.POST_MAX_MEDIA} media')
+    for _, upload in uploads:
+        if not upload.size:
+            raise InvalidUpload(f'{upload.name} is empty')
+        if upload.size > settings.UPLOAD_MAX_SIZE:
+            raise InvalidUpload(f'{upload.name} is larger than {settings.UPLOAD_MAX_SIZE} bytes')
+
+
+def store_upload(media_type: str, upload: UploadedFile) -> StoredMedia:
+    """Write one upload to media storage. Runs on a pool thread; touches no database."""
+    field = PostMedia._meta.get_field('file')
+    name = field.storage.save(field.generate_filename(None, upload.name), upload)
+    stored = StoredMedia(media_type=media_type, name=name)
+    if media_type == PostMedia.MEDIA_TYPE_VIDEO:
+        stored.is_faststart = is_faststart(field.storage.path(name))
+    return stored
+
+
+def store_uploads(uploads: Sequence[tuple[str, UploadedFile]]) -> list[StoredMedia]:
+    """
+    store_upload for every (media type, upload), concurrently, in order. If
+    one fails, the files already stored are discarded before it is raised.
+    """
+    if len(uploads) == 1:
+        return [store_upload(*uploads[0])]
+    workers = min(settings.UPLOAD_PROCESSING_THREADS, len(uploads))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload') as pool:
+        futures = [pool.submit(store_upload, *item) for item in uploads]
+    failed = next((future.exception() for future in futures if future.exception()), None)
+    if failed is not None:
+        discard_stored([future.result() for future in futures if not future.exception()])
+        raise failed
+    return [future.result() for future in futures]
+
+
+def discard_stored(stored: Sequence[StoredMedia]) -> None:
+    """Delete files stored for a post that was never created, unless another row references them."""
+    for item in stored:
+        delete_unreferenced_file(item.name)
+
+
+def create_post(creator, caption: str, stored: Sequence[StoredMedia]) -> Post:
+    """
+    Create a Post with one PostMedia per stored file, in order. Media whose
+    file was already processed for another post copy its results, as in
+    PostMedia.reuse_processing_from_duplicate; the rest get a job each.
+    """
+    from .jobs import enqueue_media_processing_many
+
+    with transaction.atomic():
+        post = Post.objects.create(creator=creator, caption=caption)
+        # The newest processed row per stored file, also when normalization
+        # has since replaced it. One each: a popular file can have thousands,
+        # all read while this transaction holds the write lock
+        originals = {}
+        for name in {item.name for item in stored}:
+            original = PostMedia.objects.filter(
+                PostMedia.same_upload([name]), status=PostMedia.STATUS_READY,
+            ).order_by('-pk').first()
+            if original is not None:
+                originals[name] = original
+        prefetch_related_objects(list(originals.values()), 'renditions')
+
+        media = []
+        copied_from = {}
+        for order, item in enumerate(stored):
+            row = PostMedia(post=post, media_type=item.media_type, file=item.name, order=order,
+                            status=PostMedia.STATUS_PROCESSING, is_faststart=item.is_faststart)
+            if item.name in originals:
+                row.copy_processing_from(originals[item.name])
+                copied_from[order] = originals[item.name]
+            media.append(row)
+        PostMedia.objects.bulk_create(media)
+        send_bulk_post_save(PostMedia, media, created=True)
+        for order, original in copied_from.items():
+            media[order].copy_renditions_from(original)
+            if media[order].file.name != stored[order].name:
+                # Normalized before: the copy just stored is referenced by no row
+                delete_unreferenced_file(stored[order].name)
+        enqueue_media_processing_many([row for row in media if row.status == PostMedia.STATUS_PROCESSING])
+    return post
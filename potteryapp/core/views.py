@@ -1,89 +1,270 @@
-import os
-from django.http import FileResponse, Http404, HttpResponse
+import re
+from io import BytesIO
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.contrib.auth import get_user_model
+from django.utils.cache import get_conditional_response
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 from rest_framework.response import Response
-from drf_spectacular.utils import extend_schema
-from .models import Post, SaleItem, PostMedia
-from .serializers import PostSerializer, ShelfListingSerializer
+from drf_spectacular.utils import OpenApiParameter, OpenApiResponse, extend_schema
+from . import feed_cache, feed_render, metrics, similarity, sync, uploads
+from .writes import coalesced_write
+from .models import Post, SaleItem, PostMedia, UploadSession
+from .pagination import KeysetPagination, ShelfPagination
+from .search import search_posts
+from .storage import BlobMissing
+from .serializers import (
+    ChangesQuerySerializer, PostChangesSerializer, PostSerializer, SearchQuerySerializer, SearchResultSerializer, ShelfItemSerializer, ShelfListingSerializer,
+    ShelfQuerySerializer, SimilarPostSerializer, SimilarQuerySerializer, UploadSessionSerializer,
+)
 
 User = get_user_model()
 
+
+def get_creator(request):
+    """
+    Get or create a default user (for now, use the first user or create one).
+    In production, you'd use request.user if authenticated.
+    """
+    creator = User.objects.first()
+    if not creator:
+        # Create a default user if none exists
+        creator = User.objects.create_user(
+            username='default_user',
+            email='default@example.com',
+            password='default_password'
+        )
+    return creator
+
+
+def metrics_view(request):
+    """
+    This process's request, SQL and feed cache metrics, plus the media
+    worker's exported ones, in Prometheus text format.
+    """
+    return HttpResponse(metrics.render(settings.METRICS_EXPORT_DIR), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def render_cached_posts(rows, request):
+    """
+    Render Post value rows through the fragment cache. Misses go through the
+    fast read path in core.feed_render (one media query for all of them), so
+    fully cached posts cost no queries beyond fetching the rows.
+    """
+    return feed_cache.render_posts(rows, request, lambda missing: feed_render.render_posts(missing, request))
+
+
+async def arender_cached_posts(rows, request):
+    """render_cached_posts() for the async views: async cache calls and media query."""
+    return await feed_cache.arender_posts(rows, request, lambda missing: feed_render.arender_posts(missing, request))
+
+
+def conditional_list(request, etag, respond):
+    """
+    304 Not Modified if the client's If-None-Match has ``etag``, so an
+    unchanged list skips the media query and rendering; otherwise
+    ``respond()`` with the ETag set.
+    """
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        return not_modified
+    response = respond()
+    response['ETag'] = etag
+    return response
+
+
+async def aconditional_list(request, etag, respond):
+    """conditional_list() with an async ``respond``."""
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        return not_modified
+    response = await respond()
+    response['ETag'] = etag
+    return response
+
+
 class PostViewSet(viewsets.ModelViewSet):
     queryset = Post.objects.all()
     serializer_class = PostSerializer
+    pagination_class = KeysetPagination
+    # Newest first; id breaks ties between posts created in the same instant
+    keyset_ordering = ('-created_at', '-id')
+
+    def get_queryset(self):
+        # Fixed query budget: creator and saleitem are joined in, media and
+        # their renditions are one extra IN (...) query each, so a page costs
+        # 3 queries regardless of size (the feed's fast path joins them into 2)
+        return (
+            Post.objects
+            .select_related('creator', 'saleitem')
+            .prefetch_related('media__renditions')
+            .order_by(*self.keyset_ordering)
+        )
+    
+    def render_posts(self, rows):
+        return render_cached_posts(rows, self.request)
+    
+    def list(self, request, *args, **kwargs):
+        rows = feed_render.post_rows(Post.objects.order_by(*self.keyset_ordering))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            etag = feed_cache.list_etag(request, page, self.paginator.next_cursor)
+            return conditional_list(request, etag, lambda: self.get_paginated_response(self.render_posts(page)))
+        rows = list(rows)
+        return conditional_list(request, feed_cache.list_etag(request, rows), lambda: Response(self.render_posts(rows)))
+    
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            rows = list(feed_render.post_rows(Post.objects.filter(pk=kwargs['pk'])))
+        except (TypeError, ValueError):
+            raise Http404
+        if not rows:
+            raise Http404
+        return Response(self.render_posts(rows)[0])
+    
+    @extend_schema(responses={200: OpenApiResponse(description='Feed fragment cache hit/miss counters')})
+    @action(detail=False, methods=['get'], url_path='cache-stats')
+    def cache_stats(self, request):
+        return Response(feed_cache.stats.as_dict())
+    
+    @extend_schema(
+        parameters=[ChangesQuerySerializer],
+        responses={200: PostChangesSerializer, 410: OpenApiResponse(description='Cursor too old: reload the feed')},
+    )
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Posts created, updated and deleted since the ``since`` cursor, oldest
+        change first (see core.sync). Clients keep the returned cursor and
+        sync again while ``has_more``.
+        """
+        query = ChangesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        try:
+            changes = sync.changes_since(params.get('since'), params['limit'])
+        except sync.CursorExpired as e:
+            return Response({'error': str(e)}, status=status.HTTP_410_GONE)
+        posts = self.render_posts(changes.created + changes.updated)
+        return Response({
+            'created': posts[:len(changes.created)],
+            'updated': posts[len(changes.created):],
+            'deleted': changes.deleted,
+            'cursor': changes.cursor.encode() if changes.cursor else None,
+            'has_more': changes.has_more,
+        })
     
+    @extend_schema(parameters=[SearchQuerySerializer], responses=SearchResultSerializer(many=True))
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Ranked full-text search over captions and creator usernames (see core.search)."""
+        query = SearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        hits = search_posts(params['q'], limit=params['limit'], offset=params['offset'])
+        rows = feed_render.post_rows(Post.objects.filter(pk__in=[hit.post_id for hit in hits]))
+        rows_by_id = {row['id']: row for row in rows}
+        hits = [hit for hit in hits if hit.post_id in rows_by_id]
+        posts = self.render_posts([rows_by_id[hit.post_id] for hit in hits])
+        return Response([
+            {
+                'score': hit.score,
+                'caption_highlight': hit.caption,
+                'creator_username_highlight': hit.creator_username,
+                'post': post,
+            }
+            for hit, post in zip(hits, posts)
+        ])
+    
+    @extend_schema(parameters=[SimilarQuerySerializer], responses=SimilarPostSerializer(many=True))
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """Posts whose photos or video thumbnails look like this one's (see core.similarity)."""
+        post = self.get_object()
+        query = SimilarQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        matches = similarity.similar_posts(post.pk, **query.validated_data)
+        rows = feed_render.post_rows(Post.objects.filter(pk__in=[post_id for post_id, _ in matches]))
+        rows_by_id = {row['id']: row for row in rows}
+        matches = [(post_id, distance) for post_id, distance in matches if post_id in rows_by_id]
+        posts = self.render_posts([rows_by_id[post_id] for post_id, _ in matches])
+        return Response([
+            {'distance': distance, 'post': rendered}
+            for (_, distance), rendered in zip(matches, posts)
+        ])
+    
+    @extend_schema(
+        request={'multipart/form-data': {
+            'type': 'object',
+            'properties': {
+                'caption': {'type': 'string'},
+                'media': {'type': 'array', 'items': {'type': 'string', 'format': 'binary'},
+                          'description': 'Images and videos, in display order'},
+                'image': {'type': 'string', 'format': 'binary'},
+                'video': {'type': 'string', 'format': 'binary'},
+            },
+        }},
+        responses={201: PostSerializer, 400: OpenApiResponse(description='No files, too many, or one is too large')},
+    )
     def create(self, request, *args, **kwargs):
         """
-        Handle POST request to create a new post with image or video.
-        Expects multipart/form-data with 'caption' and either 'image' or 'video' fields.
+        Handle POST request to create a new post with images and/or videos.
+        Expects multipart/form-data with 'caption' and one or more 'media' files,
+        in display order; each file's type comes from its content type or
+        extension. The single 'image' or 'video' field is still accepted.
         """
         # Get caption from request data
         caption = request.data.get('caption', '')
         
-        # Get image or video file from request
-        image_file = request.FILES.get('image')
-        video_file = request.FILES.get('video')
-        
-        if not image_file and not video_file:
-            return Response(
-                {'error': 'Image or video file is required'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        # Ordered (media type, file) pairs: 'media' first, then the legacy fields
+        files = [(uploads.media_type_for_upload(f), f) for f in request.FILES.getlist('media')]
+        files += [(PostMedia.MEDIA_TYPE_IMAGE, f) for f in request.FILES.getlist('image')]
+        files += [(PostMedia.MEDIA_TYPE_VIDEO, f) for f in request.FILES.getlist('video')]
+        try:
+            uploads.check_uploads(files)
+        except uploads.InvalidUpload as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Get or create a default user (for now, use the first user or create one)
-        # In production, you'd use request.user if authenticated
         try:
-            creator = User.objects.first()
-            if not creator:
-                # Create a default user if none exists
-                creator = User.objects.create_user(
-                    username='default_user',
-                    email='default@example.com',
-                    password='default_password'
-                )
+            creator = get_creator(request)
         except Exception as e:
             return Response(
                 {'error': f'Failed to get creator: {str(e)}'}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         
-        # Create the Post
-        post = Post.objects.create(
-            creator=creator,
-            caption=caption
-        )
-        
-        # Create the PostMedia for the image or video
-        if image_file:
-            PostMedia.objects.create(
-                post=post,
-                media_type=PostMedia.MEDIA_TYPE_IMAGE,
-                file=image_file,
-                order=0
-            )
-        elif video_file:
-            post_media = PostMedia.objects.create(
-                post=post,
-                media_type=PostMedia.MEDIA_TYPE_VIDEO,
-                file=video_file,
-                order=0
-            )
-            # Refresh from database to get the generated thumbnail
-            # The save() method generates the thumbnail, so we need to refresh
-            post_media.refresh_from_db()
-        
-        # Refresh the post to get updated media with thumbnails
-        # This ensures the media relationship includes the generated thumbnails
-        post.refresh_from_db()
-        
-        # Force reload of media to ensure thumbnails are included
-        list(post.media.all())
+        # Files are stored in parallel, then the Post and every PostMedia are
+        # created in one transaction, shared with other requests' writes.
+        # Thumbnailing happens in the media worker, so new media come back
+        # with status "processing"
+        stored = uploads.store_uploads(files)
+        try:
+            post = coalesced_write(uploads.create_post, creator, caption, stored)
+        except BlobMissing:
+            # A post sharing one of the files was deleted meanwhile, and took the file
+            # with it: storing the uploads again writes it back
+            uploads.discard_stored(stored)
+            stored = uploads.store_uploads(files)
+            try:
+                post = coalesced_write(uploads.create_post, creator, caption, stored)
+            except Exception:
+                uploads.discard_stored(stored)
+                raise
+        except Exception:
+            uploads.discard_stored(stored)
+            raise
         
         # Return the created post
-        serializer = PostSerializer(post, context={'request': request})
+        serializer = PostSerializer(self.get_queryset().get(pk=post.pk), context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     # 1. Add this decorator to tell schema.yaml what to expect
@@ -100,8 +281,10 @@ class PostViewSet(viewsets.ModelViewSet):
         if serializer.is_valid():
             price = serializer.validated_data['price']
             
-            # Create or update the sale item
-            SaleItem.objects.update_or_create(
+            # Create or update the sale item. get_object() joined in the old
+            # row, so attach the saved one before serializing
+            post.saleitem, _ = coalesced_write(
+                SaleItem.objects.update_or_create,
                 post=post,
                 defaults={'price': price, 'is_sold': False}
             )
@@ -112,66 +295,214 @@ class PostViewSet(viewsets.ModelViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-def serve_media_with_range(request, path):
+class ShelfViewSet(viewsets.ReadOnlyModelViewSet):
     """
-    Serve media files with proper HTTP range request support for video streaming.
-    This is required for AVPlayer to work correctly with video files.
+    The marketplace: unsold items, filterable by price range and creator and
+    sorted by recency or price. Every ordering is a range scan over one of
+    SaleItem's partial indexes on unsold items (WHERE is_sold = false), on
+    price or on post_created_at, with keyset pagination on top. The creator
+    filter goes through the joined post.
     """
-    file_path = os.path.join(settings.MEDIA_ROOT, path)
-    
-    if not os.path.exists(file_path):
-        raise Http404("File not found")
+    serializer_class = ShelfItemSerializer
+    pagination_class = ShelfPagination
+    # ?ordering= value -> keyset ordering; id breaks ties
+    KEYSET_ORDERINGS = {
+        '-created_at': ('-post_created_at', '-id'),
+        'created_at': ('post_created_at', 'id'),
+        'price': ('price', 'id'),
+        '-price': ('-price', '-id'),
+    }
     
-    file_size = os.path.getsize(file_path)
+    def get_query_params(self) -> dict:
+        if not hasattr(self, '_query_params'):
+            query = ShelfQuerySerializer(data=self.request.query_params)
+            query.is_valid(raise_exception=True)
+            self._query_params = query.validated_data
+        return self._query_params
     
-    # Get the range header
-    range_header = request.META.get('HTTP_RANGE', '').strip()
+    @property
+    def keyset_ordering(self) -> tuple[str, ...]:
+        return self.KEYSET_ORDERINGS[self.get_query_params()['ordering']]
     
-    if range_header:
-        # Parse range header (e.g., "bytes=0-1023")
-        range_match = range_header.replace('bytes=', '').split('-')
-        start = int(range_match[0]) if range_match[0] else 0
-        end = int(range_match[1]) if range_match[1] and range_match[1] else file_size - 1
-        
-        # Ensure valid range
-        if start >= file_size or end >= file_size or start > end:
-            return HttpResponse(status=416)  # Range Not Satisfiable
+    def get_queryset(self):
+        queryset = SaleItem.objects.filter(is_sold=False)
+        if self.action != 'list':
+            return queryset.select_related('post__creator').prefetch_related('post__media__renditions')
         
-        content_length = end - start + 1
-        
-        # Open file and seek to start position
-        file_handle = open(file_path, 'rb')
-        file_handle.seek(start)
-        
-        # Create response with partial content
-        response = FileResponse(
-            file_handle,
-            status=206,  # Partial Content
-            content_type='application/octet-stream'
+        params = self.get_query_params()
+        if 'min_price' in params:
+            queryset = queryset.filter(price__gte=params['min_price'])
+        if 'max_price' in params:
+            queryset = queryset.filter(price__lte=params['max_price'])
+        if 'creator' in params:
+            queryset = queryset.filter(post__creator_id=params['creator'])
+        return queryset.order_by(*self.keyset_ordering)
+    
+    @extend_schema(parameters=[ShelfQuerySerializer])
+    def list(self, request, *args, **kwargs):
+        items = self.paginate_queryset(
+            self.get_queryset().values('id', 'price', 'is_sold', 'post_id', 'post_created_at')
         )
-        response['Content-Length'] = content_length
-        response['Content-Range'] = f'bytes {start}-{end}/{file_size}'
-        response['Accept-Ranges'] = 'bytes'
-        
-        return response
-    else:
-        # No range header, serve entire file
-        file_handle = open(file_path, 'rb')
-        response = FileResponse(file_handle)
-        
-        # Set content type based on file extension
-        if path.lower().endswith('.mp4'):
-            response['Content-Type'] = 'video/mp4'
-        elif path.lower().endswith('.mov'):
-            response['Content-Type'] = 'video/quicktime'
-        elif path.lower().endswith(('.jpg', '.jpeg')):
-            response['Content-Type'] = 'image/jpeg'
-        elif path.lower().endswith('.png'):
-            response['Content-Type'] = 'image/png'
-        else:
-            response['Content-Type'] = 'application/octet-stream'
+        rows = feed_render.post_rows(Post.objects.filter(pk__in=[item['post_id'] for item in items]))
+        rows_by_id = {row['id']: row for row in rows}
+        # A post deleted between the two queries takes its sale item with it
+        items = [item for item in items if item['post_id'] in rows_by_id]
+        post_rows = [rows_by_id[item['post_id']] for item in items]
+        # Price and is_sold changes bump the post's version, so posts' versions cover the items too
+        etag = feed_cache.list_etag(request, post_rows, self.paginator.next_cursor,
+                                    *(item['id'] for item in items))
+        return conditional_list(request, etag, lambda: self.render_shelf(items, post_rows))
+    
+    def render_shelf(self, items, post_rows):
+        posts = render_cached_posts(post_rows, self.request)
+        # Same shape and formatting as ShelfItemSerializer
+        results = [
+            {
+                'id': item['id'],
+                'price': feed_render.format_price(item['price']),
+                'is_sold': item['is_sold'],
+                'post': post,
+            }
+            for item, post in zip(items, posts)
+        ]
+        return self.get_paginated_response(results)
+
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadSessionViewSet(viewsets.ModelViewSet):
+    """
+    Resumable uploads for large videos:
+
+    1. ``POST /api/uploads/`` with filename, total_size (and optionally caption, media_type)
+    2. ``PUT /api/uploads/{id}/chunk/`` with the raw bytes and ``Content-Range: bytes start-end/total``
+       (chunks may arrive in any order or be retried)
+    3. ``GET /api/uploads/{id}/`` to see ``missing_ranges`` / ``next_offset`` after a dropped connection
+    4. ``POST /api/uploads/{id}/finalize/`` to create the Post
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    http_method_names = ['get', 'post', 'put', 'delete', 'head', 'options']
+
+    def perform_create(self, serializer):
+        UploadSession.purge_expired()
+        session = serializer.save(creator=get_creator(self.request))
+        session.allocate()
+
+    def perform_destroy(self, instance):
+        instance.discard()
+
+    def update(self, request, *args, **kwargs):
+        return Response({'error': 'Use the chunk action to upload bytes'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    @extend_schema(
+        request={'application/octet-stream': {'type': 'string', 'format': 'binary'}},
+        parameters=[OpenApiParameter('Content-Range', location=OpenApiParameter.HEADER, required=True,
+                                     description='bytes start-end/total')],
+        responses={200: UploadSessionSerializer, 400: OpenApiResponse(description='Bad range or incomplete chunk'),
+                   409: OpenApiResponse(description='Upload already finalized')},
+    )
+    @action(detail=True, methods=['put'])
+    def chunk(self, request, pk=None):
+        session = self.get_object()
+        if session.status != UploadSession.STATUS_OPEN:
+            return Response({'error': 'Upload already finalized'}, status=status.HTTP_409_CONFLICT)
         
-        response['Content-Length'] = file_size
-        response['Accept-Ranges'] = 'bytes'
+        match = CONTENT_RANGE_RE.match(request.headers.get('Content-Range', '').strip())
+        if not match:
+            return Response({'error': 'Content-Range: bytes start-end/total header is required'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        start, end, total = (int(g) for g in match.groups())
+        length = end - start + 1
+        if total != session.total_size or end < start or end >= total:
+            return Response({'error': f'Range must lie within 0-{session.total_size - 1}/{session.total_size}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if length > settings.UPLOAD_MAX_CHUNK_SIZE:
+            return Response({'error': f'Chunks are limited to {settings.UPLOAD_MAX_CHUNK_SIZE} bytes'},
+                            status=status.HTTP_400_BAD_REQUEST)
         
-        return response
\ No newline at end of file
+        # Read the raw request stream: nothing is parsed or buffered in memory
+        written = session.write_chunk(start, request.stream or BytesIO(), length)
+        data = UploadSessionSerializer(session, context={'request': request}).data
+        if written < length:
+            data['error'] = f'Chunk incomplete: received {written} of {length} bytes'
+            return Response(data, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data)
+
+    @extend_schema(
+        request=None,
+        responses={201: PostSerializer, 400: OpenApiResponse(description='Upload incomplete'),
+                   409: OpenApiResponse(description='Upload already finalized')},
+    )
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        session = self.get_object()
+        if session.status != UploadSession.STATUS_OPEN:
+            return Response({'error': 'Upload already finalized'}, status=status.HTTP_409_CONFLICT)
+        missing = session.missing_ranges()
+        if missing:
+            return Response({'error': 'Upload incomplete', 'missing_ranges': missing},
+                            status=status.HTTP_400_BAD_REQUEST)
+        post = session.finalize()
+        if post is None:
+            # Another request finalized it since the check above
+            return Response({'error': 'Upload already finalized'}, status=status.HTTP_409_CONFLICT)
+        post = PostViewSet().get_queryset().get(pk=post.pk)
+        return Response(PostSerializer(post, context={'request': request}).data, status=status.HTTP_201_CREATED)
+
+
+# Native async reads of the feed, routed in place of PostViewSet's list and
+# retrieve when settings.ASYNC_VIEWS is on (see backend/asgi.py). They run the
+# same queries, cache lookups and ETag logic and return the same bytes; only
+# JSON is rendered, the browsable API stays on the sync views.
+
+def json_response(data, status=200) -> HttpResponse:
+    # What DRF's Response renders to with the default JSONRenderer and no indent
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+async def post_list_async(request):
+    """GET /api/posts/ (PostViewSet.list) on the async ORM."""
+    paginator = PostViewSet.pagination_class()
+    rows = feed_render.post_rows(Post.objects.order_by(*PostViewSet.keyset_ordering))
+    try:
+        page = await paginator.apaginate_queryset(rows, Request(request), PostViewSet)
+    except NotFound as e:
+        return json_response({'detail': e.detail}, status=e.status_code)
+
+    if page is not None:
+        async def respond():
+            posts = await arender_cached_posts(page, request)
+            return json_response(paginator.get_paginated_response(posts).data)
+        return await aconditional_list(request, feed_cache.list_etag(request, page, paginator.next_cursor), respond)
+
+    rows = [row async for row in rows]
+
+    async def respond():
+        return json_response(await arender_cached_posts(rows, request))
+    return await aconditional_list(request, feed_cache.list_etag(request, rows), respond)
+
+
+async def post_detail_async(request, pk):
+    """GET /api/posts/<pk>/ (PostViewSet.retrieve) on the async ORM."""
+    rows = [row async for row in feed_render.post_rows(Post.objects.filter(pk=pk))]
+    if not rows:
+        error = NotFound()
+        return json_response({'detail': error.detail}, status=error.status_code)
+    return json_response((await arender_cached_posts(rows, request))[0])
+
+
+def with_async_reads(read, fallback):
+    """
+    One view for a URL: GET and HEAD go to the async ``read`` view, other
+    methods to ``fallback`` (a sync DRF view) in the request's sync thread.
+    """
+    fallback = sync_to_async(fallback)
+
+    async def view(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            return await read(request, *args, **kwargs)
+        return await fallback(request, *args, **kwargs)
+    # The DRF views exempt themselves; the wrapper is what CsrfViewMiddleware sees
+    return csrf_exempt(view)
@@ -0,0 +1,183 @@
+"""
+Group commit for small writes from concurrent requests.
+
+SQLite admits one writer at a time, and every transaction pays for taking
+the write lock and for its commit. Under concurrent uploads each request's
+transaction queues for the lock separately. ``coalesced_write`` hands the
+write to one writer thread per process instead. That thread runs whatever
+has queued up while it committed the previous batch, one savepoint per
+write, in a single transaction:
+
+- a write that raises only rolls back its own savepoint, and the caller
+  gets the exception. If the COMMIT fails (a deferred foreign key), the
+  writes are retried in a transaction each;
+- callers get their result only after the shared COMMIT, so they never act
+  on data that could still roll back;
+- an idle writer starts on a new write at once, so batching adds no delay
+  when there is no contention;
+- ``transaction.on_commit`` callbacks the writes register (eager media
+  processing, blob deletes) run on a small pool after the COMMIT, not on
+  the writer thread, so they never hold up the next batch;
+- a caller waits at most WRITE_TIMEOUT for the writer to start its write.
+  If it hasn't, the write is withdrawn and run directly on the caller's
+  thread, and a new writer thread replaces the stuck one. A writer thread
+  that died is replaced too.
+
+Writes run inline when the caller is already in a transaction (it can't
+join another thread's), on the writer thread itself, and with
+``DB_WRITE_COALESCING`` off.
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from typing import Any, Callable, TypeVar
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Most writes committed together; more wait for the next transaction
+MAX_BATCH = 64
+# Seconds a caller waits for the writer thread to start its write before writing directly
+WRITE_TIMEOUT = 30
+# Threads running the on_commit callbacks of coalesced writes
+ON_COMMIT_THREADS = 2
+
+
+@dataclass
+class PendingWrite:
+    fn: Callable[..., Any]
+    args: tuple
+    kwargs: dict
+    # The submitting thread's connection.execute_wrappers (core.middleware's
+    # QueryRecorder), so its request is still charged for the SQL it caused
+    execute_wrappers: list = field(default_factory=list)
+    future: Future = field(default_factory=Future)
+
+
+class WriteCoalescer:
+    """A writer thread committing queued writes in shared transactions."""
+
+    def __init__(self, max_batch: int = MAX_BATCH):
+        self.max_batch = max_batch
+        self.queue: queue.SimpleQueue[PendingWrite] = queue.SimpleQueue()
+        self.on_commit_pool = ThreadPoolExecutor(max_workers=ON_COMMIT_THREADS, thread_name_prefix='db-on-commit')
+        self.thread = threading.Thread(target=self.run, name='db-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, fn: Callable[..., T], *args, **kwargs) -> 'Future[T]':
+        write = PendingWrite(fn, args, kwargs, list(connection.execute_wrappers))
+        self.queue.put(write)
+        return write.future
+
+    def next_batch(self) -> list[PendingWrite]:
+        batch = [self.queue.get()]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self) -> None:
+        while True:
+            # Skips writes whose callers gave up waiting and wrote them directly
+            batch = [write for write in self.next_batch() if write.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            connection.close_if_unusable_or_obsolete()
+            try:
+                outcomes = self.commit(batch)
+            except Exception as exc:
+                # BEGIN or COMMIT failed, so nothing was written. Foreign keys
+                # are only checked at COMMIT: commit each write on its own so
+                # only the one that broke a constraint fails
+                logger.warning('Coalesced transaction of %d writes failed: %s', len(batch), exc)
+                outcomes = [(None, exc)] if len(batch) == 1 else [self.commit_alone(write) for write in batch]
+            metrics.DB_WRITE_BATCH_SIZE.observe((), len(batch))
+            for write, (result, exc) in zip(batch, outcomes):
+                if exc is None:
+                    write.future.set_result(result)
+                else:
+                    write.future.set_exception(exc)
+
+    def commit(self, batch: list[PendingWrite]) -> list[tuple[Any, Exception | None]]:
+        outcomes = []
+        with transaction.atomic():
+            for write in batch:
+                try:
+                    with ExitStack() as stack:
+                        for wrapper in write.execute_wrappers:
+                            stack.enter_context(connection.execute_wrapper(wrapper))
+                        with transaction.atomic():
+                            outcomes.append((write.fn(*write.args, **write.kwargs), None))
+                except Exception as exc:
+                    outcomes.append((None, exc))
+            # Django would run these on this thread at COMMIT; hand them to the pool instead
+            callbacks = [hook[1] for hook in connection.run_on_commit]
+            connection.run_on_commit = []
+        for callback in callbacks:
+            self.on_commit_pool.submit(run_on_commit_callback, callback)
+        return outcomes
+
+    def commit_alone(self, write: PendingWrite) -> tuple[Any, Exception | None]:
+        try:
+            return self.commit([write])[0]
+        except Exception as exc:
+            return None, exc
+
+
+def run_on_commit_callback(callback: Callable[[], Any]) -> None:
+    connection.close_if_unusable_or_obsolete()
+    try:
+        callback()
+    except Exception:
+        logger.exception('on_commit callback %r of a coalesced write failed', callback)
+
+
+_coalescer: WriteCoalescer | None = None
+_coalescer_lock = threading.Lock()
+
+
+def get_coalescer(replace: WriteCoalescer | None = None) -> WriteCoalescer:
+    """The process's coalescer, started on first use and again if its thread died or is ``replace``'s."""
+    global _coalescer
+    if _coalescer is None or _coalescer is replace or not _coalescer.thread.is_alive():
+        with _coalescer_lock:
+            if _coalescer is None or _coalescer is replace or not _coalescer.thread.is_alive():
+                _coalescer = WriteCoalescer()
+    return _coalescer
+
+
+def coalesced_write(fn: Callable[..., T], *args, **kwargs) -> T:
+    """
+    ``fn(*args, **kwargs)`` run in a transaction, possibly shared with other
+    threads' writes; returns its result (or raises its exception) once
+    committed. Waits at most WRITE_TIMEOUT for the writer thread to start
+    it, then writes directly.
+    """
+    if (not getattr(settings, 'DB_WRITE_COALESCING', False) or connection.in_atomic_block
+            or threading.current_thread() is getattr(_coalescer, 'thread', None)):
+        with transaction.atomic():
+            return fn(*args, **kwargs)
+    coalescer = get_coalescer()
+    future = coalescer.submit(fn, *args, **kwargs)
+    try:
+        return future.result(timeout=WRITE_TIMEOUT)
+    except TimeoutError:
+        if not future.cancel():
+            # Already running on the writer: it may still commit, so don't run it twice
+            raise
+    logger.warning('Writer thread did not start a write within %ss; replacing it and writing directly',
+                   WRITE_TIMEOUT)
+    get_coalescer(replace=coalescer)
+    with transaction.atomic():
+        return fn(*args, **kwargs)